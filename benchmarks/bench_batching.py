@@ -0,0 +1,105 @@
+"""
+Load test of the detection service with and without micro-batching.
+
+Each simulated player sends a frame, waits for its landmarks and sends the
+next one, at most --fps times a second, like the page's annotation loop.
+For every player count the run is repeated with batching off
+(max batch size 1) and on, and reports the frames served per second, the
+frames refused with DetectorBusy, end-to-end latency and mean batch size.
+
+    python benchmarks/bench_batching.py [--players 10 100 500] [--duration 10]
+
+Without --image a synthetic frame at the decoder's target width is used, so
+MediaPipe runs its palm detector on every frame and finds no hand.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game.detection import DetectionService, DetectorBusy  # noqa: E402
+
+
+def synthetic_frame():
+    rng = np.random.default_rng(0)
+    img = (rng.random((240, 320, 3)) * 255).astype(np.uint8)
+    return cv2.GaussianBlur(img, (31, 31), 10)
+
+
+async def player(service, img, fps, deadline, latencies, refused):
+    interval = 1 / fps
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            await service.adetect(img)
+            latencies.append(time.perf_counter() - started)
+        except DetectorBusy:
+            refused.append(started)
+        await asyncio.sleep(max(interval - (time.perf_counter() - started), 0))
+
+
+async def run(service, img, players, fps, duration):
+    latencies, refused = [], []
+    batches, batched = service._batch_count, service._batched_frames
+    # Stagger the players over one frame interval, as real clients would be.
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def staggered(i):
+        await asyncio.sleep(i / players / fps)
+        await player(service, img, fps, deadline, latencies, refused)
+
+    await asyncio.gather(*(staggered(i) for i in range(players)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'served/s': len(latencies) / elapsed,
+        'refused/s': len(refused) / elapsed,
+        'p50 ms': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p95 ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        'batch': (service._batched_frames - batched) / max(service._batch_count - batches, 1) or 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--players', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--fps', type=float, default=10, help='frames a second each player sends at most')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--window-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--image', help='frame to send instead of a synthetic one')
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image) if args.image else synthetic_frame()
+    print(f"{args.workers} workers, max pending {args.max_pending}, {args.fps:g} fps per player, "
+          f"{args.duration:g}s per run, frame {img.shape[1]}x{img.shape[0]}")
+    print(f"{'players':>7} {'batching':>12} {'served/s':>9} {'refused/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'batch':>6}")
+    for players in args.players:
+        for max_batch in (1, args.max_batch):
+            service = DetectionService(
+                workers=args.workers,
+                max_pending=args.max_pending,
+                batch_window=args.window_ms / 1000,
+                batch_max_size=max_batch,
+            )
+            # Start the workers and load their graphs outside the timed run.
+            asyncio.run(run(service, img, min(players, args.workers), 1, 1))
+            result = asyncio.run(run(service, img, players, args.fps, args.duration))
+            label = 'off' if max_batch == 1 else f"{args.window_ms:g}ms/{max_batch}"
+            print(f"{players:>7} {label:>12} {result['served/s']:>9.1f} {result['refused/s']:>9.1f} "
+                  f"{result['p50 ms']:>8.1f} {result['p95 ms']:>8.1f} {result['batch']:>6.2f}")
+            service._executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Per-request latency and peak memory of reading a posted frame: the original
+json.loads of request.body, splitting the image out of request.body, and
+streaming the body through read_image_payload into the reused buffer.
+
+    python benchmarks/bench_body.py [--image webcam.jpg] [--repeat 200]
+
+Each request is built with Django's RequestFactory, so the body is read
+through the same stream a view sees. Timings and peak memory (what
+tracemalloc sees allocated while one request is parsed) stop at the JPEG
+bytes; decoding them is the same for every parser.
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rps.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import RequestFactory  # noqa: E402
+
+from game.imaging import read_image_payload, split_image_payload  # noqa: E402
+
+
+def legacy(request):
+    data = json.loads(request.body)
+    return data, base64.b64decode(data.get('image', '').split(',')[1])
+
+
+def buffered(request):
+    data, image = split_image_payload(request.body)
+    return data, binascii.a2b_base64(image)
+
+
+def streamed(request):
+    return read_image_payload(request.read, int(request.META.get('CONTENT_LENGTH') or 0))
+
+
+def measure(parse, new_request, repeat):
+    """Mean ms per request and the largest peak of Python allocations, in bytes."""
+    parse(new_request())
+    requests = [new_request() for _ in range(repeat)]
+    start = time.perf_counter()
+    for request in requests:
+        parse(request)
+    ms = (time.perf_counter() - start) / repeat * 1000
+
+    peak = 0
+    tracemalloc.start()
+    for _ in range(20):
+        request = new_request()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        parse(request)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return ms, peak
+
+
+def synthetic_frame(width, height):
+    rng = np.random.default_rng(0)
+    img = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (31, 31), 10)
+    # A little sensor noise, so the JPEG is about the size of a webcam frame.
+    return np.clip(img + rng.normal(0, 4, img.shape), 0, 255).astype(np.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--image', help='JPEG to use instead of a synthetic frame')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1280x720'],
+                        help='synthetic frame sizes, ignored with --image')
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            jpegs = [f.read()]
+    else:
+        jpegs = []
+        for size in args.sizes:
+            width, height = map(int, size.split('x'))
+            jpegs.append(cv2.imencode('.jpg', synthetic_frame(width, height), [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes())
+
+    factory = RequestFactory()
+    print(f"{'body bytes':>10}  {'parser':<9} {'ms':>7} {'peak bytes':>11}")
+    for jpeg in jpegs:
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+        body = json.dumps({'image': data_url, 'session_id': 'bench'}).encode()
+
+        def new_request():
+            return factory.post('/api/analyze_frame/', body, content_type='application/json')
+
+        for name, parse in (('legacy', legacy), ('buffered', buffered), ('streamed', streamed)):
+            ms, peak = measure(parse, new_request, args.repeat)
+            print(f"{len(body):>10,}  {name:<9} {ms:>7.3f} {peak:>11,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Per-stage timings of the frame decode path, before and after the fast path:
+body parsing and base64, JPEG decode at full and reduced scale, shipping the
+frame to a detector process, and hand detection on the full frame, the
+reduced frame and an ROI crop.
+
+    python benchmarks/bench_decode.py [--image webcam.jpg] [--repeat 200]
+
+Without --image a synthetic 640x480 frame is encoded at the browser's
+quality (0.5), so detection timings are for a frame with no hand in it.
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import pickle
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game.imaging import decode_jpeg, split_image_payload  # noqa: E402
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def synthetic_frame():
+    rng = np.random.default_rng(0)
+    img = (rng.random((480, 640, 3)) * 255).astype(np.uint8)
+    return cv2.GaussianBlur(img, (31, 31), 10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--image', help='JPEG to use instead of a synthetic frame')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--target-width', type=int, default=320)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            jpeg = f.read()
+    else:
+        jpeg = cv2.imencode('.jpg', synthetic_frame(), [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes()
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+    body = json.dumps({'image': data_url, 'session_id': 'bench'}).encode()
+
+    def old_parse():
+        data = json.loads(body)
+        return base64.b64decode(data.get('image', '').split(',')[1])
+
+    def new_parse():
+        _, image = split_image_payload(body)
+        return binascii.a2b_base64(image)
+
+    rows = [
+        ('parse + base64', timed(old_parse, args.repeat), timed(new_parse, args.repeat)),
+        ('jpeg decode', timed(lambda: decode_jpeg(jpeg), args.repeat),
+         timed(lambda: decode_jpeg(jpeg, args.target_width), args.repeat)),
+    ]
+
+    full = decode_jpeg(jpeg)
+    reduced = decode_jpeg(jpeg, args.target_width)
+    height, width = reduced.shape[:2]
+    side = min(height, width) // 2
+    crop = reduced[(height - side) // 2:(height + side) // 2, (width - side) // 2:(width + side) // 2]
+
+    rows.append(('pickle to worker', timed(lambda: pickle.loads(pickle.dumps(full)), args.repeat),
+                 timed(lambda: pickle.loads(pickle.dumps(reduced)), args.repeat)))
+
+    from cvzone.HandTrackingModule import HandDetector
+    detector = HandDetector(maxHands=1, detectionCon=0.8)
+    repeat = max(args.repeat // 4, 10)
+    rows.append(('detect (reduced frame)', timed(lambda: detector.findHands(full.copy(), draw=False), repeat),
+                 timed(lambda: detector.findHands(reduced.copy(), draw=False), repeat)))
+    rows.append(('detect (ROI crop)', timed(lambda: detector.findHands(full.copy(), draw=False), repeat),
+                 timed(lambda: detector.findHands(np.ascontiguousarray(crop), draw=False), repeat)))
+
+    print(f"frame {full.shape[1]}x{full.shape[0]} ({len(jpeg):,} byte JPEG), decoded to "
+          f"{width}x{height}, ROI crop {side}x{side}")
+    print(f"{'stage':<24} {'before ms':>10} {'after ms':>10}")
+    for stage, before, after in rows:
+        print(f"{stage:<24} {before:>10.3f} {after:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Bytes per response and encode time of annotated images, across JPEG
+quality, scale and response format (JSON data URL, raw image/jpeg and
+multipart/form-data), against the old full-quality data URL.
+
+    python benchmarks/bench_encode.py [--image webcam.jpg] [--repeat 200]
+
+The frame goes through the same reduced decode as a posted frame
+(--target-width), then gets a hand-like overlay drawn on it. Without
+--image a synthetic 640x480 frame is used.
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rps.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.http import JsonResponse  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from game.imaging import decode_jpeg  # noqa: E402
+from game.views import _annotated_image_response  # noqa: E402
+
+
+def timed(fn, repeat):
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def synthetic_frame():
+    rng = np.random.default_rng(0)
+    img = (rng.random((480, 640, 3)) * 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (31, 31), 10)
+    noise = rng.normal(0, 4, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def annotate(img):
+    """Draws something like cvzone's hand overlay: a bbox and 21 joined points."""
+    height, width = img.shape[:2]
+    rng = np.random.default_rng(1)
+    points = (rng.random((21, 2)) * [width / 2, height / 2] + [width / 4, height / 4]).astype(int)
+    cv2.rectangle(img, tuple(points.min(0) - 20), tuple(points.max(0) + 20), (255, 0, 255), 2)
+    for a, b in zip(points[:-1], points[1:]):
+        cv2.line(img, tuple(a), tuple(b), (255, 255, 255), 2)
+    for point in points:
+        cv2.circle(img, tuple(point), 4, (255, 0, 255), cv2.FILLED)
+    return img
+
+
+def legacy_response(img):
+    _, buffer = cv2.imencode('.jpg', img)
+    return JsonResponse({'annotated_image': f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--image', help='JPEG to use instead of a synthetic frame')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--target-width', type=int, default=320)
+    parser.add_argument('--qualities', type=int, nargs='+', default=[95, 80, 70, 50])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5])
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            jpeg = f.read()
+    else:
+        jpeg = cv2.imencode('.jpg', synthetic_frame(), [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes()
+    img = annotate(decode_jpeg(jpeg, args.target_width))
+    height, width = img.shape[:2]
+
+    print(f"annotated frame {width}x{height}, {args.repeat} responses each")
+    print(f"{'quality':>7} {'scale':>5} {'format':<9} {'bytes':>8} {'ms':>6}")
+    response, ms = timed(lambda: legacy_response(img), args.repeat)
+    print(f"{'legacy':>7} {1.0:>5} {'data_url':<9} {len(response.content):>8,} {ms:>6.2f}")
+    for quality in args.qualities:
+        for scale in args.scales:
+            with override_settings(ANNOTATED_JPEG_QUALITY=quality, ANNOTATED_IMAGE_SCALE=scale):
+                for image_format in ('data_url', 'jpeg', 'multipart'):
+                    response, ms = timed(lambda: _annotated_image_response({'winner': 'tie'}, img, image_format),
+                                         args.repeat)
+                    print(f"{quality:>7} {scale:>5} {image_format:<9} {len(response.content):>8,} {ms:>6.2f}")
+
+
+if __name__ == '__main__':
+    main()
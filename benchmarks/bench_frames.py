@@ -0,0 +1,270 @@
+"""
+End-to-end benchmark of the frame API through the ASGI app, in process.
+
+Virtual clients post frames to /api/annotate_only/ and /api/analyze_frame/
+back to back, each with its own session, at the given concurrency. Before
+each analyze_frame request a client opens a round at /api/round/, outside
+the timed part, and sends its token as the page does. Each client sends its
+session in X-Session-Id, so it has its own admission token bucket, and after
+a 429 it waits the next_poll_ms it was given, like the page. For every
+endpoint and concurrency it reports requests/s, p50/p95/p99 latency,
+non-200 responses, polls shed with a 429, CPU and RSS of the web process and
+of each detector worker, and the mean and p95 of every stage from the
+Server-Timing header (decode, detect, gesture, ai, encode). Shed polls are
+left out of the rate, the latencies and the stages.
+
+    python benchmarks/bench_frames.py [--corpus DIR] [--concurrency 1 8 32] [--requests 200]
+
+The corpus is a directory of recorded webcam JPEGs, one sub-directory per
+label: rock/, paper/, scissors/ and no_hand/. Without one, synthetic frames
+with no hand are used, so analyze_frame stops after gesture classification
+and the ai and encode stages do not show up.
+
+--save writes the results as JSON; --baseline compares a run against such
+a file and exits with status 1 when any p95 latency is more than
+--tolerance slower, so the script can gate a deploy.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rps.settings')
+os.environ['SERVER_TIMING'] = 'True'
+os.environ.setdefault('ALLOWED_HOSTS', 'localhost')
+
+ENDPOINTS = ('/api/annotate_only/', '/api/analyze_frame/')
+ROUND_ENDPOINT = '/api/analyze_frame/'
+LABELS = ('rock', 'paper', 'scissors', 'no_hand')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def load_corpus(path):
+    """Returns ``[(label, jpeg bytes), ...]`` from ``path``/<label>/*.jpg."""
+    frames = []
+    for label in LABELS:
+        directory = os.path.join(path, label)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    frames.append((label, f.read()))
+    return frames
+
+
+def synthetic_corpus(count=16):
+    frames = []
+    for seed in range(count):
+        rng = np.random.default_rng(seed)
+        img = cv2.GaussianBlur((rng.random((480, 640, 3)) * 128).astype(np.uint8), (31, 31), 10)
+        # Distinct brightness per frame so the annotate path never reuses a result.
+        img += np.uint8(seed * 127 // count)
+        frames.append(('no_hand', cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes()))
+    return frames
+
+
+def process_usage(pid):
+    """Returns ``(cpu seconds, rss bytes)`` for a process, from /proc."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except OSError:
+        return 0.0, 0
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+async def post(app, path, body, headers=()):
+    """Sends one POST through the ASGI app; returns ``(status, headers, body)``."""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'POST', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())] + list(headers),
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    received = False
+    response = {'body': b''}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {k.decode().lower(): v.decode() for k, v in message['headers']}
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    await app(scope, receive, send)
+    return response['status'], response['headers'], response['body']
+
+
+async def open_round(app, session_id):
+    """The X-Round-Token header for a new round of ``session_id``."""
+    _, _, body = await post(app, '/api/round/', json.dumps({'session_id': session_id}).encode())
+    return [(b'x-round-token', json.loads(body)['token'].encode())]
+
+
+def percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+async def run(app, path, frames, concurrency, requests):
+    from django.conf import settings
+
+    from game.timing import parse_server_timing
+
+    latencies, stages, errors, shed = [], {}, 0, 0
+    remaining = requests
+
+    async def client(offset):
+        nonlocal remaining, errors, shed
+        session_id = uuid.uuid4().hex
+        i = offset
+        while remaining > 0:
+            remaining -= 1
+            _, jpeg = frames[i % len(frames)]
+            i += 1
+            body = json.dumps({
+                'image': 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode(),
+                'session_id': session_id,
+            }).encode()
+            headers = [(b'x-session-id', session_id.encode())]
+            if path == ROUND_ENDPOINT and settings.ROUND_TOKENS:
+                headers += await open_round(app, session_id)
+            started = time.perf_counter()
+            status, headers, content = await post(app, path, body, headers)
+            if status == 429:
+                # Turned away before decoding: not a timing of the frame path.
+                shed += 1
+                await asyncio.sleep(json.loads(content)['next_poll_ms'] / 1000)
+                continue
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            for name, seconds in parse_server_timing(headers.get('server-timing', '')).items():
+                stages.setdefault(name, []).append(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': errors,
+        'shed': shed,
+        'elapsed': elapsed,
+        'stages': {
+            name: {'mean_ms': sum(v) / len(v) * 1000, 'p95_ms': percentile(sorted(v), 0.95) * 1000}
+            for name, v in stages.items()
+        },
+    }
+
+
+def measure(app, path, frames, concurrency, requests, pids):
+    before = {pid: process_usage(pid)[0] for pid in pids.values()}
+    result = asyncio.run(run(app, path, frames, concurrency, requests))
+    result['processes'] = {}
+    for name, pid in pids.items():
+        cpu, rss = process_usage(pid)
+        result['processes'][name] = {
+            'cpu_percent': (cpu - before[pid]) / result['elapsed'] * 100,
+            'rss_mb': rss / 2**20,
+        }
+    return result
+
+
+def report(path, concurrency, result):
+    from game.timing import STAGES
+
+    print(f"\n{path}  concurrency {concurrency}")
+    print(f"  {result['requests_per_s']:.1f} req/s  p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  "
+          f"p99 {result['p99_ms']:.1f} ms  non-200 {result['errors']}  shed 429 {result['shed']}")
+    for name in STAGES:
+        if name in result['stages']:
+            s = result['stages'][name]
+            print(f"  {name:<8} mean {s['mean_ms']:7.2f} ms  p95 {s['p95_ms']:7.2f} ms")
+    for name, p in result['processes'].items():
+        print(f"  {name:<10} cpu {p['cpu_percent']:5.1f}%  rss {p['rss_mb']:6.1f} MB")
+
+
+def compare(results, baseline, tolerance):
+    """Prints p95 regressions against ``baseline``; returns True if any exceed ``tolerance``."""
+    failed = False
+    for key, result in results.items():
+        old = baseline.get(key)
+        if not old:
+            continue
+        ratio = result['p95_ms'] / old['p95_ms'] if old['p95_ms'] else 1.0
+        if ratio > 1 + tolerance:
+            failed = True
+            print(f"REGRESSION {key}: p95 {old['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='directory with rock/, paper/, scissors/ and no_hand/ JPEGs')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and concurrency')
+    parser.add_argument('--endpoint', choices=ENDPOINTS, action='append', help='only benchmark this endpoint')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from an earlier --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown against the baseline')
+    args = parser.parse_args()
+
+    frames = load_corpus(args.corpus) if args.corpus else []
+    if not frames:
+        print('No corpus given or found; using synthetic frames with no hand in them.')
+        frames = synthetic_corpus()
+
+    from rps.asgi import application
+    from game.detection import get_detection_service
+
+    service = get_detection_service()
+    # Start the workers and load their graphs before anything is timed.
+    asyncio.run(run(application, ENDPOINTS[0], frames, max(service.workers, 1), max(service.workers, 1) * 2))
+    pids = {'web': os.getpid()}
+    for n, pid in enumerate(sorted(getattr(service._executor, '_processes', None) or {})):
+        pids[f'detector{n}'] = pid
+
+    labels = sorted({label for label, _ in frames})
+    print(f"{len(frames)} frames ({', '.join(labels)}), {service.workers} detector workers")
+    results = {}
+    for path in args.endpoint or ENDPOINTS:
+        for concurrency in args.concurrency:
+            result = measure(application, path, frames, concurrency, args.requests, pids)
+            report(path, concurrency, result)
+            results[f'{path} c={concurrency}'] = result
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Cold start of the web process and of the detector workers.
+
+Each measurement runs in a fresh interpreter. It reports:
+
+- how long importing the ASGI app takes, and whether that pulled in
+  MediaPipe, cvzone or matplotlib;
+- for each start method, with and without warm-up, the time until every
+  detector worker answers and the slowest worker's import/build/warm-up
+  time;
+- the latency of the first frame after that, and of a later frame.
+
+    python benchmarks/bench_startup.py [--workers 2]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WEB_IMPORT = """
+import json, os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rps.settings')
+start = time.perf_counter()
+import rps.asgi
+print(json.dumps({
+    'import_ms': (time.perf_counter() - start) * 1000,
+    'heavy_modules': sorted(m for m in ('mediapipe', 'cvzone', 'matplotlib') if m in sys.modules),
+}))
+"""
+
+WORKER_START = """
+import json, os, time
+os.environ['DETECTOR_START_METHOD'] = {start_method!r}
+os.environ['DETECTOR_WARMUP'] = {warmup!r}
+os.environ['DETECTOR_WORKERS'] = {workers!r}
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rps.settings')
+import django
+django.setup()
+import numpy as np
+from game.detection import get_detection_service, preload_vision_stack
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    preload_vision_stack()
+    preload = time.perf_counter() - start
+    service = get_detection_service()
+    service.warm_up()
+    frame = np.zeros((240, 320, 3), np.uint8)
+    t = time.perf_counter()
+    service.detect(frame)
+    first = time.perf_counter() - t
+    for _ in range(5):
+        service.detect(frame)
+    t = time.perf_counter()
+    service.detect(frame)
+    later = time.perf_counter() - t
+    stats = service.stats()
+    print(json.dumps({{
+        'preload_ms': preload * 1000,
+        'cold_start_ms': stats['cold_start_ms'],
+        'worker_startup_ms': stats['worker_startup_ms'],
+        'first_frame_ms': first * 1000,
+        'later_frame_ms': later * 1000,
+    }}))
+"""
+
+
+def run(code):
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    web = run(WEB_IMPORT)
+    print(f"import rps.asgi: {web['import_ms']:.0f} ms, heavy modules loaded: {', '.join(web['heavy_modules']) or 'none'}")
+    print(f"\n{args.workers} detector workers")
+    print(f"{'start method':<12} {'warm-up':>7} {'preload ms':>10} {'cold start ms':>13} {'worker ms':>9} "
+          f"{'1st frame ms':>12} {'later ms':>8}")
+    for start_method in ('spawn', 'forkserver'):
+        for warmup in ('False', 'True'):
+            r = run(WORKER_START.format(start_method=start_method, warmup=warmup, workers=str(args.workers)))
+            print(f"{start_method:<12} {warmup:>7} {r['preload_ms']:>10.0f} {r['cold_start_ms']:>13.0f} "
+                  f"{r['worker_startup_ms']:>9.0f} {r['first_frame_ms']:>12.1f} {r['later_frame_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
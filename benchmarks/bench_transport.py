@@ -0,0 +1,135 @@
+"""
+Throughput and CPU of sending frames to worker processes by pickling them
+down the pool's pipe versus through a shared-memory FrameRing.
+
+    python benchmarks/bench_transport.py [--sizes 320x240 640x480 1280x720] [--frames 2000]
+
+Each worker only takes the mean of the frame it gets, so what is measured
+is the transport: pickling, the pipe and unpickling against one copy into a
+slot. --in-flight frames are kept at the workers at a time, as a busy
+DetectionService would. CPU is split into the web process (sending and
+collecting) and the workers (receiving, plus the same mean in both modes).
+With --detector the full DetectionService, MediaPipe included, is run both
+ways as well.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game.detection import DetectionService  # noqa: E402
+from game.frame_ring import FrameRing, FrameSlot  # noqa: E402
+
+_ring = None
+
+
+def _attach(ring):
+    global _ring
+    if ring is not None:
+        _ring = FrameRing.attach(*ring)
+
+
+def _touch(img):
+    """Runs in a worker: reads the whole frame and reports this process's CPU time so far."""
+    if isinstance(img, FrameSlot):
+        img = _ring.view(img)
+    return os.getpid(), time.process_time(), float(img.mean())
+
+
+def transport(img, frames, workers, in_flight, shared):
+    """Frames per second, web process CPU ms per frame and worker CPU ms per frame."""
+    ring = FrameRing(in_flight, img.nbytes) if shared else None
+    executor = ProcessPoolExecutor(
+        max_workers=workers, initializer=_attach, initargs=((ring.name, ring.slots, ring.slot_bytes) if ring else None,),
+    )
+    # Start the workers before timing.
+    list(executor.map(_touch, [img] * workers * 2))
+
+    first, last = {}, {}
+    pending = {}
+    sent = done = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    while done < frames:
+        while sent < frames and len(pending) < in_flight:
+            slot = ring.put(img) if ring else None
+            pending[executor.submit(_touch, slot or img)] = slot
+            sent += 1
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            slot = pending.pop(future)
+            if slot:
+                ring.release(slot)
+            pid, worker_cpu, _ = future.result()
+            first.setdefault(pid, worker_cpu)
+            last[pid] = worker_cpu
+            done += 1
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    executor.shutdown()
+    if ring:
+        ring.close()
+    worker_cpu = sum(last[pid] - first[pid] for pid in first)
+    return frames / wall, cpu / frames * 1000, worker_cpu / frames * 1000
+
+
+async def _detect_all(service, img, frames, in_flight):
+    async def client(count):
+        for _ in range(count):
+            await service.adetect(img)
+
+    await asyncio.gather(*(client(frames // in_flight) for _ in range(in_flight)))
+
+
+def detector(img, frames, workers, in_flight, shared):
+    """Frames per second and web process CPU ms per frame through DetectionService."""
+    service = DetectionService(workers=workers, max_pending=in_flight, shared_frames=shared, frame_slot_bytes=img.nbytes)
+    service.warm_up()
+    asyncio.run(_detect_all(service, img, workers, workers))
+    frames = frames // in_flight * in_flight
+    wall, cpu = time.perf_counter(), time.process_time()
+    asyncio.run(_detect_all(service, img, frames, in_flight))
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    service.close()
+    return frames / wall, cpu / frames * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['320x240', '640x480', '1280x720'])
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 4))
+    parser.add_argument('--in-flight', type=int, default=8)
+    parser.add_argument('--detector', action='store_true', help='also run MediaPipe through DetectionService')
+    parser.add_argument('--detector-frames', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{args.workers} workers, {args.in_flight} frames in flight")
+    print(f"{'frame':>9}  {'transport':<10} {'frames/s':>9} {'web cpu ms':>10} {'worker cpu ms':>13}")
+    for size in args.sizes:
+        width, height = map(int, size.split('x'))
+        img = rng.integers(0, 256, (height, width, 3), np.uint8)
+        for name, shared in (('pickle', False), ('shared', True)):
+            fps, cpu, worker_cpu = transport(img, args.frames, args.workers, args.in_flight, shared)
+            print(f"{size:>9}  {name:<10} {fps:>9.0f} {cpu:>10.3f} {worker_cpu:>13.3f}")
+
+    if args.detector:
+        print(f"\nDetectionService, {args.detector_frames} frames")
+        print(f"{'frame':>9}  {'transport':<10} {'frames/s':>9} {'web cpu ms':>10}")
+        for size in args.sizes:
+            width, height = map(int, size.split('x'))
+            img = rng.integers(0, 256, (height, width, 3), np.uint8)
+            for name, shared in (('pickle', False), ('shared', True)):
+                fps, cpu = detector(img, args.detector_frames, args.workers, args.in_flight, shared)
+                print(f"{size:>9}  {name:<10} {fps:>9.1f} {cpu:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Microbenchmark: per-round cost and memory of the VOM engine versus the
+original tuple-keyed model with one NumPy array per pattern, and of the
+decayed, byte-budgeted variant.
+
+    python benchmarks/bench_vom.py [--rounds 20000] [--orders 5 8 12]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game.vom import DecayedVOMModel, VOMModel  # noqa: E402
+
+THRESHOLD = 1
+HALF_LIFE = 50
+MAX_BYTES = 8192
+
+
+class LegacyVOM:
+    """The model as it was in views.py: a growing history list and np.zeros(3) per pattern."""
+
+    def __init__(self, max_order):
+        self.max_order = max_order
+        self.history = []
+        self.patterns = {}
+
+    def update(self, move):
+        self.history.append(move)
+        history = self.history
+        for order in range(1, self.max_order + 1):
+            if len(history) > order:
+                pattern = tuple(history[-(order + 1):-1])
+                if pattern not in self.patterns:
+                    self.patterns[pattern] = np.zeros(3)
+                self.patterns[pattern][move - 1] += 1
+
+    def predict(self):
+        history = self.history
+        for order in range(min(len(history), self.max_order), 0, -1):
+            pattern = tuple(history[-order:])
+            if pattern in self.patterns and np.sum(self.patterns[pattern]) > THRESHOLD:
+                return int(np.argmax(self.patterns[pattern])) + 1
+        return None
+
+    def nbytes(self):
+        size = sys.getsizeof(self.history) + sum(sys.getsizeof(m) for m in self.history)
+        size += sys.getsizeof(self.patterns)
+        for pattern, counts in self.patterns.items():
+            size += sys.getsizeof(pattern) + counts.nbytes + sys.getsizeof(counts)
+        return size
+
+
+def run(model, moves):
+    start = time.perf_counter()
+    for move in moves:
+        model.predict()
+        model.update(move)
+    return (time.perf_counter() - start) / len(moves) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--orders', type=int, nargs='+', default=[5, 8, 12])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    moves = [rng.choice([1, 1, 2, 3]) for _ in range(args.rounds)]
+
+    print(f"{args.rounds} rounds of predict + update per model")
+    print(f"{'order':>5}  {'model':<8} {'us/round':>9} {'bytes/session':>14}")
+    for order in args.orders:
+        models = (
+            ('legacy', LegacyVOM(order)),
+            ('engine', VOMModel(order, THRESHOLD)),
+            ('decayed', DecayedVOMModel(order, THRESHOLD, HALF_LIFE, MAX_BYTES)),
+        )
+        for name, model in models:
+            per_round = run(model, moves)
+            print(f"{order:>5}  {name:<8} {per_round:>9.2f} {model.nbytes():>14,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,27 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import GameSession, PlayerSnapshot, PlayerStats, Round
+
+
+@admin.register(GameSession)
+class GameSessionAdmin(admin.ModelAdmin):
+    list_display = ('session_id', 'username', 'started_at')
+    search_fields = ('username', 'session_id')
+
+
+@admin.register(Round)
+class RoundAdmin(admin.ModelAdmin):
+    list_display = ('session', 'player_move', 'ai_move', 'winner', 'played_at')
+    list_filter = ('winner',)
+
+
+@admin.register(PlayerSnapshot)
+class PlayerSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('username', 'max_order', 'last_round_id', 'updated_at')
+    exclude = ('counts',)
+
+
+@admin.register(PlayerStats)
+class PlayerStatsAdmin(admin.ModelAdmin):
+    list_display = ('username', 'games', 'rounds', 'wins', 'losses', 'ties', 'updated_at')
+    search_fields = ('username',)
@@ -0,0 +1,138 @@
+"""
+Admission control in front of the frame endpoints.
+
+Without it, every frame under a spike is parsed, decoded and queued for
+MediaPipe before anything can turn it away, and the live annotation polls,
+which are only cosmetic, compete on equal terms with the frames that settle
+rounds. ``admission_control`` decides before the body is even read:
+
+- At most ``ADMISSION_MAX_IN_FLIGHT`` frame requests are in progress in a
+  process. Annotation polls may only use all but the last
+  ``ADMISSION_ROUND_RESERVE`` of those slots, so a round frame always finds
+  one free and waits behind a bounded number of frames.
+- Each session's annotation polls draw from a token bucket refilled at
+  ``ANNOTATE_RATE`` per second, holding up to ``ANNOTATE_BURST`` tokens.
+  The session comes from the ``X-Session-Id`` header, or the client's
+  address without one.
+
+A shed poll gets a 429 marked ``reuse``, so the page keeps showing the last
+overlay it drew and polls again after ``next_poll_ms``. A shed round frame
+gets the usual 503. Both are counted per priority and reason for /metrics.
+"""
+
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .model_store import LocalModelStore
+
+PRIORITIES = ('round', 'annotate')
+
+
+class Shed(Exception):
+    """A request refused before any work was done on it."""
+
+    def __init__(self, reason, retry_after_ms):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_ms = retry_after_ms
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight, round_reserve, rate, burst, max_sessions, ttl, busy_retry_ms=1000):
+        self.max_in_flight = max_in_flight
+        self.round_reserve = round_reserve
+        self.rate = rate
+        self.burst = burst
+        self.busy_retry_ms = busy_retry_ms
+        self.in_flight = 0
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.shed = {('round', 'busy'): 0, ('annotate', 'busy'): 0, ('annotate', 'rate'): 0}
+        self._buckets = LocalModelStore(max_sessions, ttl)
+        self._lock = threading.Lock()
+
+    def _take_token(self, key):
+        """Milliseconds until ``key`` has a token again, or 0 after taking one."""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key) or (self.burst, now)
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets.put(key, (tokens, now))
+            return math.ceil((1 - tokens) / self.rate * 1000)
+        self._buckets.put(key, (tokens - 1, now))
+        return 0
+
+    def admit(self, priority, key=None):
+        """Takes an in-flight slot for a request of ``priority``; raises Shed if it cannot have one."""
+        with self._lock:
+            if priority == 'annotate' and key is not None:
+                wait_ms = self._take_token(key)
+                if wait_ms:
+                    self.shed[priority, 'rate'] += 1
+                    raise Shed('rate', wait_ms)
+            limit = self.max_in_flight if priority == 'round' else self.max_in_flight - self.round_reserve
+            if self.in_flight >= limit:
+                self.shed[priority, 'busy'] += 1
+                raise Shed('busy', self.busy_retry_ms)
+            self.in_flight += 1
+            self.admitted[priority] += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+_controller = None
+
+
+def get_admission_controller():
+    """Returns the process-wide controller, or None when ADMISSION_CONTROL is off."""
+    global _controller
+    if not settings.ADMISSION_CONTROL:
+        return None
+    if _controller is None:
+        _controller = AdmissionController(
+            settings.ADMISSION_MAX_IN_FLIGHT,
+            settings.ADMISSION_ROUND_RESERVE,
+            settings.ANNOTATE_RATE,
+            settings.ANNOTATE_BURST,
+            settings.VOM_STORE_MAX_SESSIONS,
+            ttl=60,
+            busy_retry_ms=settings.ANNOTATE_MAX_POLL_MS,
+        )
+    return _controller
+
+
+def _shed_response(priority, exc):
+    if priority == 'round':
+        response = JsonResponse({'error': 'Server busy, try again.'}, status=503)
+    else:
+        response = JsonResponse({'error': 'Too many frames.', 'reuse': True, 'next_poll_ms': exc.retry_after_ms},
+                                status=429)
+    response['Retry-After'] = str(math.ceil(exc.retry_after_ms / 1000))
+    return response
+
+
+def admission_control(priority):
+    """Admits an async frame view's requests as ``priority`` ('round' or 'annotate') before it runs."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            controller = get_admission_controller()
+            if controller is None:
+                return await view(request, *args, **kwargs)
+            key = request.headers.get('X-Session-Id') or request.META.get('REMOTE_ADDR')
+            try:
+                controller.admit(priority, key)
+            except Shed as exc:
+                return _shed_response(priority, exc)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                controller.release()
+        return wrapper
+    return decorator
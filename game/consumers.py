@@ -2,71 +2,180 @@
 
 import json
 import asyncio
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .views import _decode_image_from_base64, ai_predict, get_winner, update_transition, move_to_int, int_to_move, detector
+from django.core.cache import caches
+from .detection import DetectorBusy, adetect_for_session
+from .gestures import classify_session_frame, get_gesture_voter, record_frame
+from .leaderboard import arecord_stats
+from .model_store import get_model_store
+from .round_log import record_round
+from .timing import stage, timed_request
+from .views import (
+    _decode_image_from_bytes, _hand_payload, ai_predict_vom, get_winner, int_to_move,
+    move_to_int, new_ai_model, update_vom_patterns,
+)
 
 game_states = {}
 WINNING_SCORE = 5
+COUNTDOWN_FROM = 3
+# Seconds the result of a round stays on screen before the next countdown.
+RESULT_PAUSE = 2
+# Seconds the room host waits for both players' moves after the shoot.
+MOVE_TIMEOUT = 2
+# Seconds a room seat stays claimed if its worker dies without releasing it.
+SEAT_TTL = 3600
 
-def _get_move_from_image(img):
+async def _get_move_from_image(session_id, img):
     """
     Analyzes an image to find a hand gesture.
 
     Returns:
-        A tuple containing the move string, a list of landmark coordinates, 
+        A tuple containing the move string, a list of landmark coordinates,
         and the bounding box coordinates.
     """
-    hands, _ = detector.findHands(img, draw=False)
+    with stage('detect'):
+        hands, _ = await adetect_for_session(session_id, img, draw=False)
+    with stage('gesture'):
+        move, _ = classify_session_frame(session_id, hands)
     if hands:
         hand = hands[0]
-        fingers = detector.fingersUp(hand)
-        move = None
-        if fingers == [0, 0, 0, 0, 0]:
-            move = "rock"
-        elif fingers == [1, 1, 1, 1, 1]:
-            move = "paper"
-        elif fingers == [0, 1, 1, 0, 0]:
-            move = "scissors"
-        
         return move, hand.get('lmList', []), hand.get('bbox', [])
-        
-    return None, [], []
+
+    return move, [], []
+
+
+async def _landmarks_message(session_id, frame):
+    """The landmarks message for a raw JPEG frame, or None if there is nothing to send."""
+    with stage('decode'):
+        img = _decode_image_from_bytes(frame)
+    if img is None:
+        return None
+    try:
+        with stage('detect'):
+            hands, _ = await adetect_for_session(session_id, img, draw=False)
+    except DetectorBusy:
+        return None
+    with stage('gesture'):
+        record_frame(session_id, hands)
+    with stage('encode'):
+        return json.dumps({
+            'type': 'landmarks',
+            'hands': [_hand_payload(hand) for hand in hands],
+            'width': img.shape[1],
+            'height': img.shape[0],
+        })
 
 
 class GameConsumer(AsyncWebsocketConsumer):
+    """
+    Plays against the AI over a WebSocket.
+
+    The browser streams raw JPEG frames as binary messages. Only the newest
+    frame is kept; whenever the previous detection has finished, the newest
+    frame is analysed and its landmarks sent back for the live overlay. The
+    server runs the countdown and scores each round from the frame it holds
+    when the countdown reaches zero.
+    """
+
     async def connect(self):
         await self.accept()
+        query = parse_qs(self.scope.get('query_string', b'').decode())
         game_states[self] = {
             "status": "idle",
+            "session_id": query.get('session_id', ['anonymous'])[0],
             "last_frame": None,
+            "frame_ready": asyncio.Event(),
             "scores": [0, 0],
-            "prev_move": None,
-            "game_loop_task": None
+            "game_loop_task": None,
+            "annotate_task": None,
         }
+        game_states[self]["annotate_task"] = asyncio.create_task(self.annotate_loop())
 
     async def disconnect(self, close_code):
-        state = game_states.get(self)
-        if state and state.get("game_loop_task"):
-            state["game_loop_task"].cancel()
-        if self in game_states:
-            del game_states[self]
+        state = game_states.pop(self, None)
+        if not state:
+            return
+        for task_name in ("game_loop_task", "annotate_task"):
+            if state.get(task_name):
+                state[task_name].cancel()
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message_type = data.get('type')
+    async def receive(self, text_data=None, bytes_data=None):
         state = game_states.get(self)
         if not state:
             return
 
-        if message_type == 'start_game':
-            if state["status"] != "playing":
-                state["status"] = "playing"
-                state["scores"] = [0, 0]
-                state["prev_move"] = None
-                state["game_loop_task"] = asyncio.create_task(self.game_loop())
+        if bytes_data is not None:
+            # Latest frame wins: anything not yet analysed is simply replaced.
+            state["last_frame"] = bytes_data
+            state["frame_ready"].set()
+            return
+
+        data = json.loads(text_data)
+        if data.get('type') == 'start_game' and state["status"] != "playing":
+            state["status"] = "playing"
+            state["scores"] = [0, 0]
+            state["game_loop_task"] = asyncio.create_task(self.game_loop())
+
+    async def annotate_loop(self):
+        """Sends landmarks for the newest frame each time the detector is free."""
+        state = game_states.get(self)
+        while state is not None:
+            await state["frame_ready"].wait()
+            state["frame_ready"].clear()
+            with timed_request('ws_annotate'):
+                message = await self.annotate_frame(state)
+            if message is not None:
+                await self.send(text_data=message)
+
+    async def annotate_frame(self, state):
+        """The landmarks message for the newest frame, or None if there is nothing to send."""
+        return await _landmarks_message(state["session_id"], state["last_frame"])
 
-        elif message_type == 'frame':
-            state["last_frame"] = data.get('image')
+    async def play_round(self, state):
+        game_update = {'type': 'game_update', 'error': 'No hand detected'}
+        with stage('decode'):
+            img = _decode_image_from_bytes(state["last_frame"]) if state.get("last_frame") else None
+        if img is None:
+            return game_update
+
+        try:
+            player_move, landmarks, bbox = await _get_move_from_image(state["session_id"], img)
+        except DetectorBusy:
+            game_update['error'] = 'Server busy'
+            return game_update
+
+        # Always include landmark data in the update
+        game_update['landmarks'] = landmarks
+        game_update['bbox'] = bbox
+
+        if player_move:
+            get_gesture_voter().reset(state["session_id"])
+            with stage('ai'):
+                store = get_model_store()
+                model = await store.aget(state["session_id"]) or new_ai_model()
+                player_move_int = move_to_int[player_move]
+                ai_move_int = ai_predict_vom(model)
+                update_vom_patterns(model, player_move_int)
+                await store.aput(state["session_id"], model)
+            ai_move = int_to_move[ai_move_int]
+            winner = get_winner(player_move, ai_move)
+            record_round(state["session_id"], player_move, ai_move, winner)
+            await arecord_stats(state["session_id"], player_move, winner)
+
+            if winner == 'player':
+                state["scores"][1] += 1
+            elif winner == 'ai':
+                state["scores"][0] += 1
+
+            game_update.update({
+                'error': None,
+                'player_move': player_move,
+                'ai_move': ai_move,
+                'winner': winner,
+                'scores': state["scores"]
+            })
+        return game_update
 
     async def game_loop(self):
         state = game_states.get(self)
@@ -76,49 +185,241 @@ class GameConsumer(AsyncWebsocketConsumer):
         while max(state["scores"]) < WINNING_SCORE:
             try:
                 # Countdown
-                for i in range(3, -1, -1):
+                for i in range(COUNTDOWN_FROM, -1, -1):
                     await self.send(text_data=json.dumps({'type': 'countdown', 'value': i}))
-                    await asyncio.sleep(1)
-
-                game_update = {'type': 'game_update', 'error': 'No hand detected'}
-
-                if state.get("last_frame"):
-                    img = _decode_image_from_base64(state["last_frame"])
-                    if img is not None:
-                        player_move, landmarks, bbox = _get_move_from_image(img)
-
-                        # Always include landmark data in the update
-                        game_update['landmarks'] = landmarks
-                        game_update['bbox'] = bbox
-
-                        if player_move:
-                            player_move_int = move_to_int[player_move]
-                            ai_move_int = ai_predict()
-                            update_transition(state["prev_move"], player_move_int)
-                            state["prev_move"] = player_move_int
-                            ai_move = int_to_move[ai_move_int]
-                            winner = get_winner(player_move, ai_move)
-
-                            if winner == 'player':
-                                state["scores"][1] += 1
-                            elif winner == 'ai':
-                                state["scores"][0] += 1
-                            
-                            game_update.update({
-                                'error': None,
-                                'player_move': player_move,
-                                'ai_move': ai_move,
-                                'scores': state["scores"]
-                            })
-                
+                    if i:
+                        await asyncio.sleep(1)
+
+                with timed_request('ws_round'):
+                    game_update = await self.play_round(state)
                 await self.send(text_data=json.dumps(game_update))
+                await asyncio.sleep(RESULT_PAUSE)
 
             except Exception as e:
                 print(f"Error in game loop: {e}")
                 await self.send(text_data=json.dumps({'type': 'game_update', 'error': 'A processing error occurred.'}))
                 await asyncio.sleep(3)
-        
+
         # Game Over
         state["status"] = "game_over"
         final_winner = "Player" if state["scores"][1] > state["scores"][0] else "AI"
-        await self.send(text_data=json.dumps({'type': 'game_over', 'winner': final_winner}))
\ No newline at end of file
+        await self.send(text_data=json.dumps({'type': 'game_over', 'winner': final_winner}))
+
+
+def _seat_key(room, seat):
+    return f'room:{room}:seat:{seat}'
+
+
+class RoomConsumer(AsyncWebsocketConsumer):
+    """
+    Player-vs-player and spectator rooms.
+
+    Everyone in a room joins the channel layer group ``room_<name>``, so the
+    room works across workers once the layer is Redis. The two player seats
+    are claimed with ``add`` on the 'shared' cache, which is Redis whenever
+    the channel layer is, so only one consumer anywhere can hold a seat.
+    Anyone else, or anyone connecting with ``?role=spectator``, watches.
+    Seat 1 hosts: its consumer keeps the score and runs the countdown, and
+    the state lives nowhere else.
+
+    At each shoot every player's consumer classifies its own newest frame on
+    its own worker's detection pool and sends just the move to the group. A
+    player never has more than one frame in detection besides the shoot, and
+    the host only waits MOVE_TIMEOUT for moves, so a busy room cannot hold up
+    the rest. Rounds go out as deltas (the round's moves and winner); the
+    full state is only sent to someone who has just joined.
+    """
+
+    async def connect(self):
+        self.room = self.scope['url_route']['kwargs']['room']
+        self.group = f'room_{self.room}'
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.session_id = query.get('session_id', ['anonymous'])[0]
+        self.name = query.get('name', ['Player'])[0][:32]
+        self.seat = 0
+        self.game = None
+        self.last_frame = None
+        self.frame_ready = asyncio.Event()
+        self.annotate_task = None
+        await self.accept()
+        await self.channel_layer.group_add(self.group, self.channel_name)
+
+        if query.get('role', ['player'])[0] == 'player':
+            for seat in (1, 2):
+                if await caches['shared'].aadd(_seat_key(self.room, seat), self.channel_name, SEAT_TTL):
+                    self.seat = seat
+                    break
+        if self.seat:
+            self.annotate_task = asyncio.create_task(self.annotate_loop())
+        if self.seat == 1:
+            self.game = {
+                'players': [self.name, None],
+                'scores': [0, 0],
+                'round': 0,
+                'status': 'idle',
+                'moves': {},
+                'moves_in': asyncio.Event(),
+                'task': None,
+            }
+        await self.send_json({'type': 'welcome', 'seat': self.seat})
+        await self.channel_layer.group_send(self.group, self._joined_event())
+
+    async def disconnect(self, close_code):
+        for task in (self.annotate_task, self.game and self.game['task']):
+            if task:
+                task.cancel()
+        if self.seat:
+            key = _seat_key(self.room, self.seat)
+            seats = caches['shared']
+            if await seats.aget(key) == self.channel_name:
+                await seats.adelete(key)
+            await self.channel_layer.group_send(self.group, {'type': 'room.left', 'seat': self.seat})
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            if self.seat:
+                # Latest frame wins, as in GameConsumer.
+                self.last_frame = bytes_data
+                self.frame_ready.set()
+            return
+
+        data = json.loads(text_data)
+        if data.get('type') == 'start_game' and self.seat:
+            if self.game is not None:
+                await self.start_game()
+            else:
+                await self.channel_layer.group_send(self.group, {'type': 'room.start'})
+
+    async def send_json(self, message):
+        await self.send(text_data=json.dumps(message))
+
+    def _joined_event(self):
+        return {'type': 'room.joined', 'seat': self.seat, 'name': self.name, 'reply_to': self.channel_name}
+
+    # --- Player side ---
+
+    async def annotate_loop(self):
+        """Sends landmarks for the newest frame each time the detector is free."""
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            with timed_request('ws_annotate'):
+                message = await _landmarks_message(self.session_id, self.last_frame)
+            if message is not None:
+                await self.send(text_data=message)
+
+    async def read_move(self):
+        """This player's move from the newest frame, or None."""
+        with stage('decode'):
+            img = _decode_image_from_bytes(self.last_frame) if self.last_frame else None
+        if img is None:
+            return None
+        try:
+            move, _, _ = await _get_move_from_image(self.session_id, img)
+        except DetectorBusy:
+            return None
+        if move:
+            get_gesture_voter().reset(self.session_id)
+        return move
+
+    # --- Host side ---
+
+    def snapshot(self):
+        game = self.game
+        return {
+            'type': 'room.state', 'players': game['players'], 'scores': game['scores'],
+            'round': game['round'], 'status': game['status'],
+        }
+
+    async def start_game(self):
+        game = self.game
+        if game['status'] == 'playing' or game['players'][1] is None:
+            return
+        game['status'] = 'playing'
+        game['scores'] = [0, 0]
+        game['task'] = asyncio.create_task(self.host_loop())
+
+    async def host_loop(self):
+        game = self.game
+        send = self.channel_layer.group_send
+        while max(game['scores']) < WINNING_SCORE:
+            game['round'] += 1
+            for i in range(COUNTDOWN_FROM, 0, -1):
+                await send(self.group, {'type': 'room.countdown', 'value': i})
+                await asyncio.sleep(1)
+            game['moves'] = {}
+            game['moves_in'].clear()
+            await send(self.group, {'type': 'room.shoot', 'round': game['round']})
+            try:
+                await asyncio.wait_for(game['moves_in'].wait(), MOVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+
+            moves = [game['moves'].get(1), game['moves'].get(2)]
+            winner = None
+            if all(moves):
+                winner = {'player': 1, 'ai': 2, 'tie': 0}[get_winner(*moves)]
+                if winner:
+                    game['scores'][winner - 1] += 1
+            await send(self.group, {'type': 'room.result', 'round': game['round'], 'moves': moves, 'winner': winner})
+            await asyncio.sleep(RESULT_PAUSE)
+
+        game['status'] = 'over'
+        await send(self.group, {'type': 'room.over', 'winner': 1 if game['scores'][0] > game['scores'][1] else 2})
+
+    # --- Group messages ---
+
+    async def room_joined(self, event):
+        if event['reply_to'] == self.channel_name:
+            return
+        if self.game is not None:
+            if event['seat'] == 2:
+                self.game['players'][1] = event['name']
+            await self.channel_layer.send(event['reply_to'], self.snapshot())
+        elif self.seat == 2 and event['seat'] == 1:
+            # A new host took the empty seat 1: tell it who it is playing.
+            await self.channel_layer.send(event['reply_to'], self._joined_event())
+        if event['seat']:
+            await self.send_json({'type': 'joined', 'seat': event['seat'], 'name': event['name']})
+
+    async def room_left(self, event):
+        if self.game is not None and event['seat'] == 2:
+            self.game['players'][1] = None
+            if self.game['task']:
+                self.game['task'].cancel()
+            self.game['status'] = 'idle'
+        await self.send_json({'type': 'left', 'seat': event['seat']})
+
+    async def room_state(self, event):
+        await self.send_json({**event, 'type': 'state'})
+
+    async def room_start(self, event):
+        if self.game is not None:
+            await self.start_game()
+
+    async def room_countdown(self, event):
+        await self.send_json({'type': 'countdown', 'value': event['value']})
+
+    async def room_shoot(self, event):
+        await self.send_json({'type': 'countdown', 'value': 0})
+        if self.seat:
+            with timed_request('ws_room_move'):
+                move = await self.read_move()
+            await self.channel_layer.group_send(self.group, {
+                'type': 'room.move', 'round': event['round'], 'seat': self.seat, 'move': move,
+            })
+
+    async def room_move(self, event):
+        game = self.game
+        if game is None or event['round'] != game['round'] or not event['move']:
+            return
+        game['moves'][event['seat']] = event['move']
+        if len(game['moves']) == 2:
+            game['moves_in'].set()
+
+    async def room_result(self, event):
+        await self.send_json({**event, 'type': 'result'})
+
+    async def room_over(self, event):
+        await self.send_json({'type': 'over', 'winner': event['winner']})
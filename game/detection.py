@@ -0,0 +1,501 @@
+"""
+Hand detection off the request path.
+
+MediaPipe graphs are not thread-safe and each inference holds the CPU for
+tens of milliseconds, so detection runs in a pool of ``DETECTOR_WORKERS``
+processes that each own one ``HandDetector``. With ``DETECTOR_WORKERS = 0``
+a single background thread owns the detector instead, which is handy for
+development and tests.
+
+Views and consumers ``await get_detection_service().adetect(img)``; sync
+code can call ``detect(img)``. Both raise ``DetectorBusy`` once
+``DETECTOR_MAX_PENDING`` frames are already queued, so overload turns into
+fast rejections rather than an ever-growing backlog.
+
+While every worker is busy, ``adetect`` holds new frames for up to
+``DETECTOR_BATCH_WINDOW_MS`` and ships them to a worker together, at most
+``DETECTOR_BATCH_MAX_SIZE`` at a time. A batch is one task and one round
+trip to the worker process instead of one per frame. Frames are still
+inferred one after another inside the worker, because MediaPipe Hands takes
+one image per call. When a worker is idle, frames go straight to it.
+
+Workers load cvzone/MediaPipe when they start, never the web process. With
+``DETECTOR_WARMUP`` each worker also runs one inference on a blank frame
+before taking work, so the first real frame does not pay for graph
+initialisation. ``warm_up()`` starts every worker ahead of the first frame
+and records how long that took. With ``DETECTOR_START_METHOD =
+'forkserver'``, ``preload_vision_stack()`` (called as each server process starts, from
+the ASGI lifespan in rps/asgi.py) imports the vision stack once in that
+process's fork server. Its workers are then forked from it instead of
+importing it again, and share those pages copy-on-write. The fork server
+belongs to the process that started it, so it is never started before
+gunicorn forks its web workers: a worker cannot use its master's.
+
+With ``DETECTOR_SHARED_FRAMES`` frames reach the worker processes through a
+``FrameRing`` of shared-memory slots (game/frame_ring.py) rather than being
+pickled down a pipe; only slot numbers and landmarks cross over.
+
+A worker that crashes (MediaPipe can take the process down) breaks the
+whole ``ProcessPoolExecutor``. The service then starts a new pool, and a new
+frame ring, and sends the frames that were caught in it once more.
+
+``RoiTracker`` sits in front of the service and, for sessions whose last
+frame had a hand in it, only sends the area around that hand to MediaPipe.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .frame_ring import FrameRing, FrameSlot
+from .model_store import LocalModelStore
+
+# The detector owned by the current worker process (or thread), and how long
+# it took to import, build and warm up.
+_worker_detector = None
+_worker_startup = None
+# The web process's FrameRing, as seen from a detector worker.
+_worker_ring = None
+
+
+class DetectorBusy(Exception):
+    """Raised when too many frames are already waiting for detection."""
+
+
+def _init_worker(max_hands, detection_con, warmup=False, ring=None):
+    global _worker_detector, _worker_startup, _worker_ring
+    if ring is not None:
+        _worker_ring = FrameRing.attach(*ring)
+    start = time.perf_counter()
+    from cvzone.HandTrackingModule import HandDetector
+    _worker_detector = HandDetector(maxHands=max_hands, detectionCon=detection_con)
+    if warmup:
+        import numpy as np
+        _worker_detector.findHands(np.zeros((240, 320, 3), np.uint8), draw=False)
+    _worker_startup = time.perf_counter() - start
+
+
+def _startup_time():
+    return _worker_startup
+
+
+def _find_hands(img, draw):
+    """
+    Runs inside a detector worker. Returns the hands found, the annotated
+    image when ``draw`` is set, and the inference time in seconds. A frame
+    passed as a FrameSlot is annotated in its slot and not sent back.
+    """
+    shared = isinstance(img, FrameSlot)
+    if shared:
+        img = _worker_ring.view(img)
+    start = time.perf_counter()
+    hands, annotated = _worker_detector.findHands(img, draw=draw)
+    elapsed = time.perf_counter() - start
+    if shared:
+        if draw and annotated is not img:
+            img[...] = annotated
+        return hands, None, elapsed
+    return hands, annotated if draw else None, elapsed
+
+
+def _find_hands_batch(frames):
+    """Runs ``_find_hands`` over ``[(img, draw), ...]`` inside one detector worker."""
+    return [_find_hands(img, draw) for img, draw in frames]
+
+
+def _settle(future, result=None, error=None):
+    """Completes ``future`` unless whoever was waiting for it has cancelled it."""
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _chain(source, future):
+    """Completes ``future`` with the outcome of ``source`` once it is done."""
+    def copy(source):
+        error = source.exception()
+        _settle(future, None if error is not None else source.result(), error)
+
+    source.add_done_callback(copy)
+
+
+class DetectionService:
+    """Bounded queue in front of a pool of hand detectors."""
+
+    def __init__(self, workers, max_pending, max_hands=1, detection_con=0.8, batch_window=0.0, batch_max_size=1,
+                 warmup=False, start_method='spawn', shared_frames=False, frame_slot_bytes=640 * 480 * 3):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.batch_window = batch_window
+        self.batch_max_size = batch_max_size
+        self.created = time.perf_counter()
+        # Seconds from creating the service until every worker answered, and
+        # the slowest worker's import/build/warm-up time; set by warm_up().
+        self.cold_start = None
+        self.worker_startup = None
+        # Pools started to replace one a crashed worker broke.
+        self.restarts = 0
+        self._pool_options = (max_hands, detection_con, warmup, start_method, shared_frames, frame_slot_bytes)
+        self._executor, self._ring = self._start_pool()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._processed = 0
+        self._rejected = 0
+        # (inference seconds, seconds including queueing) for recent frames.
+        self._recent = deque(maxlen=512)
+        # Frames waiting to be shipped together, per event loop, and how many
+        # batches are at the workers.
+        self._batches = {}
+        self._running_batches = 0
+        self._batched_frames = 0
+        self._batch_count = 0
+
+    def _start_pool(self):
+        """A new executor for the detectors and, with shared frames, the ring it reads them from."""
+        max_hands, detection_con, warmup, start_method, shared_frames, frame_slot_bytes = self._pool_options
+        initargs = (max_hands, detection_con, warmup)
+        # One slot per frame that may be pending, so a slot is only ever
+        # missing while a refused or abandoned frame is still at a worker.
+        ring = None
+        if self.workers > 0 and shared_frames:
+            ring = FrameRing(self.max_pending, frame_slot_bytes)
+            initargs += ((ring.name, ring.slots, ring.slot_bytes),)
+        if self.workers > 0:
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=_init_worker,
+                initargs=initargs,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)
+        return executor, ring
+
+    def _restart(self, broken):
+        """Replaces the pool ``broken`` and its ring, unless another frame has already done so."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            ring = self._ring
+            self._executor, self._ring = self._start_pool()
+            self.restarts += 1
+        broken.shutdown(wait=False)
+        if ring is not None:
+            ring.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise DetectorBusy()
+            self._pending += 1
+
+    def _release(self, started, inference=None):
+        with self._lock:
+            self._pending -= 1
+            if inference is not None:
+                self._processed += 1
+                self._recent.append((inference, time.perf_counter() - started))
+
+    def _submit(self, frames, retry=True):
+        """
+        Sends ``[(img, draw), ...]`` to a worker as one task and returns a
+        future of their ``_find_hands`` results. Images go through the frame
+        ring when it has room; their slots are freed once the worker is done
+        and any annotated image has been copied out. If the pool is broken,
+        it is restarted and the frames are sent again, once.
+        """
+        executor, ring = self._executor, self._ring
+        sent = [(ring.put(img) if ring is not None else None, img, draw) for img, draw in frames]
+
+        def release():
+            for slot, _, _ in sent:
+                if slot:
+                    ring.release(slot)
+
+        try:
+            task = executor.submit(_find_hands_batch, [(slot or img, draw) for slot, img, draw in sent])
+        except BrokenProcessPool:
+            release()
+            if not retry:
+                raise
+            self._restart(executor)
+            return self._submit(frames, retry=False)
+
+        results = Future()
+
+        def collect(task):
+            # The slots are freed before the result is settled: settling lets
+            # the caller admit its next frame, which should find a slot free.
+            output, error = None, task.exception()
+            try:
+                if error is None:
+                    output = [
+                        (hands, ring.view(slot).copy() if slot and draw else annotated, inference)
+                        for (slot, _, draw), (hands, annotated, inference) in zip(sent, task.result())
+                    ]
+            except Exception as exc:
+                error = exc
+            finally:
+                release()
+            if isinstance(error, BrokenProcessPool) and retry:
+                self._restart(executor)
+                try:
+                    _chain(self._submit(frames, retry=False), results)
+                except Exception as exc:
+                    _settle(results, error=exc)
+            else:
+                _settle(results, output, error)
+
+        task.add_done_callback(collect)
+        return results
+
+    def detect(self, img, draw=False):
+        """Blocking detection. Returns ``(hands, annotated_image_or_None)``."""
+        self._acquire()
+        started = time.perf_counter()
+        inference = None
+        try:
+            (hands, annotated, inference), = self._submit([(img, draw)]).result()
+        finally:
+            self._release(started, inference)
+        return hands, annotated
+
+    async def adetect(self, img, draw=False):
+        """Like ``detect`` but awaits the worker instead of blocking the event loop."""
+        self._acquire()
+        started = time.perf_counter()
+        inference = None
+        try:
+            loop = asyncio.get_running_loop()
+            if self.batch_max_size > 1:
+                future = loop.create_future()
+                self._add_to_batch(loop, (img, draw), future)
+                hands, annotated, inference = await future
+            else:
+                (hands, annotated, inference), = await asyncio.wrap_future(self._submit([(img, draw)]))
+        finally:
+            self._release(started, inference)
+        return hands, annotated
+
+    def _add_to_batch(self, loop, frame, future):
+        batch = self._batches.get(loop)
+        if batch is None:
+            batch = self._batches[loop] = []
+            loop.call_later(self.batch_window, self._flush, loop, batch)
+        batch.append((frame, future))
+        if len(batch) >= self.batch_max_size or self._running_batches < max(self.workers, 1):
+            self._flush(loop, batch)
+
+    def _flush(self, loop, batch):
+        """Ships ``batch`` to a worker, unless it has already gone."""
+        if self._batches.get(loop) is not batch:
+            return
+        del self._batches[loop]
+        self._running_batches += 1
+        self._batch_count += 1
+        self._batched_frames += len(batch)
+        try:
+            task = asyncio.wrap_future(self._submit([frame for frame, _ in batch]), loop=loop)
+        except Exception as exc:
+            # From call_later the error would only reach the loop's handler
+            # and the batch's requests would wait forever.
+            self._running_batches -= 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        task.add_done_callback(lambda task: self._fan_out(loop, task, batch))
+
+    def _fan_out(self, loop, task, batch):
+        self._running_batches -= 1
+        error = task.exception()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(task.result()[i])
+        # A worker is free again: send whatever queued up behind it.
+        waiting = self._batches.get(loop)
+        if waiting:
+            self._flush(loop, waiting)
+
+    def warm_up(self):
+        """Starts every worker and waits until each has its detector ready."""
+        futures = [self._executor.submit(_startup_time) for _ in range(max(self.workers, 1))]
+        self.worker_startup = max(future.result() for future in futures)
+        self.cold_start = time.perf_counter() - self.created
+
+    def close(self):
+        """Stops the workers and removes the frame ring."""
+        self._executor.shutdown()
+        if self._ring is not None:
+            self._ring.close()
+
+    @property
+    def queue_depth(self):
+        return self._pending
+
+    def stats(self):
+        with self._lock:
+            recent = list(self._recent)
+            stats = {
+                'workers': self.workers,
+                'queue_depth': self._pending,
+                'max_pending': self.max_pending,
+                'processed': self._processed,
+                'rejected': self._rejected,
+            }
+            if self._ring is not None:
+                stats['shared_frame_slots_free'] = self._ring.free
+                stats['shared_frame_fallbacks'] = self._ring.fallbacks
+            if self.restarts:
+                stats['pool_restarts'] = self.restarts
+            if self._batch_count:
+                stats['mean_batch_size'] = round(self._batched_frames / self._batch_count, 2)
+            if self.cold_start is not None:
+                stats['cold_start_ms'] = round(self.cold_start * 1000, 1)
+                stats['worker_startup_ms'] = round(self.worker_startup * 1000, 1)
+        if recent:
+            inference = sorted(r[0] for r in recent)
+            total = sorted(r[1] for r in recent)
+            stats.update({
+                'inference_ms_p50': round(inference[len(inference) // 2] * 1000, 2),
+                'inference_ms_p95': round(inference[int(len(inference) * 0.95)] * 1000, 2),
+                'latency_ms_p50': round(total[len(total) // 2] * 1000, 2),
+                'latency_ms_p95': round(total[int(len(total) * 0.95)] * 1000, 2),
+            })
+        return stats
+
+
+def _offset_hand(hand, dx, dy):
+    hand['lmList'] = [[x + dx, y + dy, z] for x, y, z in hand['lmList']]
+    x, y, w, h = hand['bbox']
+    hand['bbox'] = (x + dx, y + dy, w, h)
+    cx, cy = hand['center']
+    hand['center'] = (cx + dx, cy + dy)
+    return hand
+
+
+class RoiTracker:
+    """
+    Detects hands in a crop around each session's last known hand, falling
+    back to the full frame when there is no previous hand or the crop comes
+    back empty.
+    """
+
+    def __init__(self, margin, max_sessions, ttl):
+        self.margin = margin
+        self.hits = 0
+        self.misses = 0
+        self._last_bbox = LocalModelStore(max_sessions, ttl)
+
+    def _roi(self, bbox, shape):
+        x, y, w, h = bbox
+        height, width = shape[:2]
+        # Square crop around the hand with room for it to move.
+        side = max(w, h) * (1 + 2 * self.margin)
+        cx, cy = x + w / 2, y + h / 2
+        x0, y0 = max(int(cx - side / 2), 0), max(int(cy - side / 2), 0)
+        x1, y1 = min(int(cx + side / 2), width), min(int(cy + side / 2), height)
+        return x0, y0, x1, y1
+
+    async def adetect(self, service, session_id, img, draw=False):
+        """Same contract as ``DetectionService.adetect`` with landmarks in full-frame coordinates."""
+        bbox = self._last_bbox.get(session_id)
+        if bbox is not None:
+            x0, y0, x1, y1 = self._roi(bbox, img.shape)
+            if x1 - x0 >= 32 and y1 - y0 >= 32:
+                hands, annotated = await service.adetect(img[y0:y1, x0:x1], draw)
+                if hands:
+                    self.hits += 1
+                    hands = [_offset_hand(hand, x0, y0) for hand in hands]
+                    self._last_bbox.put(session_id, tuple(hands[0]['bbox']))
+                    if draw:
+                        img[y0:y1, x0:x1] = annotated
+                    return hands, img if draw else None
+            self.misses += 1
+
+        hands, annotated = await service.adetect(img, draw)
+        if hands:
+            self._last_bbox.put(session_id, tuple(hands[0]['bbox']))
+        else:
+            self._last_bbox.delete(session_id)
+        return hands, annotated
+
+
+_service = None
+_service_lock = threading.Lock()
+_tracker = None
+
+
+def get_detection_service():
+    """Returns the process-wide detection service, starting its workers on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = DetectionService(
+                    workers=settings.DETECTOR_WORKERS,
+                    max_pending=settings.DETECTOR_MAX_PENDING,
+                    max_hands=settings.DETECTOR_MAX_HANDS,
+                    detection_con=settings.DETECTOR_CONFIDENCE,
+                    batch_window=settings.DETECTOR_BATCH_WINDOW_MS / 1000,
+                    batch_max_size=settings.DETECTOR_BATCH_MAX_SIZE,
+                    warmup=settings.DETECTOR_WARMUP,
+                    start_method=settings.DETECTOR_START_METHOD,
+                    shared_frames=settings.DETECTOR_SHARED_FRAMES,
+                    frame_slot_bytes=settings.DETECTOR_FRAME_SLOT_BYTES,
+                )
+    return _service
+
+
+def preload_vision_stack():
+    """
+    With the forkserver start method, starts this process's fork server with
+    cvzone and MediaPipe already imported. Call it in each web worker, not
+    before they are forked.
+    """
+    if settings.DETECTOR_START_METHOD != 'forkserver' or settings.DETECTOR_WORKERS <= 0:
+        return
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['cvzone.HandTrackingModule'])
+    from multiprocessing import forkserver
+    forkserver.ensure_running()
+
+
+def start_detection_warmup():
+    """Warms the detection service up on a background thread; returns that thread."""
+    thread = threading.Thread(target=get_detection_service().warm_up, name='detector-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_roi_tracker():
+    """Returns the process-wide ROI tracker, or None when ROI_TRACKING is off or several hands are wanted."""
+    global _tracker
+    if not settings.ROI_TRACKING or settings.DETECTOR_MAX_HANDS > 1:
+        return None
+    if _tracker is None:
+        _tracker = RoiTracker(settings.ROI_MARGIN, settings.VOM_STORE_MAX_SESSIONS, ttl=60)
+    return _tracker
+
+
+async def adetect_for_session(session_id, img, draw=False):
+    """Detects hands in a session's frame, through the ROI tracker when it is enabled."""
+    service = get_detection_service()
+    tracker = get_roi_tracker()
+    if tracker is None:
+        return await service.adetect(img, draw)
+    return await tracker.adetect(service, session_id, img, draw)
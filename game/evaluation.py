@@ -0,0 +1,209 @@
+"""
+Offline evaluation of the AI opponents.
+
+A corpus is a batch of the player's move sequences: an int8 array of moves
+(1-3, padded with 0) and the length of each sequence. Every strategy plays
+each sequence as one game, predicting before each move and learning from it
+afterwards, just as the views do. The corpora are fixed sequences, so the
+synthetic players do not react to what the AI throws.
+
+The Markov strategies and the random baseline step through all sequences of
+a chunk at once with NumPy. VOM and the ensemble are sequential by nature
+and play the models of game/strategies.py one sequence at a time. For both kinds, chunks of sequences are spread over
+worker processes.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from .strategies import new_model
+
+# Rows are indexed by move (1-3); row 0 is the padding.
+BEAT = np.array([0, 2, 3, 1], np.int8)
+# How often the Markov strategies of test.py play at random instead.
+MARKOV_EXPLORE = 0.33
+SYNTHETIC_PLAYERS = ('random', 'biased', 'cyclic', 'markov', 'switching')
+# Rounds a 'switching' player keeps one habit.
+SWITCH_EVERY = 100
+
+
+def synthetic_corpus(kind, sequences, rounds, seed=0):
+    """
+    Generates ``sequences`` games of ``rounds`` moves from one kind of player:
+
+    - random: uniform moves;
+    - biased: each player favours moves with their own fixed weights;
+    - cyclic: rock, paper, scissors (or the reverse) with 10% noise;
+    - markov: each player's next move depends on their last one;
+    - switching: a markov player who takes up new habits every SWITCH_EVERY
+      rounds.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (sequences, rounds)
+    if kind == 'random':
+        moves = rng.integers(0, 3, shape)
+    elif kind == 'biased':
+        cumulative = rng.dirichlet([0.5] * 3, sequences).cumsum(1)
+        moves = (rng.random(shape)[:, :, None] > cumulative[:, None, :2]).sum(2)
+    elif kind == 'cyclic':
+        start = rng.integers(0, 3, (sequences, 1))
+        step = rng.choice([1, 2], (sequences, 1))
+        moves = (start + step * np.arange(rounds)) % 3
+        moves = np.where(rng.random(shape) < 0.1, rng.integers(0, 3, shape), moves)
+    elif kind in ('markov', 'switching'):
+        cumulative = rng.dirichlet([0.5] * 3, (sequences, 3)).cumsum(2)
+        rows = np.arange(sequences)
+        moves = np.empty(shape, np.int64)
+        moves[:, 0] = rng.integers(0, 3, sequences)
+        for t in range(1, rounds):
+            if kind == 'switching' and t % SWITCH_EVERY == 0:
+                cumulative = rng.dirichlet([0.5] * 3, (sequences, 3)).cumsum(2)
+            moves[:, t] = (rng.random(sequences)[:, None] > cumulative[rows, moves[:, t - 1], :2]).sum(1)
+    else:
+        raise ValueError(f'Unknown synthetic player {kind!r}.')
+    return (moves + 1).astype(np.int8), np.full(sequences, rounds)
+
+
+def pad_sequences(games):
+    """Packs lists of moves (1-3) into a corpus."""
+    lengths = np.array([len(moves) for moves in games], np.int64)
+    moves = np.zeros((len(games), lengths.max(initial=0)), np.int8)
+    for i, game in enumerate(games):
+        moves[i, :len(game)] = game
+    return moves, lengths
+
+
+def recorded_corpus():
+    """Every logged game session with at least one round."""
+    from .models import Round
+    from .round_log import MOVE_TO_INT
+
+    games = {}
+    for session_id, player_move in Round.objects.order_by('id').values_list('session_id', 'player_move').iterator():
+        games.setdefault(session_id, []).append(MOVE_TO_INT[player_move])
+    return pad_sequences(list(games.values()))
+
+
+def play_random(moves, lengths, rng, **options):
+    return rng.integers(1, 4, moves.shape).astype(np.int8)
+
+
+def play_markov(moves, lengths, rng, order, **options):
+    """
+    The Markov model of test.py for any order: a per-game table of next-move
+    probabilities after each context of ``order`` moves, renormalized after
+    every update, with MARKOV_EXPLORE random moves.
+    """
+    sequences, rounds = moves.shape
+    rows = np.arange(sequences)
+    table = np.full((sequences, 3 ** order, 3), 1 / 3)
+    ai = rng.integers(1, 4, moves.shape).astype(np.int8)
+    explore = rng.random(moves.shape) < MARKOV_EXPLORE
+    outcome = moves.astype(np.int64) - 1
+    for t in range(order, rounds):
+        # Oldest move in the highest digit, as in get_sequence_index.
+        context = np.zeros(sequences, np.int64)
+        for j in range(t - order, t):
+            context = context * 3 + outcome[:, j]
+        predicted = table[rows, context].argmax(1) + 1
+        ai[:, t] = np.where(explore[:, t], ai[:, t], BEAT[predicted])
+
+        active = rows[t < lengths]
+        cells = table[active, context[active]]
+        cells[np.arange(len(active)), outcome[active, t]] += 1
+        table[active, context[active]] = cells / cells.sum(1, keepdims=True)
+    return ai
+
+
+def play_model(moves, lengths, rng, strategy, max_order=5, threshold=1):
+    """A strategy model of the game views, falling back to random moves."""
+    ai = rng.integers(1, 4, moves.shape).astype(np.int8)
+    beat = BEAT.tolist()
+    for i, length in enumerate(lengths.tolist()):
+        model = new_model(strategy, max_order, threshold)
+        predict, update = model.predict, model.update
+        row = ai[i].tolist()
+        for t, move in enumerate(moves[i, :length].tolist()):
+            predicted = predict()
+            if predicted is not None:
+                row[t] = beat[predicted]
+            update(move)
+        ai[i] = row
+    return ai
+
+
+STRATEGIES = {
+    'random': play_random,
+    'markov1': partial(play_markov, order=1),
+    'markov2': partial(play_markov, order=2),
+    'vom': partial(play_model, strategy='vom'),
+    'vom_decay': partial(play_model, strategy='vom_decay'),
+    'ensemble': partial(play_model, strategy='ensemble'),
+}
+
+
+def _play_chunk(strategy, moves, lengths, seed, options):
+    start = time.process_time()
+    ai = STRATEGIES[strategy](moves, lengths, np.random.default_rng(seed), **options)
+    return ai, time.process_time() - start
+
+
+def convergence_round(ai_wins, active, window=20):
+    """
+    First round at which the AI's win rate, averaged over all games and a
+    ``window`` of rounds, gets 90% of the way from chance to its final level
+    (the mean over the last quarter of the games). None if the AI never gets
+    a real edge.
+    """
+    played = active.sum(0)
+    curve = ai_wins.sum(0) / np.maximum(played, 1)
+    curve = curve[played > 0]
+    if len(curve) < 2 * window:
+        return None
+    plateau = curve[-len(curve) // 4:].mean()
+    if plateau < 1 / 3 + 0.05:
+        return None
+    smoothed = np.convolve(curve, np.ones(window) / window, 'valid')
+    reached = np.flatnonzero(smoothed >= 1 / 3 + 0.9 * (plateau - 1 / 3))
+    return int(reached[0]) + window if len(reached) else None
+
+
+def evaluate(strategy, moves, lengths, seed=0, jobs=1, chunk_size=250, **options):
+    """
+    Plays every game of the corpus against ``strategy``. Returns the AI's
+    win, loss and tie rates, the round it converges at, and the CPU time per
+    round (prediction plus update).
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown strategy {strategy!r}.')
+    seeds = np.random.SeedSequence(seed).spawn(max(1, -(-len(moves) // chunk_size)))
+    chunks = [
+        (strategy, moves[i:i + chunk_size], lengths[i:i + chunk_size], seeds[n], options)
+        for n, i in enumerate(range(0, len(moves), chunk_size))
+    ]
+    start = time.perf_counter()
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_play_chunk, *zip(*chunks)))
+    else:
+        results = [_play_chunk(*chunk) for chunk in chunks]
+    wall = time.perf_counter() - start
+
+    ai = np.concatenate([r[0] for r in results]) if results else np.zeros(moves.shape, np.int8)
+    active = np.arange(moves.shape[1]) < lengths[:, None]
+    ai_wins = (BEAT[moves] == ai) & active
+    ai_losses = (BEAT[ai] == moves) & active
+    rounds = int(active.sum())
+    total = max(rounds, 1)
+    return {
+        'rounds': rounds,
+        'win_rate': ai_wins.sum() / total,
+        'loss_rate': ai_losses.sum() / total,
+        'tie_rate': ((ai == moves) & active).sum() / total,
+        'converged_after': convergence_round(ai_wins, active),
+        'us_per_round': sum(r[1] for r in results) / total * 1e6,
+        'wall_seconds': wall,
+    }
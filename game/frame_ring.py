@@ -0,0 +1,91 @@
+"""
+Decoded frames handed to the detection workers through shared memory.
+
+Sending a frame to a ``ProcessPoolExecutor`` worker pickles it and writes it
+down a pipe, and the worker unpickles it into a fresh array: two copies and
+two allocations of about 900 KB for a 640x480 BGR frame, plus the pickling
+itself. ``FrameRing`` is one ``multiprocessing.shared_memory`` block cut into
+fixed-size slots. The web process copies a frame into a free slot and sends
+the worker only a ``FrameSlot`` (the slot's index and the frame's shape); the
+worker runs MediaPipe on a NumPy view of the slot and sends back the
+landmarks. Annotations are drawn on the slot in place and copied out by the
+web process.
+
+Only the web process that created a ring hands out its slots, so the free
+list is a plain list under a lock. A frame that is larger than a slot, or
+that arrives while every slot is taken, is sent the old way.
+"""
+
+import atexit
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FrameSlot = namedtuple('FrameSlot', 'index shape')
+
+
+class FrameRing:
+    def __init__(self, slots, slot_bytes, name=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        # Frames that could not have a slot and were pickled instead.
+        self.fallbacks = 0
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+            self._free = list(range(slots))
+            atexit.register(self.close)
+        else:
+            # Workers share their parent's resource tracker, so the
+            # registration that attaching makes (before Python 3.13) is the
+            # owner's own and nothing is unlinked when a worker exits.
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._free = []
+        self.name = self._shm.name
+        self._lock = threading.Lock()
+
+    @classmethod
+    def attach(cls, name, slots, slot_bytes):
+        """The ring created as ``name`` by another process, for reading its slots."""
+        return cls(slots, slot_bytes, name=name)
+
+    def view(self, slot):
+        """The frame in ``slot`` as a uint8 array backed by the shared memory."""
+        return np.ndarray(slot.shape, np.uint8, self._shm.buf, offset=slot.index * self.slot_bytes)
+
+    def put(self, img):
+        """Copies ``img`` into a free slot and returns the slot, or None if it does not fit or none is free."""
+        if img.dtype != np.uint8 or img.nbytes > self.slot_bytes:
+            self.fallbacks += 1
+            return None
+        with self._lock:
+            if not self._free:
+                self.fallbacks += 1
+                return None
+            index = self._free.pop()
+        slot = FrameSlot(index, img.shape)
+        np.copyto(self.view(slot), img)
+        return slot
+
+    def release(self, slot):
+        with self._lock:
+            self._free.append(slot.index)
+
+    @property
+    def free(self):
+        return len(self._free)
+
+    def close(self):
+        """Detaches from the ring; the owner also removes it."""
+        if self._shm is None:
+            return
+        if self.owner:
+            self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            # A view of a slot is still alive; the mapping goes with the process.
+            pass
+        self._shm = None
@@ -0,0 +1,210 @@
+"""
+Rock/paper/scissors classification from MediaPipe hand landmarks.
+
+Instead of the exact ``fingersUp`` pattern match, each finger gets a
+continuous extension score in [0, 1] built from the bend at its middle
+joint and from how far its tip reaches from the wrist relative to that
+joint. The thumb, which rarely lines up with the other fingers, is scored
+from the distance between its tip and the index knuckle, normalised by
+palm size. These features do not depend on image scale, hand rotation or
+handedness. The five scores are matched against a template per move;
+fingers whose landmarks are missing, or that a move does not care about
+(the thumb in scissors), carry no weight.
+
+``GestureVoter`` combines the classification of a session's last few
+frames, so one noisy frame at the moment of capture no longer voids the
+round.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .model_store import LocalModelStore
+
+WRIST = 0
+# (knuckle, middle joint, upper joint, tip) for index, middle, ring and pinky.
+FINGER_JOINTS = ((5, 6, 7, 8), (9, 10, 11, 12), (13, 14, 15, 16), (17, 18, 19, 20))
+THUMB_JOINTS = (2, 3, 4)
+VOTE_DECAY = 0.7
+
+# Expected extension of (thumb, index, middle, ring, pinky) for each move,
+# with the weight each finger carries in the match.
+TEMPLATES = {
+    'rock': ((0, 0, 0, 0, 0), (0.5, 1, 1, 1, 1)),
+    'paper': ((1, 1, 1, 1, 1), (0.5, 1, 1, 1, 1)),
+    'scissors': ((0, 1, 1, 0, 0), (0, 1, 1, 1, 1)),
+}
+
+
+def _ramp(value, low, high):
+    return min(max((value - low) / (high - low), 0.0), 1.0)
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def _angle(a, b, c):
+    """Angle at ``b`` in degrees between the segments to ``a`` and ``c``."""
+    v1 = (a[0] - b[0], a[1] - b[1])
+    v2 = (c[0] - b[0], c[1] - b[1])
+    norm = math.hypot(*v1) * math.hypot(*v2)
+    if not norm:
+        return 0.0
+    cos = (v1[0] * v2[0] + v1[1] * v2[1]) / norm
+    return math.degrees(math.acos(min(max(cos, -1.0), 1.0)))
+
+
+def finger_extensions(lm_list):
+    """
+    Returns how extended (thumb, index, middle, ring, pinky) are, each in
+    [0, 1], or None for a finger whose landmarks are missing. ``lm_list`` is
+    the detector's 21 landmarks; individual points may be None.
+    """
+    def point(i):
+        return lm_list[i] if i < len(lm_list) else None
+
+    wrist = point(WRIST)
+    extensions = []
+
+    mcp, ip, tip = (point(i) for i in THUMB_JOINTS)
+    index_mcp, middle_mcp = point(5), point(9)
+    if None in (wrist, mcp, ip, tip, index_mcp, middle_mcp) or not _distance(wrist, middle_mcp):
+        extensions.append(None)
+    else:
+        palm = _distance(wrist, middle_mcp)
+        reach = _ramp(_distance(tip, index_mcp) / palm, 0.35, 0.8)
+        straight = _ramp(_angle(mcp, ip, tip), 120, 165)
+        extensions.append((2 * reach + straight) / 3)
+
+    for joints in FINGER_JOINTS:
+        mcp, pip, _, tip = (point(i) for i in joints)
+        if None in (wrist, mcp, pip, tip) or not _distance(wrist, pip):
+            extensions.append(None)
+            continue
+        straight = _ramp(_angle(mcp, pip, tip), 90, 160)
+        reach = _ramp(_distance(wrist, tip) / _distance(wrist, pip), 0.9, 1.3)
+        extensions.append((straight + reach) / 2)
+    return extensions
+
+
+def classify_landmarks(lm_list):
+    """
+    Returns ``(move, confidence)`` for one hand, where confidence in [0, 1]
+    is how closely the best template matched. A template is only considered
+    when at least two of the fingers it weighs fully are visible. ``move`` is
+    None when no template reaches GESTURE_MIN_CONFIDENCE.
+    """
+    if not lm_list:
+        return None, 0.0
+    extensions = finger_extensions(lm_list)
+    best_move, best_score = None, 0.0
+    for move, (expected, weights) in TEMPLATES.items():
+        total = error = 0.0
+        for value, target, weight in zip(extensions, expected, weights):
+            if value is not None and weight:
+                total += weight
+                error += weight * abs(value - target)
+        if total >= 2:
+            score = 1 - error / total
+            if score > best_score:
+                best_move, best_score = move, score
+    if best_score < settings.GESTURE_MIN_CONFIDENCE:
+        return None, best_score
+    return best_move, best_score
+
+
+class GestureVoter:
+    """
+    Keeps each session's recent classifications and combines them into a
+    single move and confidence. Each older frame counts VOTE_DECAY times as
+    much as the one after it, and a move wins only with a weighted majority,
+    so one stray frame is outvoted by the ones before it. Frames in which no
+    hand was found are not evidence either way and are not kept.
+    """
+
+    def __init__(self, frames, window, max_sessions, ttl):
+        self.frames = frames
+        self.window = window
+        self._history = LocalModelStore(max_sessions, ttl)
+        self._lock = threading.Lock()
+
+    def add(self, session_id, move, confidence):
+        with self._lock:
+            history = self._history.get(session_id)
+            if history is None:
+                history = deque(maxlen=self.frames)
+                self._history.put(session_id, history)
+            history.append((time.monotonic(), move, confidence))
+
+    def vote(self, session_id):
+        """Returns ``(move, confidence)`` over the session's frames from the last ``window`` seconds."""
+        history = self._history.get(session_id)
+        if not history:
+            return None, 0.0
+        cutoff = time.monotonic() - self.window
+        votes = {}
+        scores = {}
+        total = 0.0
+        weight = 1.0
+        for seen_at, move, confidence in reversed(history):
+            if seen_at < cutoff:
+                break
+            total += weight
+            if move is not None:
+                votes[move] = votes.get(move, 0.0) + weight
+                scores[move] = scores.get(move, 0.0) + weight * confidence
+            weight *= VOTE_DECAY
+        if not votes:
+            return None, 0.0
+        move = max(votes, key=votes.get)
+        confidence = scores[move] / total
+        if votes[move] <= total / 2:
+            return None, confidence
+        return move, confidence
+
+    def reset(self, session_id):
+        self._history.delete(session_id)
+
+
+_voter = None
+
+
+def get_gesture_voter():
+    global _voter
+    if _voter is None:
+        _voter = GestureVoter(
+            settings.GESTURE_VOTE_FRAMES,
+            settings.GESTURE_VOTE_WINDOW,
+            settings.VOM_STORE_MAX_SESSIONS,
+            ttl=60,
+        )
+    return _voter
+
+
+def assign_players(hands):
+    """
+    Splits a frame's two hands into ``(left, right)`` players, as they see
+    themselves on the mirrored page: the hand further right in the camera's
+    image is the left player's. None unless there are exactly two hands.
+    """
+    if len(hands) != 2:
+        return None
+    right, left = sorted(hands, key=lambda hand: hand['bbox'][0] + hand['bbox'][2] / 2)
+    return left, right
+
+
+def record_frame(session_id, hands):
+    """Classifies the first hand in a frame and adds it to the session's votes."""
+    if hands:
+        get_gesture_voter().add(session_id, *classify_landmarks(hands[0]['lmList']))
+
+
+def classify_session_frame(session_id, hands):
+    """Records a frame and returns the session's combined ``(move, confidence)``."""
+    record_frame(session_id, hands)
+    return get_gesture_voter().vote(session_id)
@@ -0,0 +1,321 @@
+"""
+Frame decoding and encoding for the image endpoints.
+
+Browsers post ``{"image": "data:image/jpeg;base64,...", ...}`` bodies that
+are almost entirely base64. ``split_image_payload`` finds that field in the
+raw body and hands back a memoryview of it, so the large string is never
+built as a Python ``str``, split or sliced; only the small remainder of the
+body goes through ``json.loads``.
+
+``read_image_payload`` does the same from the request stream without ever
+holding the whole body: it reads the body in chunks, keeps only the bytes
+outside the image, and base64-decodes the image chunk by chunk into a
+per-thread buffer that is reused from one request to the next. Like
+``request.body`` it refuses bodies over ``max_size``, before reading them
+when the length is known, and a buffer grown past ``MAX_SCRATCH_BYTES`` for
+an unusually large image is not kept for the next request.
+
+``decode_jpeg`` reads the frame size from the JPEG header and lets libjpeg
+decode straight to 1/2, 1/4 or 1/8 scale when the frame is much larger than
+the detector needs, which is far cheaper than decoding at full size.
+
+``encode_jpeg`` goes the other way for annotated images, at a chosen quality
+and scale. cv2.imencode cannot write into a caller's buffer, so the reuse is
+of the downscaled frame's buffer (one per thread and size), and the JPEG is
+handed on as a memoryview of the encoder's output rather than copied to bytes.
+"""
+
+import binascii
+import json
+import threading
+
+import cv2
+import numpy as np
+from django.core.exceptions import RequestDataTooBig
+
+_IMAGE_KEY = b'"image"'
+CHUNK_SIZE = 8 * 1024
+# Largest decode buffer kept for the thread's next request.
+MAX_SCRATCH_BYTES = 2 * 1024 * 1024
+_REDUCED_READS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def split_image_payload(body):
+    """
+    Splits a JSON request body into its small fields and its image.
+
+    Returns ``(data, image)`` where ``data`` is the parsed JSON with the image
+    field emptied and ``image`` is a memoryview of the base64 text after the
+    data URL's comma, or None when the body has no usable image field.
+    Raises ``ValueError`` for bodies that are not valid JSON.
+    """
+    key = body.find(_IMAGE_KEY)
+    while key >= 0:
+        value_start = key + len(_IMAGE_KEY)
+        quote = body.find(b'"', value_start)
+        # Skip "image" where it is a value, as in "mode": "image".
+        if quote >= 0 and body[value_start:quote].strip() == b':':
+            end = body.find(b'"', quote + 1)
+            if end >= 0:
+                data = json.loads(body[:quote + 1] + body[end:])
+                comma = body.find(b',', quote + 1, end)
+                image = memoryview(body)[comma + 1:end] if comma >= 0 else None
+                if image is not None and body.find(b'\\', comma + 1, end) >= 0:
+                    image = memoryview(_unescape(image))
+                return data, image
+        key = body.find(_IMAGE_KEY, value_start)
+    return json.loads(body), None
+
+
+def _find_image_value(head, start):
+    """
+    Index of the opening quote of the "image" value in ``head``, or None.
+    Also returns where to resume looking once more of the body has arrived.
+    """
+    key = head.find(_IMAGE_KEY, start)
+    while key >= 0:
+        value_start = key + len(_IMAGE_KEY)
+        quote = head.find(b'"', value_start)
+        if quote < 0:
+            return None, key
+        if head[value_start:quote].strip() == b':':
+            return quote, key
+        key = head.find(_IMAGE_KEY, value_start)
+    return None, max(start, len(head) - len(_IMAGE_KEY) + 1)
+
+
+def _unescape(text):
+    """
+    The base64 in the JSON string contents ``text``: escapes decoded, and the
+    line breaks and anything else that is not ASCII dropped, so that what is
+    left splits into four-character groups.
+    """
+    return json.loads(b'"' + bytes(text) + b'"').encode('ascii', 'ignore').translate(None, b' \t\r\n')
+
+
+def _whole_escapes(text):
+    """Length of the longest prefix of ``text`` that does not end inside a JSON escape."""
+    i = text.find(b'\\')
+    while i >= 0:
+        size = 6 if text[i + 1:i + 2] == b'u' else 2
+        if i + size > len(text):
+            return i
+        i = text.find(b'\\', i + size)
+    return len(text)
+
+
+def _decode_buffer(size):
+    buffer = getattr(_scratch, 'decoded', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _keep_scratch(bytearray(size))
+    return buffer
+
+
+def _keep_scratch(buffer):
+    """Makes ``buffer`` the thread's decode buffer unless it is too large to keep around."""
+    if len(buffer) <= MAX_SCRATCH_BYTES:
+        _scratch.decoded = buffer
+    return buffer
+
+
+def _limit_reads(read, max_size):
+    """``read`` that raises RequestDataTooBig once more than ``max_size`` bytes have come through it."""
+    total = 0
+
+    def limited(size):
+        nonlocal total
+        chunk = read(size)
+        total += len(chunk)
+        if total > max_size:
+            raise RequestDataTooBig('Request body exceeded settings.DATA_UPLOAD_MAX_MEMORY_SIZE.')
+        return chunk
+
+    return limited
+
+
+def _read_rest(read, chunk_size):
+    parts = []
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            return b''.join(parts)
+        parts.append(chunk)
+
+
+def read_image_payload(read, size_hint=0, chunk_size=CHUNK_SIZE, max_size=None):
+    """
+    ``split_image_payload`` for a body read from a stream with ``read(n)``,
+    with the image already base64-decoded. ``size_hint`` is the body's
+    length, if known, to size the decode buffer up front.
+
+    Returns ``(data, image)`` where ``image`` is a memoryview of the JPEG
+    bytes in this thread's buffer, good until the thread's next call, or None
+    when the body has no usable image. Raises ``ValueError`` for bodies that
+    are not valid JSON, and RequestDataTooBig for ones over ``max_size``.
+    """
+    if max_size is not None:
+        if size_hint > max_size:
+            raise RequestDataTooBig('Request body exceeded settings.DATA_UPLOAD_MAX_MEMORY_SIZE.')
+        read = _limit_reads(read, max_size)
+    head = b''
+    start = 0
+    quote = None
+    while True:
+        chunk = read(chunk_size)
+        # Usually the image starts in the first chunk, which is then used as is.
+        head = head + chunk if head else chunk
+        if quote is None:
+            quote, start = _find_image_value(head, start)
+        if quote is not None:
+            comma = head.find(b',', quote + 1)
+            end = head.find(b'"', quote + 1)
+            if end >= 0 and not 0 <= comma < end:
+                # Not a data URL; let split_image_payload deal with the rest.
+                comma = -1
+            if comma >= 0 or end >= 0:
+                break
+        if not chunk:
+            comma = -1
+            break
+    if comma < 0:
+        head += _read_rest(read, chunk_size)
+        data, image = split_image_payload(bytes(head))
+        if image is not None:
+            try:
+                image = memoryview(binascii.a2b_base64(image))
+            except (binascii.Error, ValueError):
+                image = None
+        return data, image
+
+    prefix = bytes(head[:quote + 1])
+    decoded = _decode_buffer(max(size_hint * 3 // 4, 1))
+    length = 0
+    carry = escaped = b''
+    buf, start = head, comma + 1
+    while True:
+        end = buf.find(b'"', start)
+        stop = len(buf) if end < 0 else end
+        text = memoryview(buf)[start:stop]
+        if escaped or buf.find(b'\\', start, stop) >= 0:
+            # Line-wrapped base64 arrives with "\n" escapes; one split across
+            # chunks is finished with the next.
+            text = escaped + bytes(text)
+            whole = len(text) if end >= 0 else _whole_escapes(text)
+            text, escaped = _unescape(text[:whole]), text[whole:]
+        if carry:
+            # Complete the four-character group left over from earlier chunks,
+            # which takes more than one more when the stream trickles in.
+            take = 4 - len(carry)
+            carry, text = carry + bytes(text[:take]), text[take:]
+            if len(carry) == 4 or end >= 0:
+                decoded, length = _append_base64(decoded, length, carry)
+                carry = b''
+        # Base64 decodes in groups of four characters; the rest waits for the next chunk.
+        usable = len(text) if end >= 0 else len(text) - len(text) % 4
+        decoded, length = _append_base64(decoded, length, text[:usable])
+        carry += bytes(text[usable:])
+        if end >= 0:
+            break
+        buf, start = read(chunk_size), 0
+        if not buf:
+            raise ValueError('Unterminated image field.')
+
+    data = json.loads(prefix + bytes(buf[end:]) + _read_rest(read, chunk_size))
+    return data, memoryview(decoded)[:length] if length >= 0 else None
+
+
+def _append_base64(decoded, length, text):
+    """
+    Decodes ``text`` onto the end of the first ``length`` bytes of
+    ``decoded``. A ``length`` of -1 marks an image that failed to decode.
+    """
+    if length < 0 or not len(text):
+        return decoded, length
+    try:
+        part = binascii.a2b_base64(text)
+    except (binascii.Error, ValueError):
+        return decoded, -1
+    if length + len(part) > len(decoded):
+        # The size hint was short. A new buffer, as the last image may still be in use.
+        grown = bytearray(2 * (length + len(part)))
+        grown[:length] = decoded[:length]
+        decoded = _keep_scratch(grown)
+    decoded[length:length + len(part)] = part
+    return decoded, length + len(part)
+
+
+def jpeg_size(data):
+    """Returns ``(width, height)`` from a JPEG's frame header, or None if it is not a JPEG."""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i, n = 2, len(data)
+    while i + 9 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        # SOF0-SOF15 hold the frame size; C4, C8 and CC are other segments.
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+def _read_flag(data, target_width):
+    if target_width:
+        size = jpeg_size(data)
+        if size:
+            for factor, flag in _REDUCED_READS:
+                if size[0] // factor >= target_width:
+                    return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_jpeg(data, target_width=0):
+    """
+    Decodes image bytes to a BGR array, at a reduced scale if the image is at
+    least twice ``target_width`` wide. Returns None for undecodable data.
+    """
+    np_arr = np.frombuffer(data, np.uint8)
+    if not np_arr.size:
+        return None
+    return cv2.imdecode(np_arr, _read_flag(data, target_width))
+
+
+def decode_base64_image(b64, target_width=0):
+    """Decodes base64 text (str, bytes or memoryview) holding a JPEG; None if it is invalid."""
+    try:
+        data = binascii.a2b_base64(b64)
+    except (binascii.Error, ValueError):
+        return None
+    return decode_jpeg(data, target_width)
+
+
+_scratch = threading.local()
+
+
+def encode_jpeg(img, quality=95, scale=1.0):
+    """JPEG bytes (as a memoryview) of ``img`` resized by ``scale`` (at most 1)."""
+    if scale < 1:
+        height, width = img.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        buffers = getattr(_scratch, 'buffers', None)
+        if buffers is None:
+            buffers = _scratch.buffers = {}
+        key = (size, img.shape[2:])
+        dst = buffers.get(key)
+        if dst is None:
+            dst = buffers[key] = np.empty((size[1], size[0]) + img.shape[2:], np.uint8)
+        img = cv2.resize(img, size, dst=dst, interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError('Could not encode the image.')
+    return buffer.reshape(-1).data
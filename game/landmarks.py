@@ -0,0 +1,103 @@
+"""
+Hands detected in the browser.
+
+With ``CLIENT_INFERENCE`` on, the page can run MediaPipe Hands itself and
+post a flat list of 21 (x, y) pixel pairs instead of a JPEG.
+``parse_landmark_vector`` rejects anything that cannot be a hand in the
+stated frame. The result then goes through the same gesture classification,
+voting and AI as a server-side detection.
+
+The client could still lie about its hand, so ``SpotChecker`` picks a random
+``LANDMARK_SPOT_CHECK_RATE`` of final rounds to be settled from a real frame
+instead. The page then uploads the frame it classified to analyze_frame,
+which compares the server's reading with the claimed move.
+"""
+
+import math
+import random
+
+from django.conf import settings
+
+from .model_store import LocalModelStore
+
+LANDMARK_COUNT = 21
+# How far outside the frame a landmark may be (MediaPipe extrapolates fingers
+# cut off by the frame edge), as a fraction of the frame size.
+FRAME_MARGIN = 0.25
+
+
+def parse_landmark_vector(values, width, height):
+    """
+    Validates a client-detected hand given as ``[x0, y0, x1, y1, ...]`` in a
+    ``width`` x ``height`` frame. Returns the landmarks as ``[[x, y], ...]``,
+    or None when ``values`` is None (no hand). Raises ``ValueError`` for
+    anything that is not a plausible hand.
+    """
+    if values is None:
+        return None
+    for size in (width, height):
+        if not isinstance(size, int) or isinstance(size, bool) or not 16 <= size <= 4096:
+            raise ValueError('Invalid frame size.')
+    if not isinstance(values, list) or len(values) != 2 * LANDMARK_COUNT:
+        raise ValueError(f'Expected {2 * LANDMARK_COUNT} coordinates.')
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError('Coordinates must be numbers.')
+
+    points = [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
+    for x, y in points:
+        if not (-FRAME_MARGIN * width <= x <= (1 + FRAME_MARGIN) * width
+                and -FRAME_MARGIN * height <= y <= (1 + FRAME_MARGIN) * height):
+            raise ValueError('Landmark outside the frame.')
+    # Wrist to middle knuckle; every landmark of a real hand lies within a few
+    # palm lengths of the wrist.
+    palm = math.dist(points[0], points[9])
+    if palm < 0.02 * min(width, height):
+        raise ValueError('Hand too small.')
+    if any(math.dist(points[0], point) > 4 * palm for point in points):
+        raise ValueError('Landmarks do not form a hand.')
+    return points
+
+
+class SpotChecker:
+    """Chooses client-inference rounds to verify and compares the verdicts."""
+
+    def __init__(self, rate, max_sessions, ttl):
+        self.rate = rate
+        self.checked = 0
+        self.mismatches = 0
+        self._claims = LocalModelStore(max_sessions, ttl)
+
+    def claim(self, session_id, move):
+        """
+        Returns True if the round the client claims as ``move`` must be settled
+        from a real frame, remembering the claim until then.
+        """
+        if random.random() >= self.rate:
+            return False
+        self._claims.put(session_id, move)
+        return True
+
+    def pending(self, session_id):
+        return self._claims.get(session_id) is not None
+
+    def verify(self, session_id, move):
+        """Compares the server's reading with a pending claim; None if there was none."""
+        claimed = self._claims.get(session_id)
+        if claimed is None:
+            return None
+        self._claims.delete(session_id)
+        self.checked += 1
+        if claimed != move:
+            self.mismatches += 1
+        return claimed == move
+
+
+_checker = None
+
+
+def get_spot_checker():
+    global _checker
+    if _checker is None:
+        _checker = SpotChecker(settings.LANDMARK_SPOT_CHECK_RATE, settings.VOM_STORE_MAX_SESSIONS, ttl=60)
+    return _checker
@@ -0,0 +1,195 @@
+"""
+Per-player stats and the leaderboard, kept up to date round by round.
+
+Nothing here scans the round history. Each named player's totals (games,
+rounds, wins, losses, ties and how often they threw each move) are one
+value in the 'stats' cache, and every settled round adds to them. The
+leaderboard is a second value: the top ``LEADERBOARD_SIZE`` players by
+wins, as ``[wins, username]`` pairs. A player's wins only ever go up, so
+when one of them wins a round, moving them up the list keeps it exact.
+Reading either costs one cache get, however many rounds are stored.
+
+The stats cache has to be shared by every worker, so PLAYER_STATS is on by
+default only with Redis; a single worker can turn it on without. A player only plays one round at a time, so read-modify-write
+of their totals does not race, even across workers. The leaderboard can:
+two workers updating it at once may drop a name. Each checkpoint merges it
+with the top rows of the database, which puts any such name back.
+
+``StatsBoard`` writes the players whose totals changed to ``PlayerStats``
+every ``STATS_CHECKPOINT_INTERVAL`` seconds from a background thread. A
+player whose totals are not in the cache, after a restart or an eviction, is
+loaded from the database when their next game starts. Rounds of a game whose
+player dropped out of the cache meanwhile are not counted.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, close_old_connections
+
+from .models import PlayerStats
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('games', 'rounds', 'wins', 'losses', 'ties', 'rock', 'paper', 'scissors')
+MOVES = ('rock', 'paper', 'scissors')
+WINNER_FIELDS = {'player': 'wins', 'ai': 'losses', 'tie': 'ties'}
+# Seconds a game session stays linked to its player.
+SESSION_TTL = 24 * 3600
+TOP_KEY = 'stats:top'
+
+
+def _totals_key(username):
+    return f'stats:player:{username}'
+
+
+def _session_key(session_id):
+    return f'stats:session:{session_id}'
+
+
+def summarize(username, totals):
+    """The stats shown for a player, from their totals in FIELDS order."""
+    values = dict(zip(FIELDS, totals))
+    thrown = [values[move] for move in MOVES]
+    return {
+        'username': username,
+        'games': values['games'],
+        'rounds': values['rounds'],
+        'wins': values['wins'],
+        'win_rate': values['wins'] / values['rounds'] if values['rounds'] else 0.0,
+        'favourite_move': MOVES[thrown.index(max(thrown))] if any(thrown) else None,
+    }
+
+
+class StatsBoard:
+    def __init__(self, cache, size, interval):
+        self.cache = cache
+        self.size = size
+        self.interval = interval
+        self.checkpointed = 0
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_game(self, session_id, username):
+        """Links a new game session to its player, loading their totals from the database if needed."""
+        self.cache.set(_session_key(session_id), [username, 0], SESSION_TTL)
+        if self.cache.get(_totals_key(username)) is None:
+            row = PlayerStats.objects.filter(username=username).values_list(*FIELDS).first()
+            self.cache.add(_totals_key(username), list(row or (0,) * len(FIELDS)), None)
+
+    async def arecord(self, session_id, player_move, winner):
+        """Adds a settled round to its player's totals; rounds of anonymous sessions are skipped."""
+        session = await self.cache.aget(_session_key(session_id))
+        if session is None:
+            return
+        username, played = session
+        totals = await self.cache.aget(_totals_key(username))
+        if totals is None:
+            return
+        if not played:
+            totals[0] += 1
+            await self.cache.aset(_session_key(session_id), [username, 1], SESSION_TTL)
+        for field in ('rounds', WINNER_FIELDS[winner], player_move):
+            totals[FIELDS.index(field)] += 1
+        await self.cache.aset(_totals_key(username), totals, None)
+        if winner == 'player':
+            await self._promote(username, totals[FIELDS.index('wins')])
+        with self._lock:
+            self._dirty.add(username)
+            if self._thread is None and self.interval > 0:
+                self._thread = threading.Thread(target=self._run, name='stats-checkpoint', daemon=True)
+                self._thread.start()
+                atexit.register(self.checkpoint)
+
+    async def _promote(self, username, wins):
+        # Rounds are settled in async views, so no database here: a missing
+        # list starts empty and the next checkpoint fills it in.
+        top = [entry for entry in await self.cache.aget(TOP_KEY) or [] if entry[1] != username]
+        if len(top) < self.size or wins > top[-1][0]:
+            # Ties are in username order, as in _top_from_database.
+            position = next((i for i, entry in enumerate(top) if (-entry[0], entry[1]) > (-wins, username)), len(top))
+            top.insert(position, [wins, username])
+            del top[self.size:]
+        await self.cache.aset(TOP_KEY, top, None)
+
+    def _top_from_database(self):
+        rows = PlayerStats.objects.filter(wins__gt=0).order_by('-wins', 'username').values_list('wins', 'username')
+        return [list(row) for row in rows[:self.size]]
+
+    def stats(self, username):
+        """A player's stats (see summarize), or None for a player who has never played."""
+        totals = self.cache.get(_totals_key(username))
+        if totals is None:
+            totals = PlayerStats.objects.filter(username=username).values_list(*FIELDS).first()
+        if not totals or not totals[FIELDS.index('rounds')]:
+            return None
+        return summarize(username, totals)
+
+    def leaderboard(self):
+        """The top players by wins, best first, each with their stats."""
+        top = self.cache.get(TOP_KEY)
+        if top is None:
+            top = self._top_from_database()
+            self.cache.add(TOP_KEY, top, None)
+        cached = self.cache.get_many([_totals_key(username) for _, username in top])
+        board = []
+        for wins, username in top:
+            totals = cached.get(_totals_key(username))
+            board.append(summarize(username, totals) if totals else self.stats(username))
+        return [entry for entry in board if entry]
+
+    def checkpoint(self):
+        """Writes the players changed since the last checkpoint to the database; returns how many."""
+        with self._lock:
+            usernames, self._dirty = self._dirty, set()
+        if not usernames:
+            return 0
+        cached = self.cache.get_many([_totals_key(username) for username in usernames])
+        rows = [
+            PlayerStats(username=username, **dict(zip(FIELDS, cached[_totals_key(username)])))
+            for username in usernames if _totals_key(username) in cached
+        ]
+        try:
+            PlayerStats.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['username'], update_fields=FIELDS + ('updated_at',),
+            )
+            # Puts back anyone a concurrent update dropped from the cached list.
+            merged = {username: wins for wins, username in self._top_from_database()}
+            for wins, username in self.cache.get(TOP_KEY) or []:
+                merged[username] = max(wins, merged.get(username, 0))
+        except DatabaseError:
+            logger.exception('Could not checkpoint the stats of %d players.', len(rows))
+            with self._lock:
+                self._dirty |= usernames
+            return 0
+        top = sorted(([wins, username] for username, wins in merged.items()), key=lambda entry: (-entry[0], entry[1]))
+        self.cache.set(TOP_KEY, top[:self.size], None)
+        self.checkpointed += len(rows)
+        return len(rows)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.checkpoint()
+            close_old_connections()
+
+
+_board = None
+
+
+def get_stats_board():
+    global _board
+    if _board is None:
+        _board = StatsBoard(caches['stats'], settings.LEADERBOARD_SIZE, settings.STATS_CHECKPOINT_INTERVAL)
+    return _board
+
+
+async def arecord_stats(session_id, player_move, winner):
+    """Adds a settled round to its player's stats when PLAYER_STATS is on."""
+    if settings.PLAYER_STATS:
+        await get_stats_board().arecord(session_id, player_move, winner)
@@ -0,0 +1,55 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.evaluation import STRATEGIES, SYNTHETIC_PLAYERS, evaluate, recorded_corpus, synthetic_corpus
+from game.views import MAX_ORDER, STATISTICAL_SIGNIFICANCE_THRESHOLD
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays recorded and synthetic move sequences against each AI strategy and reports '
+        'win rate, convergence and CPU time per round.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', action='append', choices=sorted(STRATEGIES),
+                            help='Strategy to evaluate (repeatable; default: all).')
+        parser.add_argument('--player', action='append', choices=('recorded',) + SYNTHETIC_PLAYERS,
+                            help='Corpus to replay (repeatable; default: all).')
+        parser.add_argument('--sequences', type=int, default=2000, help='Games per synthetic corpus.')
+        parser.add_argument('--rounds', type=int, default=500, help='Rounds per synthetic game.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes.')
+        parser.add_argument('--max-order', type=int, default=MAX_ORDER, help='VOM context length.')
+        parser.add_argument('--threshold', type=int, default=STATISTICAL_SIGNIFICANCE_THRESHOLD,
+                            help='VOM statistical significance threshold.')
+
+    def handle(self, *args, **options):
+        strategies = options['strategy'] or list(STRATEGIES)
+        players = options['player'] or ['recorded', *SYNTHETIC_PLAYERS]
+        if options['sequences'] < 1 or options['rounds'] < 1:
+            raise CommandError('--sequences and --rounds must be positive.')
+
+        self.stdout.write(f"{'player':<9} {'strategy':<9} {'rounds':>9} {'win %':>6} {'loss %':>6} {'tie %':>6} "
+                          f"{'converged':>9} {'us/round':>8} {'wall s':>6}")
+        for player in players:
+            if player == 'recorded':
+                moves, lengths = recorded_corpus()
+                if not len(moves):
+                    self.stdout.write(f'{player:<9} no rounds logged yet')
+                    continue
+            else:
+                moves, lengths = synthetic_corpus(player, options['sequences'], options['rounds'], options['seed'])
+            for strategy in strategies:
+                result = evaluate(
+                    strategy, moves, lengths, seed=options['seed'], jobs=options['jobs'],
+                    max_order=options['max_order'], threshold=options['threshold'],
+                )
+                converged = result['converged_after']
+                self.stdout.write(
+                    f"{player:<9} {strategy:<9} {result['rounds']:>9} {100 * result['win_rate']:>6.1f} "
+                    f"{100 * result['loss_rate']:>6.1f} {100 * result['tie_rate']:>6.1f} "
+                    f"{'-' if converged is None else converged:>9} {result['us_per_round']:>8.2f} "
+                    f"{result['wall_seconds']:>6.2f}"
+                )
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameSession',
+            fields=[
+                ('session_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('username', models.CharField(blank=True, db_index=True, max_length=150)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayerSnapshot',
+            fields=[
+                ('username', models.CharField(max_length=150, primary_key=True, serialize=False)),
+                ('max_order', models.PositiveSmallIntegerField()),
+                ('counts', models.BinaryField()),
+                ('last_round_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Round',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player_move', models.CharField(choices=[('rock', 'Rock'), ('paper', 'Paper'), ('scissors', 'Scissors')], max_length=8)),
+                ('ai_move', models.CharField(choices=[('rock', 'Rock'), ('paper', 'Paper'), ('scissors', 'Scissors')], max_length=8)),
+                ('winner', models.CharField(choices=[('player', 'Player'), ('ai', 'AI'), ('tie', 'Tie')], max_length=6)),
+                ('played_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='game.gamesession')),
+            ],
+        ),
+    ]
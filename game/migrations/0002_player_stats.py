@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('username', models.CharField(max_length=150, primary_key=True, serialize=False)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('rounds', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(db_index=True, default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('ties', models.PositiveIntegerField(default=0)),
+                ('rock', models.PositiveIntegerField(default=0)),
+                ('paper', models.PositiveIntegerField(default=0)),
+                ('scissors', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,111 @@
+"""
+Session-keyed storage for per-player AI state.
+
+Views look a model up by its game session id, mutate it and put it back
+(``aget``/``aput`` from async views). Two backends are available, picked by ``settings.VOM_STORE_BACKEND``:
+
+* ``local``: an in-process LRU dict with an idle timeout. Lookups are O(1)
+  and memory is capped at ``VOM_STORE_MAX_SESSIONS`` models per worker.
+* ``cache``: the Django cache named by ``settings.VOM_STORE_CACHE`` (the
+  database cache on the default SQLite/Postgres connection, or Redis), so
+  all workers read and write the same model for a session.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LocalModelStore:
+    """In-process LRU store that also drops entries idle for longer than ``ttl`` seconds."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            entry[0] = time.monotonic()
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = [now, value]
+            self._entries.move_to_end(key)
+            self._evict(now)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aput(self, key, value):
+        self.put(key, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now):
+        # Entries are kept in access order, so idle ones are always at the front.
+        entries = self._entries
+        while entries:
+            key, (last_seen, _) = next(iter(entries.items()))
+            if len(entries) <= self.max_entries and now - last_seen <= self.ttl:
+                break
+            del entries[key]
+
+
+class CacheModelStore:
+    """Store backed by a Django cache so every worker shares the same models."""
+
+    def __init__(self, alias, ttl, prefix='vom:'):
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def put(self, key, value):
+        self.cache.set(self.prefix + key, value, timeout=self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+    async def aget(self, key):
+        return await self.cache.aget(self.prefix + key)
+
+    async def aput(self, key, value):
+        await self.cache.aset(self.prefix + key, value, timeout=self.ttl)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_model_store():
+    """Returns the process-wide model store configured in settings."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.VOM_STORE_BACKEND == 'cache':
+                    _store = CacheModelStore(settings.VOM_STORE_CACHE, settings.VOM_STORE_TTL)
+                else:
+                    _store = LocalModelStore(settings.VOM_STORE_MAX_SESSIONS, settings.VOM_STORE_TTL)
+    return _store
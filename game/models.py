@@ -1,3 +1,58 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+MOVE_CHOICES = [('rock', 'Rock'), ('paper', 'Paper'), ('scissors', 'Scissors')]
+WINNER_CHOICES = [('player', 'Player'), ('ai', 'AI'), ('tie', 'Tie')]
+
+
+class GameSession(models.Model):
+    """
+    One game page load. Sessions that never went through the page, such as
+    bare WebSocket clients, have no username.
+    """
+    session_id = models.CharField(max_length=64, primary_key=True)
+    username = models.CharField(max_length=150, blank=True, db_index=True)
+    started_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.username or 'anonymous'} ({self.session_id})"
+
+
+class Round(models.Model):
+    session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='rounds')
+    player_move = models.CharField(max_length=8, choices=MOVE_CHOICES)
+    ai_move = models.CharField(max_length=8, choices=MOVE_CHOICES)
+    winner = models.CharField(max_length=6, choices=WINNER_CHOICES)
+    played_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.player_move} vs {self.ai_move}: {self.winner}"
+
+
+class PlayerSnapshot(models.Model):
+    """A player's VOM counts as of ``last_round_id``, so a warm start only replays newer rounds."""
+    username = models.CharField(max_length=150, primary_key=True)
+    max_order = models.PositiveSmallIntegerField()
+    counts = models.BinaryField()
+    last_round_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.username} up to round {self.last_round_id}"
+
+
+class PlayerStats(models.Model):
+    """A player's totals as of the last checkpoint of the stats cache (see game/leaderboard.py)."""
+    username = models.CharField(max_length=150, primary_key=True)
+    games = models.PositiveIntegerField(default=0)
+    rounds = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0, db_index=True)
+    losses = models.PositiveIntegerField(default=0)
+    ties = models.PositiveIntegerField(default=0)
+    rock = models.PositiveIntegerField(default=0)
+    paper = models.PositiveIntegerField(default=0)
+    scissors = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.username}: {self.wins} wins in {self.rounds} rounds"
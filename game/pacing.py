@@ -0,0 +1,67 @@
+"""
+Load-aware pacing for the live annotation polls.
+
+The page polls annotate_only as often as the server tells it to: the
+suggested delay grows with the detection queue, so clients back off on their
+own when the detectors are saturated. Each session's last detection is also
+kept next to a tiny grayscale thumbnail of the frame it came from, and a new
+frame that barely differs from that thumbnail reuses the old result instead
+of going through MediaPipe again.
+"""
+
+import cv2
+from django.conf import settings
+
+from .model_store import LocalModelStore
+
+THUMBNAIL_SIZE = (32, 24)
+
+
+def suggested_poll_delay_ms(queue_depth, workers):
+    """Milliseconds the client should wait before its next annotation poll."""
+    load = queue_depth / max(workers, 1)
+    delay = settings.ANNOTATE_MIN_POLL_MS * (1 + load)
+    return int(min(delay, settings.ANNOTATE_MAX_POLL_MS))
+
+
+def frame_thumbnail(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+class FrameChangeDetector:
+    """Remembers each session's last detection and the thumbnail it was computed from."""
+
+    def __init__(self, threshold, max_sessions, ttl):
+        self.threshold = threshold
+        self.reused = 0
+        self._last = LocalModelStore(max_sessions, ttl)
+
+    def reusable_result(self, session_id, thumbnail):
+        """Returns the last result if ``thumbnail`` is close enough to the frame it came from."""
+        entry = self._last.get(session_id)
+        if entry is None:
+            return None
+        last_thumbnail, result = entry
+        # Mean absolute difference in grey levels per pixel.
+        if cv2.norm(thumbnail, last_thumbnail, cv2.NORM_L1) / thumbnail.size > self.threshold:
+            return None
+        self.reused += 1
+        return result
+
+    def remember(self, session_id, thumbnail, result):
+        self._last.put(session_id, (thumbnail, result))
+
+
+_detector = None
+
+
+def get_frame_change_detector():
+    global _detector
+    if _detector is None:
+        _detector = FrameChangeDetector(
+            settings.FRAME_CHANGE_THRESHOLD,
+            settings.VOM_STORE_MAX_SESSIONS,
+            ttl=60,
+        )
+    return _detector
@@ -0,0 +1,96 @@
+"""
+Sampling profiler for slow requests.
+
+With ``PROFILE_SLOW_REQUEST_MS`` set, a background thread samples the stack
+of every thread that has handled a timed request, every
+``PROFILE_SAMPLE_INTERVAL_MS``, into a bounded ring. When a request takes
+longer than the threshold, the samples taken during it are written to
+``PROFILE_DIR`` in collapsed-stack format (``frame;frame;frame count`` per
+line), which flamegraph.pl and speedscope read directly.
+
+Requests share the event loop thread, so a dump also contains samples from
+whatever else the loop ran during the slow request. The stage timings at the
+top of the file say which of the request's own stages were slow. Detection
+runs in worker processes and shows up only as time awaiting the result.
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SlowRequestSampler:
+    def __init__(self, interval, directory, max_samples=20000):
+        self.interval = interval
+        self.directory = directory
+        self.dumped = 0
+        self._threads = set()
+        self._samples = deque(maxlen=max_samples)
+        self._dumps = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def watch(self, thread_id):
+        """Starts sampling ``thread_id``, and the sampler thread itself on first use."""
+        if thread_id in self._threads:
+            return
+        with self._lock:
+            self._threads.add(thread_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slow-request-sampler', daemon=True)
+                self._thread.start()
+
+    def dump(self, name, start, end, timings):
+        """Queues the samples between ``start`` and ``end`` (perf_counter) for writing."""
+        self._dumps.put((name, start, end, dict(timings), threading.get_ident()))
+
+    def _run(self):
+        while True:
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            for thread_id in tuple(self._threads):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._samples.append((now, thread_id, _collapse(frame)))
+            del frames
+            while not self._dumps.empty():
+                self._write(*self._dumps.get())
+            time.sleep(self.interval)
+
+    def _write(self, name, start, end, timings, thread_id):
+        stacks = Counter(
+            stack for at, thread, stack in tuple(self._samples)
+            if start <= at <= end and thread == thread_id
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{self.dumped}.folded")
+        with open(path, 'w') as f:
+            f.write(f"# {name} took {(end - start) * 1000:.1f} ms; stages: "
+                    + ', '.join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()) + '\n')
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumped += 1
+
+
+_sampler = None
+
+
+def get_slow_request_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = SlowRequestSampler(settings.PROFILE_SAMPLE_INTERVAL_MS / 1000, settings.PROFILE_DIR)
+    return _sampler
@@ -0,0 +1,151 @@
+"""
+Persistent round history and per-player warm starts.
+
+Settled rounds are handed to ``RoundWriter``, which buffers them in memory
+and writes them with ``bulk_create`` from a background thread. It flushes
+every ``ROUND_LOG_FLUSH_INTERVAL`` seconds, or as soon as
+``ROUND_LOG_BATCH_SIZE`` rounds are waiting, so a request never waits on
+the database to record its round.
+
+When a named player opens a new game, ``start_session`` rebuilds their VOM
+counts for the new session's AI to start from. It starts from
+the player's ``PlayerSnapshot`` (the serialized count table) and replays
+only the rounds after it, one game session at a time. Once that replay grows
+past ``ROUND_SNAPSHOT_EVERY`` rounds, the snapshot is rewritten.
+"""
+
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+from .models import GameSession, PlayerSnapshot, Round
+from .vom import VOMModel
+
+logger = logging.getLogger(__name__)
+
+MOVE_TO_INT = {'rock': 1, 'paper': 2, 'scissors': 3}
+
+
+class RoundWriter:
+    """Buffers rounds and writes them in batches off the request path."""
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, session_id, player_move, ai_move, winner):
+        with self._lock:
+            self._buffer.append(Round(session_id=session_id, player_move=player_move, ai_move=ai_move, winner=winner))
+            full = len(self._buffer) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='round-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Writes everything buffered so far; returns the number of rounds written."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        session_ids = {r.session_id for r in batch}
+        try:
+            with transaction.atomic():
+                # Rounds from sessions that did not start on the game page
+                # still need a session row to point at.
+                GameSession.objects.bulk_create(
+                    [GameSession(session_id=session_id) for session_id in session_ids],
+                    ignore_conflicts=True,
+                )
+                Round.objects.bulk_create(batch)
+        except DatabaseError:
+            logger.exception('Dropped %d rounds that could not be written.', len(batch))
+            self.dropped += len(batch)
+            return 0
+        self.written += len(batch)
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+            close_old_connections()
+
+
+_writer = None
+
+
+def get_round_writer():
+    global _writer
+    if _writer is None:
+        _writer = RoundWriter(settings.ROUND_LOG_BATCH_SIZE, settings.ROUND_LOG_FLUSH_INTERVAL)
+    return _writer
+
+
+def record_round(session_id, player_move, ai_move, winner):
+    """Queues a settled round for writing when ROUND_LOG is on."""
+    if settings.ROUND_LOG:
+        get_round_writer().record(session_id, player_move, ai_move, winner)
+
+
+def load_player_model(username, max_order, threshold):
+    """
+    Rebuilds ``username``'s model from their snapshot and the rounds after it,
+    or returns None for a player with no history.
+    """
+    snapshot = PlayerSnapshot.objects.filter(username=username).first()
+    model = None
+    last_round_id = 0
+    if snapshot is not None and snapshot.max_order == max_order:
+        try:
+            model = VOMModel.from_bytes(max_order, threshold, snapshot.counts)
+            last_round_id = snapshot.last_round_id
+        except ValueError:
+            model = None
+
+    rounds = (
+        Round.objects.filter(session__username=username, id__gt=last_round_id)
+        .order_by('id')
+        .values_list('id', 'session_id', 'player_move')
+    )
+    games = OrderedDict()
+    for round_id, session_id, player_move in rounds.iterator():
+        games.setdefault(session_id, []).append(MOVE_TO_INT[player_move])
+        last_round_id = round_id
+    if model is None and not games:
+        return None
+
+    model = model or VOMModel(max_order, threshold)
+    replayed = 0
+    for moves in games.values():
+        model.reset_context()
+        for move in moves:
+            model.update(move)
+        replayed += len(moves)
+    model.reset_context()
+
+    if replayed >= settings.ROUND_SNAPSHOT_EVERY:
+        PlayerSnapshot.objects.update_or_create(
+            username=username,
+            defaults={'max_order': max_order, 'counts': model.to_bytes(), 'last_round_id': last_round_id},
+        )
+    return model
+
+
+def start_session(session_id, username, max_order, threshold):
+    """Registers a new game session; returns the player's VOM model as load_player_model does."""
+    GameSession.objects.create(session_id=session_id, username=username)
+    return load_player_model(username, max_order, threshold)
@@ -0,0 +1,130 @@
+"""
+Server-owned rounds for the HTTP game.
+
+The page asks for each round instead of running its own timer. ``issue``
+returns a round token with when to start the countdown, when to shoot and
+the deadline for the frame, all relative to now. The start is pushed back
+by up to ``ROUND_JITTER_MS`` at random, so pages that started together
+drift apart instead of uploading their final frames in the same instant.
+
+A token is the round's session, shoot time and deadline, signed with
+``django.core.signing``, so any web worker can check it without a shared
+round table. The page sends it in the ``X-Round-Token`` header, and
+``claim`` rejects a late, forged or reused token before the body is parsed
+or the image decoded. Reuse is caught by adding the token's nonce to the
+'shared' cache, which is Redis, and so seen by every worker, whenever
+REDIS_URL is set. A claimed frame that then does not settle the round (the
+detectors are busy, the image does not decode or no hand is found) gives
+the round back with ``release``, so the page can send another before the
+deadline.
+"""
+
+import random
+import secrets
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+SALT = 'game.rounds'
+
+
+class RoundRejected(Exception):
+    """A frame that does not belong to an open round; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=409):
+        super().__init__(message)
+        self.status = status
+
+
+class RoundScheduler:
+    def __init__(self, countdown, window, jitter):
+        self.countdown = countdown
+        self.window = window
+        self.jitter = jitter
+        self.issued = 0
+        self.rejected = {'missing': 0, 'invalid': 0, 'late': 0, 'duplicate': 0}
+
+    def issue(self, session_id, immediate=False):
+        """
+        Opens a round for ``session_id``. An ``immediate`` round has no
+        countdown, for a frame the server asks for straight away.
+        """
+        now = time.time()
+        start = now if immediate else now + random.uniform(0, self.jitter)
+        shoot = start if immediate else start + self.countdown
+        deadline = shoot + self.window
+        token = signing.dumps([session_id, deadline, secrets.token_hex(8)], salt=SALT, compress=False)
+        self.issued += 1
+        return {
+            'token': token,
+            'start_in_ms': round((start - now) * 1000),
+            'shoot_in_ms': round((shoot - now) * 1000),
+            'deadline_in_ms': round((deadline - now) * 1000),
+        }
+
+    def _reject(self, reason, message, status=409):
+        self.rejected[reason] += 1
+        return RoundRejected(message, status)
+
+    def _open_round(self, token):
+        """The session id, nonce and seconds left of a valid token whose round is open."""
+        if not token:
+            raise self._reject('missing', 'Missing round token.', status=400)
+        try:
+            session_id, deadline, nonce = signing.loads(token, salt=SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise self._reject('invalid', 'Invalid round token.', status=400) from None
+        remaining = deadline - time.time()
+        if remaining < 0:
+            raise self._reject('late', 'The round is over.')
+        return session_id, _round_key(nonce), remaining + 1
+
+    def claim(self, token):
+        """
+        Accepts the one frame of the round ``token`` opened and returns its
+        session id; raises RoundRejected otherwise.
+        """
+        session_id, key, timeout = self._open_round(token)
+        if not caches['shared'].add(key, 1, timeout=timeout):
+            raise self._reject('duplicate', 'This round has already been played.')
+        return session_id
+
+    async def aclaim(self, token):
+        """Like ``claim``, for async views."""
+        session_id, key, timeout = self._open_round(token)
+        if not await caches['shared'].aadd(key, 1, timeout=timeout):
+            raise self._reject('duplicate', 'This round has already been played.')
+        return session_id
+
+    def release(self, token):
+        """Reopens the round a claimed ``token`` opened, for a frame that did not settle it."""
+        caches['shared'].delete(_claimed_key(token))
+
+    async def arelease(self, token):
+        """Like ``release``, for async views."""
+        await caches['shared'].adelete(_claimed_key(token))
+
+
+def _round_key(nonce):
+    return f'round:{nonce}'
+
+
+def _claimed_key(token):
+    """The cache key of a token that has already been claimed, and so is known to be valid."""
+    return _round_key(signing.loads(token, salt=SALT)[2])
+
+
+_scheduler = None
+
+
+def get_round_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RoundScheduler(
+            settings.ROUND_COUNTDOWN_MS / 1000,
+            settings.ROUND_CAPTURE_WINDOW_MS / 1000,
+            settings.ROUND_JITTER_MS / 1000,
+        )
+    return _scheduler
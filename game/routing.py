@@ -3,5 +3,6 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    # e_path(r'ws/game/$', consumers.GameConsumer.as_asgi()),
-]
\ No newline at end of file
+    re_path(r'ws/game/$', consumers.GameConsumer.as_asgi()),
+    re_path(r'ws/room/(?P<room>[A-Za-z0-9_-]{1,32})/$', consumers.RoomConsumer.as_asgi()),
+]
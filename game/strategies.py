@@ -0,0 +1,146 @@
+"""
+The AI opponents, behind one interface.
+
+A strategy model learns from the player's moves one at a time and guesses
+the next one:
+
+    model.predict()      -> the player's likely next move (1-3), or None
+    model.update(move)   -> learn that the player threw ``move``
+
+The views answer a guess with the move that beats it, or play at random when
+there is none. ``new_model`` builds a model by its name in ``STRATEGIES``.
+Each game session picks its strategy when the page is loaded, from
+``?ai=<name>`` or ``settings.AI_STRATEGY``.
+
+The ensemble runs VOM and both Markov models and follows the ones that have
+been right lately. They all read the same rolling context, which the VOM
+model keeps (the last moves as a base-3 number, most recent in the lowest
+digit), so each Markov member costs a byte lookup on top of VOM.
+"""
+
+import random
+
+from django.conf import settings
+
+from .vom import DecayedVOMModel, VOMModel
+
+# How often the Markov models play at random, as test.py did.
+MARKOV_EXPLORE = 0.33
+# Weight of the latest round in the ensemble's running accuracy of each member.
+ENSEMBLE_RATE = 0.15
+
+
+class MarkovModel:
+    """
+    The Markov model of test.py for contexts of ``order`` moves.
+
+    test.py keeps a row of next-move probabilities per context, adds 1 for
+    the move that followed and renormalizes. As every row sums to 1, that
+    halves the row and adds 0.5 for the latest move, which is then always
+    the most likely one. So the model only stores, per context, the move that
+    followed it last time (rock for a context never seen, as ``argmax`` of a
+    uniform row).
+    """
+    __slots__ = ('order', 'explore', 'length', 'context', 'last')
+
+    def __init__(self, order, explore=MARKOV_EXPLORE):
+        self.order = order
+        self.explore = explore
+        self.length = 0
+        self.context = 0
+        self.last = bytearray([1]) * 3 ** order
+
+    def predict(self):
+        if self.length < self.order or random.random() < self.explore:
+            return None
+        return self.last[self.context]
+
+    def update(self, move):
+        if self.length == self.order:
+            self.last[self.context] = move
+        else:
+            self.length += 1
+        self.context = (self.context * 3 + move - 1) % (3 ** self.order)
+
+
+class EnsembleModel:
+    """VOM, first- and second-order Markov, weighted by their recent accuracy."""
+    __slots__ = ('vom', 'last1', 'last2', 'accuracy', 'guesses')
+
+    def __init__(self, max_order, threshold, vom=None):
+        self.vom = vom or VOMModel(max(max_order, 2), threshold)
+        # The tables of MarkovModel(1) and MarkovModel(2), indexed by the
+        # VOM model's context.
+        self.last1 = bytearray([1]) * 3
+        self.last2 = bytearray([1]) * 9
+        self.accuracy = (1 / 3, 1 / 3, 1 / 3)
+        self.guesses = None
+
+    def _guess(self):
+        vom = self.vom
+        context, length = vom.context, vom.length
+        self.guesses = guesses = (
+            vom.predict(),
+            self.last1[context % 3] if length >= 1 else None,
+            self.last2[context % 9] if length >= 2 else None,
+        )
+        return guesses
+
+    def predict(self):
+        guess_vom, guess1, guess2 = self._guess()
+        weight_vom, weight1, weight2 = self.accuracy
+        votes = [0.0, 0.0, 0.0, 0.0]
+        if guess_vom is not None:
+            votes[guess_vom] = weight_vom
+        if guess1 is not None:
+            votes[guess1] += weight1
+        if guess2 is not None:
+            votes[guess2] += weight2
+        _, rock, paper, scissors = votes
+        if not (rock or paper or scissors):
+            return None
+        if rock >= paper and rock >= scissors:
+            return 1
+        return 2 if paper >= scissors else 3
+
+    def update(self, move):
+        guess_vom, guess1, guess2 = self.guesses or self._guess()
+        weight_vom, weight1, weight2 = self.accuracy
+        keep = 1 - ENSEMBLE_RATE
+        self.accuracy = (
+            keep * weight_vom + (ENSEMBLE_RATE if guess_vom == move else 0),
+            keep * weight1 + (ENSEMBLE_RATE if guess1 == move else 0),
+            keep * weight2 + (ENSEMBLE_RATE if guess2 == move else 0),
+        )
+        vom = self.vom
+        if vom.length >= 1:
+            self.last1[vom.context % 3] = move
+            if vom.length >= 2:
+                self.last2[vom.context % 9] = move
+        vom.update(move)
+        self.guesses = None
+
+    def reset_context(self):
+        self.vom.reset_context()
+        self.guesses = None
+
+
+# name -> factory(max_order, threshold, vom); ``vom`` is a warmed-up VOM model
+# from the player's history, or None.
+STRATEGIES = {
+    'vom': lambda max_order, threshold, vom: vom or VOMModel(max_order, threshold),
+    'vom_decay': lambda max_order, threshold, vom: DecayedVOMModel(
+        max_order, threshold, settings.VOM_HALF_LIFE, settings.VOM_MAX_BYTES),
+    'markov1': lambda max_order, threshold, vom: MarkovModel(1),
+    'markov2': lambda max_order, threshold, vom: MarkovModel(2),
+    'ensemble': lambda max_order, threshold, vom: EnsembleModel(max_order, threshold, vom),
+}
+
+
+def new_model(name, max_order, threshold, vom=None):
+    """A fresh model for strategy ``name``; raises ValueError for an unknown name."""
+    try:
+        factory = STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f'Unknown AI strategy {name!r}.') from None
+    return factory(max_order, threshold, vom)
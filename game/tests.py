@@ -1,3 +1,913 @@
-from django.test import TestCase
+import asyncio
+import base64
+import email
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import caches
+from django.core.exceptions import RequestDataTooBig
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import detection, imaging, views
+from .admission import AdmissionController, Shed
+from .consumers import GameConsumer
+from .routing import websocket_urlpatterns
+from .detection import DetectionService, DetectorBusy, RoiTracker
+from .evaluation import evaluate, recorded_corpus, synthetic_corpus
+from .frame_ring import FrameRing
+from .gestures import GestureVoter, classify_landmarks
+from .imaging import decode_base64_image, encode_jpeg, jpeg_size, read_image_payload, split_image_payload
+from .landmarks import SpotChecker, parse_landmark_vector
+from .leaderboard import StatsBoard
+from .pacing import FrameChangeDetector, frame_thumbnail, suggested_poll_delay_ms
+from .profiling import SlowRequestSampler
+from .timing import parse_server_timing
+from .model_store import CacheModelStore, LocalModelStore
+from .models import GameSession, PlayerSnapshot, PlayerStats, Round
+from .round_log import RoundWriter, load_player_model
+from .rounds import RoundRejected, RoundScheduler
+from .strategies import EnsembleModel, MarkovModel
+from .vom import DecayedVOMModel, VOMModel
+
+
+class LocalModelStoreTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        store = LocalModelStore(max_entries=2, ttl=60)
+        store.put('a', 1)
+        store.put('b', 2)
+        store.get('a')
+        store.put('c', 3)
+        self.assertEqual(store.get('a'), 1)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(len(store), 2)
+
+    def test_drops_idle_sessions(self):
+        store = LocalModelStore(max_entries=10, ttl=60)
+        with mock.patch('game.model_store.time.monotonic', return_value=100.0):
+            store.put('a', 1)
+        with mock.patch('game.model_store.time.monotonic', return_value=161.0):
+            self.assertIsNone(store.get('a'))
+
+
+@override_settings(CACHES={'vom': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheModelStoreTests(SimpleTestCase):
+    def test_round_trips_model_state(self):
+        store = CacheModelStore('vom', ttl=60)
+        model = views.new_vom_model()
+        views.update_vom_patterns(model, 1)
+        views.update_vom_patterns(model, 2)
+        store.put('s1', model)
+        loaded = store.get('s1')
+        self.assertEqual(loaded.context, model.context)
+        self.assertEqual(loaded.counts, model.counts)
+
+
+def _reference_vom(history, max_order, threshold):
+    """The original tuple-keyed VOM, used to check the engine against."""
+    patterns = {}
+    predictions = []
+    for i, move in enumerate(history):
+        seen = history[:i]
+        prediction = None
+        for order in range(min(len(seen), max_order), 0, -1):
+            counts = patterns.get(tuple(seen[-order:]))
+            if counts and sum(counts) > threshold:
+                prediction = counts.index(max(counts)) + 1
+                break
+        predictions.append(prediction)
+        seen = history[:i + 1]
+        for order in range(1, max_order + 1):
+            if len(seen) > order:
+                counts = patterns.setdefault(tuple(seen[-(order + 1):-1]), [0, 0, 0])
+                counts[move - 1] += 1
+    return predictions
+
+
+class VOMTests(SimpleTestCase):
+    def test_counters_a_repeated_move(self):
+        model = views.new_vom_model()
+        for _ in range(4):
+            views.update_vom_patterns(model, 1)
+        # The player keeps throwing rock, so the AI should answer with paper.
+        self.assertEqual(views.ai_predict_vom(model), 2)
+
+    def test_matches_reference_model(self):
+        rng = random.Random(7)
+        history = [rng.choice([1, 1, 2, 3]) for _ in range(300)]
+        for max_order in (1, 5, 9):
+            model = VOMModel(max_order, threshold=1)
+            predictions = []
+            for move in history:
+                predictions.append(model.predict())
+                model.update(move)
+            self.assertEqual(predictions, _reference_vom(history, max_order, 1))
+
+    def test_large_orders_use_sparse_counts(self):
+        model = VOMModel(12, threshold=1)
+        for move in [1, 2, 3] * 20:
+            model.update(move)
+        self.assertIsInstance(model.counts, dict)
+        self.assertEqual(model.predict(), 1)
+
+    def test_counts_round_trip_through_bytes(self):
+        for max_order in (3, 12):
+            model = VOMModel(max_order, threshold=1)
+            for move in [1, 2, 3, 3] * 10:
+                model.update(move)
+            restored = VOMModel.from_bytes(max_order, 1, model.to_bytes())
+            self.assertEqual(restored.counts, model.counts)
+        with self.assertRaises(ValueError):
+            VOMModel.from_bytes(4, 1, VOMModel(3, threshold=1).to_bytes())
+
+
+def _test_py_markov(history, order):
+    """test.py's renormalized transition table, without the random moves."""
+    table = np.ones((3 ** order, 3)) / 3
+    predictions = []
+    for t, move in enumerate(history):
+        index = sum((m - 1) * 3 ** (order - 1 - j) for j, m in enumerate(history[t - order:t]))
+        predictions.append(int(np.argmax(table[index])) + 1 if t >= order else None)
+        if t >= order:
+            table[index, move - 1] += 1
+            table[index] /= table[index].sum()
+    return predictions
+
+
+@override_settings(ROUND_LOG=False, PLAYER_STATS=False)
+class StrategyTests(SimpleTestCase):
+    def test_markov_matches_test_py(self):
+        rng = random.Random(11)
+        history = [rng.choice([1, 1, 2, 3]) for _ in range(300)]
+        for order in (1, 2):
+            model = MarkovModel(order, explore=0)
+            predictions = []
+            for move in history:
+                predictions.append(model.predict())
+                model.update(move)
+            self.assertEqual(predictions, _test_py_markov(history, order))
+
+    def test_ensemble_follows_the_accurate_member(self):
+        # Alternating rock and paper: the first-order member is right from
+        # the third round on.
+        model = EnsembleModel(5, 1)
+        hits = 0
+        for move in [1, 2] * 15:
+            hits += model.predict() == move
+            model.update(move)
+        self.assertGreaterEqual(hits, 27)
+        self.assertGreater(model.accuracy[1], 0.9)
+
+    def test_page_picks_the_strategy(self):
+        for query, expected in (('?ai=ensemble', EnsembleModel), ('?ai=nope', VOMModel), ('?ai=markov2', MarkovModel)):
+            response = self.client.get('/game/alice/' + query)
+            model = views.get_model_store().get(response.context['session_id'])
+            self.assertIsInstance(model, expected)
+
+
+class DecayedVOMTests(SimpleTestCase):
+    def play(self, model, moves):
+        predictions = []
+        for move in moves:
+            predictions.append(model.predict())
+            model.update(move)
+        return predictions
+
+    def test_matches_vom_without_decay(self):
+        rng = random.Random(5)
+        history = [rng.choice([1, 1, 2, 3]) for _ in range(300)]
+        self.assertEqual(self.play(DecayedVOMModel(4, 1, half_life=float('inf'), max_bytes=4096), history),
+                         self.play(VOMModel(4, threshold=1), history))
+
+    def test_forgets_old_habits(self):
+        # Paper used to follow rock; lately scissors does.
+        decayed, vom = DecayedVOMModel(1, 1, half_life=5, max_bytes=4096), VOMModel(1, threshold=1)
+        for model in (decayed, vom):
+            self.play(model, [1, 2] * 100 + [1, 3] * 5 + [1])
+        self.assertEqual(decayed.predict(), 3)
+        self.assertEqual(vom.predict(), 2)
+
+    def test_memory_stays_within_budget(self):
+        model = DecayedVOMModel(12, 0, half_life=1, max_bytes=4096)
+        size = model.nbytes()
+        self.assertLessEqual(model.counts.itemsize * len(model.counts), 4096)
+        self.play(model, [1, 2, 3, 3] * 100)
+        self.assertLess(model.weight, 1e30)
+        self.assertEqual(model.nbytes(), size)
+        self.assertEqual(model.predict(), 1)
+
+
+class DetectionServiceTests(SimpleTestCase):
+    def test_refuses_frames_when_queue_is_full(self):
+        service = DetectionService(workers=0, max_pending=0)
+        with self.assertRaises(DetectorBusy):
+            service.detect(None)
+        self.assertEqual(service.stats()['rejected'], 1)
+
+    def test_warm_up_reports_cold_start(self):
+        def init_worker(*args):
+            detection._worker_startup = 0.25
+
+        with mock.patch('game.detection._init_worker', init_worker):
+            service = DetectionService(workers=0, max_pending=1, warmup=True)
+        service.warm_up()
+        stats = service.stats()
+        self.assertEqual(stats['worker_startup_ms'], 250.0)
+        self.assertGreaterEqual(stats['cold_start_ms'], 0)
+
+    async def test_batches_frames_while_workers_are_busy(self):
+        def find_hands(img, draw):
+            time.sleep(0.01)
+            return [img], None, 0.01
+
+        with mock.patch('game.detection._init_worker'), mock.patch('game.detection._find_hands', find_hands):
+            service = DetectionService(workers=0, max_pending=10, batch_window=0.05, batch_max_size=4)
+            results = await asyncio.gather(*(service.adetect(i) for i in range(5)))
+        # The first frame finds the worker idle; the other four go as one batch.
+        self.assertEqual([hands for hands, _ in results], [[i] for i in range(5)])
+        self.assertEqual(service.stats()['mean_batch_size'], 2.5)
+
+    def test_restarts_a_broken_pool_once(self):
+        crashes = [BrokenProcessPool()]
+
+        def find_hands(img, draw):
+            if crashes:
+                raise crashes.pop()
+            return [img], None, 0.01
+
+        with mock.patch('game.detection._init_worker'), mock.patch('game.detection._find_hands', find_hands):
+            service = DetectionService(workers=0, max_pending=1)
+            first_pool = service._executor
+            # The first crash is retried on a new pool; two in a row fail the frame.
+            self.assertEqual(service.detect('frame'), (['frame'], None))
+            self.assertIsNot(service._executor, first_pool)
+            crashes += [BrokenProcessPool(), BrokenProcessPool()]
+            with self.assertRaises(BrokenProcessPool):
+                service.detect('frame')
+        self.assertEqual(service.stats()['pool_restarts'], 2)
+
+    async def test_failed_batch_fails_its_frames(self):
+        with mock.patch('game.detection._init_worker'):
+            service = DetectionService(workers=0, max_pending=10, batch_window=0.01, batch_max_size=4)
+        with mock.patch.object(service, '_submit', side_effect=RuntimeError('shut down')):
+            results = await asyncio.wait_for(
+                asyncio.gather(*(service.adetect(i) for i in range(3)), return_exceptions=True), 1,
+            )
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual((service._running_batches, service.queue_depth), (0, 0))
+
+    def test_frees_the_slot_before_settling(self):
+        settle, free_when_settled = detection._settle, []
+
+        def record(*args):
+            free_when_settled.append(service._ring.free)
+            settle(*args)
+
+        with mock.patch('game.detection._init_worker'), \
+                mock.patch('game.detection._find_hands', return_value=([], None, 0.01)), \
+                mock.patch('game.detection._settle', record):
+            service = DetectionService(workers=0, max_pending=1)
+            service._ring = FrameRing(1, 8 * 8 * 3)
+            self.addCleanup(service._ring.close)
+            service._submit([(np.zeros((8, 8, 3), np.uint8), False)]).result()
+        # The caller may send its next frame as soon as this one settles.
+        self.assertEqual(free_when_settled, [1])
+
+
+class FrameRingTests(SimpleTestCase):
+    def test_frames_round_trip_through_slots(self):
+        ring = FrameRing(2, 32 * 24 * 3)
+        self.addCleanup(ring.close)
+        img = np.arange(24 * 32 * 3, dtype=np.uint8).reshape(24, 32, 3)
+        first, second = ring.put(img[:, :16]), ring.put(img)
+        self.assertIsNone(ring.put(img))
+        reader = FrameRing.attach(ring.name, ring.slots, ring.slot_bytes)
+        np.testing.assert_array_equal(reader.view(first), img[:, :16])
+        np.testing.assert_array_equal(reader.view(second), img)
+        reader.close()
+
+        ring.release(first)
+        self.assertIsNone(ring.put(np.zeros((48, 32, 3), np.uint8)))
+        self.assertIsNotNone(ring.put(img))
+        self.assertEqual(ring.fallbacks, 2)
+
+
+def _landmarks(thumb, fingers, angle=0.0, scale=1.0, origin=(200, 200)):
+    """
+    21 landmarks for a hand with the wrist at ``origin``, rotated by
+    ``angle`` radians. ``thumb`` and each of the four ``fingers`` are
+    1 for extended and 0 for curled.
+    """
+    points = [(0, 0), (-15, -10), (-28, -22)]
+    points += [(-42, -32), (-56, -42)] if thumb else [(-20, -34), (-5, -38)]
+    for x, extended in zip((-15, -5, 5, 15), fingers):
+        points += [(x, -40), (x, -60), (x, -75), (x, -90)] if extended else [(x, -40), (x, -55), (x, -45), (x, -35)]
+    cos, sin = np.cos(angle), np.sin(angle)
+    return [
+        [int(round(scale * (x * cos - y * sin))) + origin[0], int(round(scale * (x * sin + y * cos))) + origin[1], 0]
+        for x, y in points
+    ]
+
+
+ROCK = _landmarks(0, (0, 0, 0, 0))
+PAPER = _landmarks(1, (1, 1, 1, 1))
+SCISSORS = _landmarks(0, (1, 1, 0, 0))
+
+
+@override_settings(GESTURE_MIN_CONFIDENCE=0.8)
+class GestureTests(SimpleTestCase):
+    def test_classifies_rotated_and_scaled_hands(self):
+        for thumb, fingers, move in ((0, (0, 0, 0, 0), 'rock'), (1, (1, 1, 1, 1), 'paper'),
+                                     (0, (1, 1, 0, 0), 'scissors'), (1, (1, 1, 0, 0), 'scissors')):
+            for angle, scale in ((0.0, 1.0), (0.7, 2.5), (-2.0, 0.5)):
+                self.assertEqual(classify_landmarks(_landmarks(thumb, fingers, angle, scale))[0], move)
+
+    def test_rejects_ambiguous_hands(self):
+        move, confidence = classify_landmarks(_landmarks(0, (1, 0, 0, 0)))
+        self.assertIsNone(move)
+        self.assertGreater(confidence, 0)
+
+    def test_tolerates_missing_landmarks(self):
+        partial = list(SCISSORS)
+        partial[16] = partial[20] = None
+        self.assertEqual(classify_landmarks(partial)[0], 'scissors')
+        self.assertIsNone(classify_landmarks(SCISSORS[:9])[0])
+
+    def test_voter_outweighs_one_bad_frame(self):
+        voter = GestureVoter(frames=5, window=1.0, max_sessions=10, ttl=60)
+        for move in ('rock', None, 'paper'):
+            voter.add('s', move, 0.9)
+        self.assertIsNone(voter.vote('s')[0])
+        for move in ('rock', 'rock', 'rock', 'rock', 'scissors'):
+            voter.add('s', move, 0.9)
+        self.assertEqual(voter.vote('s')[0], 'rock')
+        voter.reset('s')
+        self.assertEqual(voter.vote('s'), (None, 0.0))
+
+
+class _FakeDetectionService:
+    queue_depth = 0
+    workers = 1
+
+    def __init__(self, hands):
+        self.hands = hands
+        self.shapes = []
+
+    async def adetect(self, img, draw=False):
+        self.shapes.append(img.shape[:2])
+        return [dict(hand) for hand in self.hands], img if draw else None
+
+
+class RoiTrackerTests(SimpleTestCase):
+    async def test_searches_around_previous_hand(self):
+        hand = {'lmList': [[102, 102, 0]] * 21, 'bbox': (100, 100, 20, 20), 'center': (110, 110)}
+        service = _FakeDetectionService([hand])
+        tracker = RoiTracker(margin=0.5, max_sessions=10, ttl=60)
+        img = np.zeros((240, 320, 3), np.uint8)
+        await tracker.adetect(service, 's', img)
+        # The second frame is cropped to a 40x40 square centred on the first
+        # hand, so the detector sees the hand 10px in from the crop's corner.
+        service.hands = [{'lmList': [[12, 12, 0]] * 21, 'bbox': (10, 10, 20, 20), 'center': (20, 20)}]
+        hands, _ = await tracker.adetect(service, 's', img)
+        self.assertEqual(service.shapes, [(240, 320), (40, 40)])
+        self.assertEqual(hands[0]['bbox'], (100, 100, 20, 20))
+        self.assertEqual(hands[0]['lmList'][0], [102, 102, 0])
+
+    async def test_falls_back_to_full_frame(self):
+        service = _FakeDetectionService([])
+        tracker = RoiTracker(margin=0.5, max_sessions=10, ttl=60)
+        tracker._last_bbox.put('s', (100, 100, 40, 40))
+        hands, _ = await tracker.adetect(service, 's', np.zeros((240, 320, 3), np.uint8))
+        self.assertEqual(hands, [])
+        self.assertEqual(service.shapes, [(80, 80), (240, 320)])
+        self.assertIsNone(tracker._last_bbox.get('s'))
+
+
+def _patch_detection(service):
+    return mock.patch('game.detection.get_detection_service', return_value=service)
+
+
+@override_settings(ROI_TRACKING=False)
+class GameConsumerTests(SimpleTestCase):
+    async def test_binary_frames_get_landmarks_back(self):
+        _, jpeg = cv2.imencode('.jpg', np.zeros((48, 64, 3), np.uint8))
+        hand = {'lmList': ROCK, 'bbox': (1, 2, 3, 4)}
+        with _patch_detection(_FakeDetectionService([hand])):
+            communicator = WebsocketCommunicator(GameConsumer.as_asgi(), '/ws/game/?session_id=abc')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_to(bytes_data=jpeg.tobytes())
+            message = await communicator.receive_json_from()
+            await communicator.disconnect()
+        self.assertEqual(message['type'], 'landmarks')
+        self.assertEqual((message['width'], message['height']), (64, 48))
+        self.assertEqual(message['hands'][0]['bbox'], [1, 2, 3, 4])
+        self.assertEqual(message['hands'][0]['gesture'], 'rock')
+
+
+class _HandsByWidth(_FakeDetectionService):
+    """Answers with the hand registered for the frame's width, so each player can show a different move."""
+
+    def __init__(self, hands_by_width):
+        super().__init__([])
+        self.hands_by_width = hands_by_width
+
+    async def adetect(self, img, draw=False):
+        return [dict(self.hands_by_width[img.shape[1]])], None
+
+
+@override_settings(ROI_TRACKING=False)
+class RoomConsumerTests(SimpleTestCase):
+    async def join(self, query):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/test-room/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator, message_type):
+        while True:
+            message = await communicator.receive_json_from()
+            if message['type'] == message_type:
+                return message
+
+    async def test_players_and_spectator_get_round_deltas(self):
+        bbox = (0, 0, 9, 9)
+        service = _HandsByWidth({64: {'lmList': ROCK, 'bbox': bbox}, 32: {'lmList': SCISSORS, 'bbox': bbox}})
+        with _patch_detection(service), mock.patch.multiple('game.consumers', COUNTDOWN_FROM=0,
+                                                            RESULT_PAUSE=0, WINNING_SCORE=1):
+            host = await self.join('session_id=a&name=Ann')
+            guest = await self.join('session_id=b&name=Bob')
+            spectator = await self.join('session_id=c&role=player')
+            self.assertEqual((await host.receive_json_from())['seat'], 1)
+            self.assertEqual((await guest.receive_json_from())['seat'], 2)
+            self.assertEqual((await self.receive(host, 'joined'))['name'], 'Bob')
+            state = await self.receive(guest, 'state')
+            self.assertEqual((state['players'], state['scores']), (['Ann', 'Bob'], [0, 0]))
+
+            for communicator, width in ((host, 64), (guest, 32)):
+                _, jpeg = cv2.imencode('.jpg', np.zeros((24, width, 3), np.uint8))
+                await communicator.send_to(bytes_data=jpeg.tobytes())
+                await self.receive(communicator, 'landmarks')
+            await guest.send_json_to({'type': 'start_game'})
+
+            messages = [await spectator.receive_json_from() for _ in range(5)]
+            for communicator in (host, guest, spectator):
+                await communicator.disconnect()
+
+        # A third player is seated as a spectator and is sent the full state once.
+        self.assertEqual([m['type'] for m in messages], ['welcome', 'state', 'countdown', 'result', 'over'])
+        self.assertEqual(messages[0]['seat'], 0)
+        self.assertEqual(messages[3], {'type': 'result', 'round': 1, 'moves': ['rock', 'scissors'], 'winner': 1})
+        self.assertEqual(messages[4]['winner'], 1)
+
+
+def _jpeg_data_url(width=64, height=48):
+    _, jpeg = cv2.imencode('.jpg', np.zeros((height, width, 3), np.uint8))
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+
+
+class AdmissionTests(SimpleTestCase):
+    def test_reserves_slots_for_rounds_and_rate_limits_polls(self):
+        controller = AdmissionController(3, 1, rate=10, burst=1, max_sessions=10, ttl=60)
+        controller.admit('annotate', 'a')
+        controller.admit('annotate', 'b')
+        with self.assertRaises(Shed) as shed:
+            controller.admit('annotate', 'c')
+        self.assertEqual(shed.exception.reason, 'busy')
+        controller.admit('round')
+        with self.assertRaises(Shed):
+            controller.admit('round')
+
+        for _ in range(3):
+            controller.release()
+        with self.assertRaises(Shed) as shed:
+            controller.admit('annotate', 'a')
+        self.assertEqual(shed.exception.reason, 'rate')
+        self.assertGreater(shed.exception.retry_after_ms, 0)
+        self.assertEqual(controller.shed, {('round', 'busy'): 1, ('annotate', 'busy'): 1, ('annotate', 'rate'): 1})
+
+    async def test_sheds_polls_before_reading_the_body(self):
+        controller = AdmissionController(4, 1, rate=1, burst=1, max_sessions=10, ttl=60)
+        decode = mock.Mock(return_value=({}, None))
+        with mock.patch('game.admission.get_admission_controller', return_value=controller), \
+                mock.patch('game.views.read_image_payload', decode):
+            response = await self.async_client.post(
+                '/api/annotate_only/', b'{}', content_type='application/json', headers={'X-Session-Id': 'busy'},
+            )
+            self.assertEqual(response.status_code, 400)
+            response = await self.async_client.post(
+                '/api/annotate_only/', b'{}', content_type='application/json', headers={'X-Session-Id': 'busy'},
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(response.json()['reuse'])
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(controller.in_flight, 0)
+
+
+@override_settings(ROI_TRACKING=False, ADMISSION_CONTROL=False)
+class AnnotateOnlyFrameTests(SimpleTestCase):
+    hand = {'lmList': SCISSORS, 'bbox': (5, 6, 7, 8)}
+
+    async def post(self, **payload):
+        payload['image'] = _jpeg_data_url()
+        with _patch_detection(_FakeDetectionService([self.hand])), \
+                mock.patch('game.views.get_detection_service', return_value=_FakeDetectionService([])):
+            return await self.async_client.post('/api/annotate_only/', json.dumps(payload), content_type='application/json')
+
+    async def test_returns_landmarks_by_default(self):
+        data = (await self.post()).json()
+        self.assertEqual((data['width'], data['height']), (64, 48))
+        self.assertEqual(data['hands'], [
+            {'lmList': [p[:2] for p in SCISSORS], 'bbox': [5, 6, 7, 8], 'gesture': 'scissors', 'confidence': 1.0},
+        ])
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    async def test_refuses_bodies_over_the_upload_limit(self):
+        with mock.patch('game.views.read_image_payload', wraps=read_image_payload) as parse:
+            response = await self.post(session_id='x' * 2000)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(parse.call_args.kwargs['max_size'], 1000)
+
+    async def test_near_identical_frames_reuse_last_result(self):
+        service = mock.Mock(wraps=_FakeDetectionService([self.hand]), queue_depth=0, workers=1)
+        payload = json.dumps({'image': _jpeg_data_url(), 'session_id': 'still-hand'})
+        with _patch_detection(service), mock.patch('game.views.get_detection_service', return_value=service):
+            for _ in range(3):
+                response = await self.async_client.post('/api/annotate_only/', payload, content_type='application/json')
+        self.assertEqual(service.adetect.call_count, 1)
+        self.assertEqual(response.json()['hands'][0]['gesture'], 'scissors')
+
+    @override_settings(SERVER_TIMING=True)
+    async def test_reports_stage_timings(self):
+        response = await self.post(session_id='timed')
+        self.assertEqual(set(parse_server_timing(response['Server-Timing'])), {'parse', 'decode', 'detect', 'gesture', 'encode'})
+        stats = {'queue_depth': 0, 'processed': 1, 'rejected': 0}
+        with mock.patch('game.views.get_detection_service', return_value=mock.Mock(stats=lambda: stats)):
+            metrics = (await self.async_client.get('/metrics')).content.decode()
+        self.assertIn('rps_stage_seconds_count{request="annotate_only_frame",stage="detect"}', metrics)
+        self.assertIn('rps_detector_queue_depth 0', metrics)
+
+    @override_settings(ANNOTATED_JPEG_QUALITY=60, ANNOTATED_IMAGE_SCALE=0.5)
+    async def test_image_formats(self):
+        response = await self.post(mode='image', image_format='jpeg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('next_poll_ms', json.loads(response['X-Result']))
+        self.assertEqual(jpeg_size(response.content), (32, 24))
+
+        response = await self.post(mode='image', image_format='multipart')
+        message = email.message_from_bytes(f"Content-Type: {response['Content-Type']}\r\n\r\n".encode() + response.content)
+        result, image = message.get_payload()
+        self.assertIn('next_poll_ms', json.loads(result.get_payload()))
+        self.assertEqual(jpeg_size(image.get_payload(decode=True)), (32, 24))
+
+        data = (await self.post(mode='image')).json()
+        self.assertTrue(data['annotated_image'].startswith('data:image/jpeg;base64,'))
+
+    async def test_binary_mode_packs_int16(self):
+        response = await self.post(mode='binary')
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        values = np.frombuffer(response.content, '<i2').tolist()
+        self.assertEqual(values[:8], [64, 48, 1, 5, 6, 7, 8, 3])
+        self.assertEqual(values[8:], [v for p in SCISSORS for v in p[:2]])
+
+
+def _flat(lm_list):
+    return [v for point in lm_list for v in point[:2]]
+
+
+class LandmarkVectorTests(SimpleTestCase):
+    def test_accepts_a_hand(self):
+        self.assertEqual(parse_landmark_vector(_flat(SCISSORS), 320, 240), [p[:2] for p in SCISSORS])
+        self.assertIsNone(parse_landmark_vector(None, 320, 240))
+
+    def test_rejects_implausible_hands(self):
+        for values, width in ((_flat(SCISSORS)[:40], 320), (_flat(SCISSORS), 100),
+                              ([200] * 42, 320), (['1'] * 42, 320), (_flat(SCISSORS), True)):
+            with self.assertRaises(ValueError):
+                parse_landmark_vector(values, width, 240)
+
+
+@override_settings(ROUND_LOG=False, PLAYER_STATS=False)
+class ClientInferenceTests(SimpleTestCase):
+    async def post(self, path, token=None, **payload):
+        headers = {'X-Round-Token': token} if token else {}
+        response = await self.async_client.post(path, json.dumps(payload), content_type='application/json',
+                                                headers=headers)
+        return response.json()
+
+    async def test_settles_round_from_landmarks(self):
+        token = (await self.post('/api/round/', session_id='client'))['token']
+        with mock.patch('game.views.get_spot_checker', return_value=SpotChecker(0, 10, 60)):
+            data = await self.post('/api/analyze_landmarks/', token, width=320, height=240, landmarks=_flat(ROCK))
+            self.assertEqual(data['player_move'], 'rock')
+            self.assertIn(data['winner'], ('player', 'ai', 'tie'))
+            data = await self.post('/api/analyze_landmarks/', token, width=320, height=240, landmarks=_flat(ROCK))
+        self.assertEqual(data, {'error': 'This round has already been played.'})
+
+    @override_settings(ROI_TRACKING=False)
+    async def test_spot_check_compares_claim_with_real_frame(self):
+        checker = SpotChecker(1, 10, 60)
+        with mock.patch('game.views.get_spot_checker', return_value=checker):
+            token = (await self.post('/api/round/', session_id='cheat'))['token']
+            data = await self.post('/api/analyze_landmarks/', token, width=320, height=240, landmarks=_flat(PAPER))
+            self.assertTrue(data['spot_check'])
+            self.assertEqual(data['round']['shoot_in_ms'], 0)
+            hand = {'lmList': ROCK, 'bbox': (5, 6, 7, 8)}
+            with _patch_detection(_FakeDetectionService([hand])):
+                data = await self.post('/api/analyze_frame/', data['round']['token'], image=_jpeg_data_url())
+        self.assertEqual(data['player_move'], 'rock')
+        self.assertEqual((checker.checked, checker.mismatches), (1, 1))
+
+    @override_settings(ROI_TRACKING=False)
+    async def test_busy_detector_does_not_use_up_the_round(self):
+        token = (await self.post('/api/round/', session_id='busy'))['token']
+        with mock.patch('game.views.adetect_for_session', side_effect=DetectorBusy):
+            data = await self.post('/api/analyze_frame/', token, image=_jpeg_data_url())
+        self.assertEqual(data, {'error': 'Server busy, try again.'})
+        with _patch_detection(_FakeDetectionService([{'lmList': ROCK, 'bbox': (5, 6, 7, 8)}])):
+            data = await self.post('/api/analyze_frame/', token, image=_jpeg_data_url())
+        self.assertEqual(data['player_move'], 'rock')
+
+    def test_page_renders(self):
+        self.assertContains(self.client.get('/game/alice/'), 'analyze_landmarks')
+
+
+@override_settings(ROUND_TOKENS=False, DETECTOR_MAX_HANDS=2)
+class HeadToHeadTests(SimpleTestCase):
+    async def post(self, hands):
+        with _patch_detection(_FakeDetectionService(hands)):
+            response = await self.async_client.post('/api/analyze_head_to_head/', {'image': _jpeg_data_url()},
+                                                    content_type='application/json')
+        return response.json()
+
+    async def test_scores_both_hands_of_one_frame(self):
+        # The page is mirrored, so the hand on the camera's right is the left player's.
+        right = {'lmList': SCISSORS, 'bbox': (2, 0, 10, 10)}
+        left = {'lmList': ROCK, 'bbox': (40, 0, 10, 10)}
+        data = await self.post([right, left])
+        self.assertEqual((data['left_move'], data['right_move'], data['winner']), ('rock', 'scissors', 'left'))
+        self.assertTrue(data['annotated_image'].startswith('data:image/jpeg;base64,'))
+        self.assertEqual(await self.post([left]), {'error': 'Both players need a clear hand in view.', 'hands': 1})
+
+    async def test_needs_two_hand_detector(self):
+        with self.settings(DETECTOR_MAX_HANDS=1):
+            response = await self.async_client.post('/api/analyze_head_to_head/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 501)
+
+
+class RoundLogTests(TestCase):
+    def play(self, session_id, moves, username='alice'):
+        GameSession.objects.create(session_id=session_id, username=username)
+        writer = RoundWriter(batch_size=100, interval=60)
+        for move in moves:
+            writer.record(session_id, views.int_to_move[move], 'rock', 'tie')
+        self.assertEqual(writer.flush(), len(moves))
+
+    def replayed(self, games):
+        model = VOMModel(5, threshold=1)
+        for moves in games:
+            model.reset_context()
+            for move in moves:
+                model.update(move)
+        return model
+
+    def test_writer_creates_missing_sessions(self):
+        writer = RoundWriter(batch_size=100, interval=60)
+        writer.record('ws-only', 'paper', 'scissors', 'ai')
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(Round.objects.get().session.username, '')
+        self.assertEqual(writer.flush(), 0)
+
+    @override_settings(ROUND_SNAPSHOT_EVERY=10)
+    def test_warm_start_matches_full_replay(self):
+        self.assertIsNone(load_player_model('alice', 5, 1))
+        first, second = [1, 1, 2, 3] * 3, [2, 3, 3]
+        self.play('one', first)
+        self.assertEqual(load_player_model('alice', 5, 1).counts, self.replayed([first]).counts)
+        snapshot = PlayerSnapshot.objects.get(username='alice')
+        self.assertEqual(snapshot.last_round_id, Round.objects.latest('id').id)
+
+        self.play('two', second)
+        self.play('other', [3] * 5, username='bob')
+        model = load_player_model('alice', 5, 1)
+        self.assertEqual(model.counts, self.replayed([first, second]).counts)
+        # Three new rounds are below ROUND_SNAPSHOT_EVERY, so the snapshot stays.
+        self.assertEqual(PlayerSnapshot.objects.get(username='alice').last_round_id, snapshot.last_round_id)
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        caches['stats'].clear()
+        self.board = StatsBoard(caches['stats'], size=2, interval=0)
+
+    def play(self, session_id, username, rounds):
+        self.board.start_game(session_id, username)
+        for player_move, winner in rounds:
+            async_to_sync(self.board.arecord)(session_id, player_move, winner)
+
+    def test_counts_rounds_as_they_are_settled(self):
+        self.play('s1', 'alice', [('rock', 'player'), ('rock', 'ai'), ('paper', 'player')])
+        self.play('s2', 'alice', [('rock', 'tie')])
+        self.play('s3', 'bob', [('paper', 'player')])
+        self.play('s4', 'carol', [('scissors', 'ai')])
+        async_to_sync(self.board.arecord)('anonymous', 'rock', 'player')
+        self.assertEqual(self.board.stats('alice'), {
+            'username': 'alice', 'games': 2, 'rounds': 4, 'wins': 2, 'win_rate': 0.5, 'favourite_move': 'rock',
+        })
+        self.assertEqual([player['username'] for player in self.board.leaderboard()], ['alice', 'bob'])
+        self.assertIsNone(self.board.stats('dave'))
+
+    def test_checkpoints_and_reloads_from_database(self):
+        self.play('s1', 'alice', [('rock', 'player'), ('paper', 'player')])
+        self.play('s2', 'bob', [('paper', 'player')])
+        with self.assertNumQueries(0):
+            self.board.leaderboard()
+        self.assertEqual(self.board.checkpoint(), 2)
+        self.assertEqual(PlayerStats.objects.get(username='alice').wins, 2)
+
+        caches['stats'].clear()
+        self.assertEqual([player['wins'] for player in self.board.leaderboard()], [2, 1])
+        self.play('s3', 'bob', [('rock', 'player'), ('rock', 'player')])
+        self.assertEqual(self.board.stats('bob')['rounds'], 3)
+        self.assertEqual([player['username'] for player in self.board.leaderboard()], ['bob', 'alice'])
+
+
+class EvaluationTests(TestCase):
+    def test_strategies_exploit_a_cyclic_player(self):
+        moves, lengths = synthetic_corpus('cyclic', 40, 120, seed=3)
+        self.assertLess(evaluate('random', moves, lengths)['win_rate'], 0.45)
+        for strategy in ('markov1', 'markov2', 'vom'):
+            result = evaluate(strategy, moves, lengths, chunk_size=16)
+            self.assertEqual(result['rounds'], 40 * 120)
+            self.assertGreater(result['win_rate'], 0.55, strategy)
+            self.assertIsNotNone(result['converged_after'])
+
+    def test_replays_recorded_sessions(self):
+        writer = RoundWriter(batch_size=100, interval=60)
+        for session_id, moves in (('short', 'rp'), ('long', 'rrprs')):
+            for move in moves:
+                writer.record(session_id, {'r': 'rock', 'p': 'paper', 's': 'scissors'}[move], 'rock', 'tie')
+        writer.flush()
+        moves, lengths = recorded_corpus()
+        self.assertEqual(lengths.tolist(), [2, 5])
+        self.assertEqual(moves.tolist(), [[1, 2, 0, 0, 0], [1, 1, 2, 1, 3]])
+        self.assertEqual(evaluate('vom', moves, lengths)['rounds'], 7)
+
+
+class RoundSchedulerTests(SimpleTestCase):
+    def test_rounds_are_jittered(self):
+        scheduler = RoundScheduler(countdown=3, window=2, jitter=0.5)
+        for _ in range(20):
+            round_ = scheduler.issue('abc')
+            self.assertTrue(0 <= round_['start_in_ms'] <= 500)
+            self.assertEqual(round_['shoot_in_ms'] - round_['start_in_ms'], 3000)
+            self.assertEqual(round_['deadline_in_ms'] - round_['shoot_in_ms'], 2000)
+        self.assertEqual(scheduler.claim(round_['token']), 'abc')
+
+    def test_rejects_frames_outside_their_round(self):
+        scheduler = RoundScheduler(countdown=3, window=2, jitter=0)
+        token = scheduler.issue('abc')['token']
+        for bad in (None, token[:-2] + 'xx'):
+            with self.assertRaises(RoundRejected) as cm:
+                scheduler.claim(bad)
+            self.assertEqual(cm.exception.status, 400)
+        with mock.patch('game.rounds.time.time', return_value=time.time() + 6):
+            self.assertRaises(RoundRejected, scheduler.claim, token)
+        self.assertEqual(scheduler.rejected, {'missing': 1, 'invalid': 1, 'late': 1, 'duplicate': 0})
+
+    async def test_each_round_takes_one_frame(self):
+        scheduler = RoundScheduler(countdown=0, window=2, jitter=0)
+        token = scheduler.issue('abc')['token']
+        self.assertEqual(await scheduler.aclaim(token), 'abc')
+        with self.assertRaises(RoundRejected):
+            await scheduler.aclaim(token)
+        self.assertEqual(scheduler.rejected['duplicate'], 1)
+
+    async def test_late_frame_is_not_decoded(self):
+        token = RoundScheduler(countdown=0, window=-1, jitter=0).issue('abc')['token']
+        with mock.patch('game.views._parse_frame_request') as parse:
+            response = await self.async_client.post('/api/analyze_frame/', '{}', content_type='application/json',
+                                                    headers={'X-Round-Token': token})
+        self.assertEqual(response.status_code, 409)
+        parse.assert_not_called()
+
+
+class SlowRequestSamplerTests(SimpleTestCase):
+    def test_dumps_samples_taken_during_a_slow_request(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sampler = SlowRequestSampler(interval=0.001, directory=directory)
+            sampler.watch(threading.get_ident())
+            start = time.perf_counter()
+            while time.perf_counter() - start < 0.05:
+                pass
+            sampler.dump('slow', start, time.perf_counter(), {'detect': 0.05})
+            for _ in range(100):
+                if sampler.dumped:
+                    break
+                time.sleep(0.01)
+            [name] = os.listdir(directory)
+            with open(os.path.join(directory, name)) as f:
+                lines = f.read().splitlines()
+        self.assertTrue(lines[0].startswith('# slow took'))
+        self.assertIn('test_dumps_samples_taken_during_a_slow_request', lines[1])
+
+
+class PacingTests(SimpleTestCase):
+    @override_settings(ANNOTATE_MIN_POLL_MS=100, ANNOTATE_MAX_POLL_MS=1000)
+    def test_poll_delay_grows_with_queue_depth(self):
+        self.assertEqual(suggested_poll_delay_ms(0, 4), 100)
+        self.assertEqual(suggested_poll_delay_ms(8, 4), 300)
+        self.assertEqual(suggested_poll_delay_ms(400, 4), 1000)
+
+    def test_change_detector_ignores_small_differences(self):
+        detector = FrameChangeDetector(threshold=2.0, max_sessions=10, ttl=60)
+        frame = np.full((48, 64, 3), 100, np.uint8)
+        detector.remember('s', frame_thumbnail(frame), ['hand'])
+        self.assertEqual(detector.reusable_result('s', frame_thumbnail(frame + 1)), ['hand'])
+        self.assertIsNone(detector.reusable_result('s', frame_thumbnail(frame + 30)))
+        self.assertIsNone(detector.reusable_result('other', frame_thumbnail(frame)))
+
+
+class ImagingTests(SimpleTestCase):
+    def test_splits_image_out_of_json_body(self):
+        body = b'{"session_id": "abc", "image": "data:image/jpeg;base64,AAEC", "mode": "binary"}'
+        data, image = split_image_payload(body)
+        self.assertEqual(data, {'session_id': 'abc', 'image': '', 'mode': 'binary'})
+        self.assertIsInstance(image, memoryview)
+        self.assertEqual(bytes(image), b'AAEC')
+        data, image = split_image_payload(b'{"mode": "image", "image": "data:image/jpeg;base64,AAEC"}')
+        self.assertEqual((data['mode'], bytes(image)), ('image', b'AAEC'))
+
+    def test_bodies_without_image_still_parse(self):
+        self.assertEqual(split_image_payload(b'{"image": null}'), ({'image': None}, None))
+
+    def test_reads_image_from_stream_in_chunks(self):
+        _, jpeg = cv2.imencode('.jpg', np.random.default_rng(0).integers(0, 256, (48, 64, 3), np.uint8))
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+        body = json.dumps({'mode': 'image', 'image': data_url, 'session_id': 'abc'}).encode()
+        for chunk_size, size_hint in ((5, 0), (64, len(body)), (1 << 16, len(body))):
+            data, image = read_image_payload(io.BytesIO(body).read, size_hint, chunk_size=chunk_size)
+            self.assertEqual(data, {'mode': 'image', 'image': '', 'session_id': 'abc'})
+            self.assertEqual(bytes(image), jpeg.tobytes())
+        self.assertEqual(read_image_payload(io.BytesIO(b'{"image": null}').read, chunk_size=4), ({'image': None}, None))
+
+        with self.assertRaises(RequestDataTooBig):
+            read_image_payload(io.BytesIO(body).read, len(body), max_size=len(body) - 1)
+        with self.assertRaises(RequestDataTooBig):
+            read_image_payload(io.BytesIO(body + b' ' * 100).read, max_size=len(body), chunk_size=64)
+        read_image_payload(io.BytesIO(body).read, len(body), max_size=len(body))
+        # A buffer grown past MAX_SCRATCH_BYTES serves its request and is not kept.
+        kept = imaging._scratch.decoded = bytearray(1)
+        with mock.patch('game.imaging.MAX_SCRATCH_BYTES', 16):
+            data, image = read_image_payload(io.BytesIO(body).read, len(body))
+        self.assertEqual(bytes(image), jpeg.tobytes())
+        self.assertIs(imaging._scratch.decoded, kept)
+
+        # A stream that hands out 1 to 3 bytes per read, whatever is asked for.
+        stream, sizes = io.BytesIO(body), itertools.cycle((1, 2, 3))
+        data, image = read_image_payload(lambda n=-1: stream.read(min(n, next(sizes)) if n >= 0 else -1), len(body))
+        self.assertEqual(data['session_id'], 'abc')
+        self.assertEqual(bytes(image), jpeg.tobytes())
+        with self.assertRaises(ValueError):
+            read_image_payload(io.BytesIO(b'{"image": "data:image/jpeg;base64,AAEC').read)
+
+    def test_unescapes_line_wrapped_base64(self):
+        _, jpeg = cv2.imencode('.jpg', np.random.default_rng(1).integers(0, 256, (48, 64, 3), np.uint8))
+        # Wrapped at 76 columns, as MIME encoders do, with "/" and "A" escaped as some JSON encoders write them.
+        wrapped = base64.encodebytes(jpeg.tobytes()).decode()
+        body = json.dumps({'image': 'data:image/jpeg;base64,' + wrapped, 'session_id': 'abc'}).encode()
+        body = body.replace(b'/', b'\\/').replace(b'A', b'\\u0041')
+        self.assertEqual(bytes(split_image_payload(body)[1]), wrapped.replace('\n', '').encode())
+        for chunk_size in (3, 5, 64, 1 << 16):
+            data, image = read_image_payload(io.BytesIO(body).read, len(body), chunk_size=chunk_size)
+            self.assertEqual(data['session_id'], 'abc')
+            self.assertEqual(bytes(image), jpeg.tobytes())
+
+    def test_reduced_decode_for_large_frames(self):
+        _, jpeg = cv2.imencode('.jpg', np.zeros((480, 640, 3), np.uint8))
+        b64 = base64.b64encode(jpeg.tobytes())
+        self.assertEqual(jpeg_size(jpeg.tobytes()), (640, 480))
+        self.assertEqual(decode_base64_image(b64, target_width=320).shape, (240, 320, 3))
+        self.assertEqual(decode_base64_image(b64, target_width=0).shape, (480, 640, 3))
+        self.assertIsNone(decode_base64_image(b'not an image'))
+
+    def test_encodes_at_quality_and_scale(self):
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 256, (240, 320, 3), np.uint8) for _ in range(2)]
+        half = [bytes(encode_jpeg(frame, 70, 0.5)) for frame in frames]
+        self.assertEqual(jpeg_size(half[0]), (160, 120))
+        # The shared resize buffer must not leak one frame into the next.
+        self.assertEqual(half[1], bytes(encode_jpeg(cv2.resize(frames[1], (160, 120), interpolation=cv2.INTER_AREA), 70)))
+        self.assertLess(len(encode_jpeg(frames[0], 50)), len(encode_jpeg(frames[0], 95)))
@@ -0,0 +1,171 @@
+"""
+Per-stage timing of the frame endpoints and the WebSocket game.
+
+Work done for one request (or one WebSocket frame or round) runs inside
+``timed_request(name)``, and each ``with stage(stage_name):`` block inside
+it adds its duration to that request's timings. When the request finishes
+the timings go to:
+
+- per-process histograms, exported in Prometheus text format at /metrics
+  (``STAGE_METRICS``);
+- a standard ``Server-Timing`` header on HTTP responses
+  (``SERVER_TIMING``), read by browser dev tools and
+  benchmarks/bench_frames.py;
+- the slow-request profiler (``PROFILE_SLOW_REQUEST_MS``, see
+  profiling.py).
+
+With all three off, ``timed_request`` only reads three settings and
+``stage`` one context variable.
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .profiling import get_slow_request_sampler
+
+STAGES = ('parse', 'decode', 'detect', 'gesture', 'ai', 'encode')
+# Histogram bucket upper bounds in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_timings = contextvars.ContextVar('stage_timings', default=None)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class StageMetrics:
+    """Latency histograms per request name, and per request name and stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._stages = {}
+
+    def observe(self, name, timings, total):
+        with self._lock:
+            self._requests.setdefault(name, Histogram()).observe(total)
+            for stage_name, seconds in timings.items():
+                self._stages.setdefault((name, stage_name), Histogram()).observe(seconds)
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP rps_request_seconds Time to handle a frame request, WebSocket frame or round.',
+                '# TYPE rps_request_seconds histogram',
+            ]
+            for name, histogram in sorted(self._requests.items()):
+                lines += histogram.render('rps_request_seconds', f'request="{name}"')
+            lines += [
+                '# HELP rps_stage_seconds Time spent in each stage of a request.',
+                '# TYPE rps_stage_seconds histogram',
+            ]
+            for (name, stage_name), histogram in sorted(self._stages.items()):
+                lines += histogram.render('rps_stage_seconds', f'request="{name}",stage="{stage_name}"')
+        return lines
+
+
+_metrics = StageMetrics()
+
+
+def get_stage_metrics():
+    return _metrics
+
+
+def _enabled():
+    return settings.STAGE_METRICS or settings.SERVER_TIMING or settings.PROFILE_SLOW_REQUEST_MS
+
+
+@contextmanager
+def timed_request(name):
+    """
+    Collects the stage timings of one request. Yields the ``{stage: seconds}``
+    dict being filled in, or None when timing is off.
+    """
+    if not _enabled():
+        yield None
+        return
+    if settings.PROFILE_SLOW_REQUEST_MS:
+        get_slow_request_sampler().watch(threading.get_ident())
+    timings = {}
+    token = _timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        end = time.perf_counter()
+        if settings.STAGE_METRICS:
+            _metrics.observe(name, timings, end - start)
+        if settings.PROFILE_SLOW_REQUEST_MS and (end - start) * 1000 >= settings.PROFILE_SLOW_REQUEST_MS:
+            get_slow_request_sampler().dump(name, start, end, timings)
+
+
+@contextmanager
+def stage(name):
+    """Adds the time spent in the block to the current request's ``name`` stage."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def server_timing_header(timings):
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+def parse_server_timing(header):
+    """Returns ``{stage: seconds}`` from a Server-Timing header value."""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in header.split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                timings[name.strip()] = float(value) / 1000
+    return timings
+
+
+def timed_view(view):
+    """Runs an async view in ``timed_request`` and reports its stages when SERVER_TIMING is on."""
+    name = view.__name__
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        with timed_request(name) as timings:
+            response = await view(request, *args, **kwargs)
+        if timings and settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing_header(timings)
+        return response
+    return wrapper
@@ -6,8 +6,14 @@ urlpatterns = [
     path('', views.home_view, name='home'),
     path('start/', views.start_game_view, name='start_game'),
     path('game/<str:username>/', views.index, name='game_page'),
+    path('api/round/', views.new_round, name='new_round'),
     path('api/analyze_frame/', views.analyze_frame, name='analyze_frame'),
+    path('api/analyze_head_to_head/', views.analyze_head_to_head, name='analyze_head_to_head'),
     
     # ADD THIS LINE
     path('api/annotate_only/', views.annotate_only_frame, name='annotate_only'),
+    path('api/landmarks/', views.submit_landmarks, name='submit_landmarks'),
+    path('api/analyze_landmarks/', views.analyze_landmarks, name='analyze_landmarks'),
+    path('api/detector_stats/', views.detector_stats, name='detector_stats'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,16 +1,28 @@
 import json
 import random
-import cv2
+import secrets
+import uuid
 import base64
 import numpy as np
-from cvzone.HandTrackingModule import HandDetector
+from django.conf import settings
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from .admission import PRIORITIES, admission_control, get_admission_controller
+from .detection import DetectorBusy, adetect_for_session, get_detection_service
+from .gestures import assign_players, classify_landmarks, classify_session_frame, get_gesture_voter, record_frame
+from .imaging import decode_jpeg, encode_jpeg, read_image_payload
+from .landmarks import get_spot_checker, parse_landmark_vector
+from .leaderboard import arecord_stats, get_stats_board
+from .model_store import get_model_store
+from .pacing import frame_thumbnail, get_frame_change_detector, suggested_poll_delay_ms
+from .round_log import record_round, start_session
+from .rounds import RoundRejected, get_round_scheduler
+from .strategies import STRATEGIES, new_model
+from .timing import get_stage_metrics, stage, timed_view
+from .vom import VOMModel
 
 # --- VOM AI Model State ---
-player_move_history = []
-move_patterns = {}
 MAX_ORDER = 5
 STATISTICAL_SIGNIFICANCE_THRESHOLD = 1
 
@@ -18,40 +30,97 @@ STATISTICAL_SIGNIFICANCE_THRESHOLD = 1
 move_to_int = {'rock': 1, 'paper': 2, 'scissors': 3}
 int_to_move = {1: 'rock', 2: 'paper', 3: 'scissors'}
 beat_map = {1: 2, 2: 3, 3: 1}
-detector = HandDetector(maxHands=1, detectionCon=0.8)
 
 # --- HELPER FUNCTIONS ---
-def _decode_image_from_base64(image_data_string):
+def _decode_image_from_bytes(image_bytes):
+    return decode_jpeg(image_bytes, settings.DECODE_TARGET_WIDTH)
+
+def _parse_frame_request(request):
+    """
+    Returns the request's JSON fields and decoded image; both are None for a
+    malformed body. The body is read in chunks and never held whole (see
+    read_image_payload), so this must be the only read of request.body.
+    Like request.body, it raises RequestDataTooBig for a body over
+    DATA_UPLOAD_MAX_MEMORY_SIZE.
+    """
     try:
-        image_data = image_data_string.split(',')[1]
-        decoded_image = base64.b64decode(image_data)
-        np_arr = np.frombuffer(decoded_image, np.uint8)
-        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    except (IndexError, base64.binascii.Error):
-        return None
+        with stage('parse'):
+            data, image = read_image_payload(
+                request.read, int(request.META.get('CONTENT_LENGTH') or 0),
+                max_size=settings.DATA_UPLOAD_MAX_MEMORY_SIZE,
+            )
+    except ValueError:
+        return None, None
+    with stage('decode'):
+        return data, _decode_image_from_bytes(image) if image is not None else None
+
+def _hand_payload(hand):
+    """The parts of a detected hand the page needs to draw its own overlay."""
+    gesture, confidence = classify_landmarks(hand['lmList'])
+    return {
+        'lmList': [point[:2] for point in hand['lmList']],
+        'bbox': list(hand['bbox']),
+        'gesture': gesture,
+        'confidence': round(confidence, 2),
+    }
+
+def _annotated_image_response(result, img, image_format):
+    """
+    ``result`` with the annotated image ``img``, in one of three formats:
+
+    - 'data_url' (default): JSON with the JPEG as a base64 data URL in 'annotated_image';
+    - 'jpeg': the raw JPEG, with ``result`` as JSON in the X-Result header;
+    - 'multipart': multipart/form-data with a JSON 'result' part and an 'image' part.
+    """
+    with stage('encode'):
+        jpeg = encode_jpeg(img, settings.ANNOTATED_JPEG_QUALITY, settings.ANNOTATED_IMAGE_SCALE)
+        if image_format == 'jpeg':
+            response = HttpResponse(jpeg, content_type='image/jpeg')
+            response['X-Result'] = json.dumps(result, separators=(',', ':'))
+        elif image_format == 'multipart':
+            boundary = secrets.token_hex(16).encode()
+            response = HttpResponse(b''.join((
+                b'--', boundary, b'\r\nContent-Disposition: form-data; name="result"\r\n'
+                b'Content-Type: application/json\r\n\r\n', json.dumps(result).encode(),
+                b'\r\n--', boundary, b'\r\nContent-Disposition: form-data; name="image"; filename="annotated.jpg"\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n', jpeg,
+                b'\r\n--', boundary, b'--\r\n',
+            )), content_type=f'multipart/form-data; boundary={boundary.decode()}')
+        else:
+            result['annotated_image'] = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')
+            response = JsonResponse(result)
+    return response
+
+def _pack_landmarks(hands, width, height):
+    """
+    Packs detection results as little-endian int16s:
+    [width, height, hand count, then per hand: bbox x, y, w, h, gesture (0 = none,
+    1-3 = rock/paper/scissors) and the 21 landmarks as x, y pairs].
+    """
+    values = [width, height, len(hands)]
+    for hand in hands:
+        values.extend(hand['bbox'])
+        values.append(move_to_int.get(classify_landmarks(hand['lmList'])[0], 0))
+        for x, y, _ in hand['lmList']:
+            values.extend((x, y))
+    return np.clip(values, -32768, 32767).astype('<i2').tobytes()
 
 # --- VOM AI Prediction and Learning Functions ---
-def update_vom_patterns(history):
-    global move_patterns
-    if not history:
-        return
-    outcome = history[-1]
-    outcome_index = outcome - 1
-    for order in range(1, MAX_ORDER + 1):
-        if len(history) > order:
-            pattern = tuple(history[-(order + 1):-1])
-            if pattern not in move_patterns:
-                move_patterns[pattern] = np.zeros(3)
-            move_patterns[pattern][outcome_index] += 1
-
-def ai_predict_vom(history):
-    for order in range(min(len(history), MAX_ORDER), 0, -1):
-        pattern_to_check = tuple(history[-order:])
-        if pattern_to_check in move_patterns and np.sum(move_patterns[pattern_to_check]) > STATISTICAL_SIGNIFICANCE_THRESHOLD:
-            prediction_counts = move_patterns[pattern_to_check]
-            predicted_player_move = np.argmax(prediction_counts) + 1
-            return beat_map[predicted_player_move]
-    return random.randint(1, 3)
+def new_vom_model():
+    return VOMModel(MAX_ORDER, STATISTICAL_SIGNIFICANCE_THRESHOLD)
+
+def new_ai_model(strategy=None, vom=None):
+    """A model for ``strategy`` (default settings.AI_STRATEGY), optionally warmed up from ``vom``."""
+    return new_model(strategy or settings.AI_STRATEGY, MAX_ORDER, STATISTICAL_SIGNIFICANCE_THRESHOLD, vom)
+
+def update_vom_patterns(model, move):
+    model.update(move)
+
+def ai_predict_vom(model):
+    predicted_player_move = model.predict()
+    if predicted_player_move is None:
+        return random.randint(1, 3)
+    return beat_map[predicted_player_move]
 
 def get_winner(player_move, ai_move):
     if player_move == ai_move: return 'tie'
@@ -61,7 +130,8 @@ def get_winner(player_move, ai_move):
 
 # --- DJANGO VIEWS ---
 def home_view(request):
-    return render(request, 'game/home.html')
+    leaderboard = get_stats_board().leaderboard() if settings.PLAYER_STATS else []
+    return render(request, 'game/home.html', {'leaderboard': leaderboard})
 
 def start_game_view(request):
     if request.method == 'POST':
@@ -71,82 +141,348 @@ def start_game_view(request):
     return redirect('home')
 
 def index(request, username):
-    global player_move_history, move_patterns
-    player_move_history = []
-    move_patterns = {}
-    context = {'username': username}
+    # Every page load starts a fresh game session with the AI strategy from
+    # ?ai=, which starts from what the player's earlier games taught it.
+    session_id = uuid.uuid4().hex
+    strategy = request.GET.get('ai')
+    if strategy not in STRATEGIES:
+        strategy = settings.AI_STRATEGY
+    vom = None
+    if settings.ROUND_LOG:
+        vom = start_session(session_id, username, MAX_ORDER, STATISTICAL_SIGNIFICANCE_THRESHOLD)
+    get_model_store().put(session_id, new_ai_model(strategy, vom))
+    stats = None
+    if settings.PLAYER_STATS:
+        board = get_stats_board()
+        board.start_game(session_id, username)
+        stats = board.stats(username)
+    context = {
+        'username': username,
+        'session_id': session_id,
+        'client_inference': settings.CLIENT_INFERENCE,
+        'stats': stats,
+    }
     return render(request, 'game/index.html', context)
 
+def _busy_response():
+    return JsonResponse({'error': 'Server busy, try again.'}, status=503)
+
+async def _claim_round(request):
+    """
+    The session of the round the request's X-Round-Token opened, or None when
+    ROUND_TOKENS is off; raises RoundRejected for a frame outside its round.
+    """
+    if not settings.ROUND_TOKENS:
+        return None
+    return await get_round_scheduler().aclaim(request.headers.get('X-Round-Token'))
+
+async def _unsettled(request, response):
+    """
+    Returns ``response`` for a frame that was claimed for its round but did
+    not settle it, after giving the round back so another frame can.
+    """
+    if settings.ROUND_TOKENS:
+        await get_round_scheduler().arelease(request.headers.get('X-Round-Token'))
+    return response
+
 @csrf_exempt
-def annotate_only_frame(request):
+def new_round(request):
+    """Opens the session's next round: its token, countdown start, shoot time and deadline."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        session_id = str(json.loads(request.body).get('session_id') or 'anonymous')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    return JsonResponse(get_round_scheduler().issue(session_id))
+
+async def _settle_round(session_id, player_move_str, confidence):
+    """Plays the AI against the player's move, teaches it the move and returns the result."""
+    get_gesture_voter().reset(session_id)
+    with stage('ai'):
+        store = get_model_store()
+        model = await store.aget(session_id) or new_ai_model()
+        player_move_int = move_to_int[player_move_str]
+        ai_move_int = ai_predict_vom(model)
+        update_vom_patterns(model, player_move_int)
+        await store.aput(session_id, model)
+    ai_move_str = int_to_move[ai_move_int]
+    winner = get_winner(player_move_str, ai_move_str)
+    record_round(session_id, player_move_str, ai_move_str, winner)
+    await arecord_stats(session_id, player_move_str, winner)
+    return {
+        'player_move': player_move_str,
+        'confidence': round(confidence, 2),
+        'ai_move': ai_move_str,
+        'winner': winner,
+    }
+
+@csrf_exempt
+@timed_view
+@admission_control('annotate')
+async def annotate_only_frame(request):
     """
     A lightweight view that only performs hand detection and annotation.
     It does NOT run any game logic. Built for speed to be called repeatedly.
+
+    By default only the landmarks, bbox and gesture of each hand are returned
+    so the page can draw its own overlay. 'mode': 'binary' returns the same
+    data packed as int16s, and 'mode': 'image' returns the annotated JPEG in
+    the 'image_format' of _annotated_image_response. Every response carries
+    the delay the client should wait before polling again ('next_poll_ms', or
+    the X-Next-Poll-Ms header in binary mode).
     """
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request method'}, status=405)
 
-    data = json.loads(request.body)
-    img = _decode_image_from_base64(data.get('image', ''))
+    data, img = _parse_frame_request(request)
 
     if img is None:
         return JsonResponse({'error': 'Invalid image data'}, status=400)
 
-    # Use draw=True to get the annotated image back from the detector.
-    _, img_with_annotations = detector.findHands(img, draw=True)
+    mode = data.get('mode', 'landmarks')
+    session_id = str(data.get('session_id') or 'anonymous')
+    height, width = img.shape[:2]
+    service = get_detection_service()
+    next_poll_ms = suggested_poll_delay_ms(service.queue_depth, service.workers)
+
+    # A frame that barely differs from the last one analysed for this session
+    # gets the previous landmarks back without another inference.
+    change_detector = get_frame_change_detector()
+    thumbnail = frame_thumbnail(img)
+    hands = change_detector.reusable_result(session_id, thumbnail) if mode != 'image' else None
+
+    if hands is None:
+        # Use draw=True to get the annotated image back from the detector.
+        try:
+            with stage('detect'):
+                hands, img_with_annotations = await adetect_for_session(session_id, img, draw=(mode == 'image'))
+        except DetectorBusy:
+            return JsonResponse({'error': 'Server busy, try again.', 'next_poll_ms': settings.ANNOTATE_MAX_POLL_MS}, status=503)
+        change_detector.remember(session_id, thumbnail, hands)
+    with stage('gesture'):
+        record_frame(session_id, hands)
 
-    # Encode the annotated image back to Base64 to send to the frontend.
-    _, buffer = cv2.imencode('.jpg', img_with_annotations)
-    annotated_image_base64 = base64.b64encode(buffer).decode('utf-8')
-    annotated_image_data_url = f"data:image/jpeg;base64,{annotated_image_base64}"
+    if mode == 'binary':
+        with stage('encode'):
+            response = HttpResponse(_pack_landmarks(hands, width, height), content_type='application/octet-stream')
+        response['X-Next-Poll-Ms'] = str(next_poll_ms)
+        return response
+    if mode != 'image':
+        with stage('encode'):
+            return JsonResponse({
+                'hands': [_hand_payload(hand) for hand in hands],
+                'width': width,
+                'height': height,
+                'next_poll_ms': next_poll_ms,
+            })
 
     # Return only the annotated image.
-    return JsonResponse({'annotated_image': annotated_image_data_url})
+    return _annotated_image_response({'next_poll_ms': next_poll_ms}, img_with_annotations, data.get('image_format'))
 
 @csrf_exempt
-def analyze_frame(request):
+@timed_view
+@admission_control('round')
+async def analyze_frame(request):
     """
     Receives the final image, runs game logic, and returns the result.
     """
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request method'}, status=405)
+    # Late and repeated frames are turned away before the image is decoded.
+    try:
+        round_session = await _claim_round(request)
+    except RoundRejected as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
 
-    data = json.loads(request.body)
-    img = _decode_image_from_base64(data.get('image', ''))
+    data, img = _parse_frame_request(request)
 
     if img is None:
-        return JsonResponse({'error': 'Invalid image data'}, status=400)
+        return await _unsettled(request, JsonResponse({'error': 'Invalid image data'}, status=400))
 
     # Final detection and annotation for the result screen
-    hands, img_with_annotations = detector.findHands(img, draw=True)
-    
-    player_move_str = None
-    if hands:
-        fingers = detector.fingersUp(hands[0])
-        if fingers == [0, 0, 0, 0, 0]: player_move_str = "rock"
-        elif fingers == [1, 1, 1, 1, 1]: player_move_str = "paper"
-        elif fingers == [0, 1, 1, 0, 0]: player_move_str = "scissors"
+    session_id = round_session or str(data.get('session_id') or 'anonymous')
+    try:
+        with stage('detect'):
+            hands, img_with_annotations = await adetect_for_session(session_id, img, draw=True)
+    except DetectorBusy:
+        return await _unsettled(request, _busy_response())
+
+    # The final frame is combined with the session's last few annotated frames,
+    # unless it is a spot check of client-side inference, which it decides alone.
+    spot_checker = get_spot_checker()
+    with stage('gesture'):
+        if spot_checker.pending(session_id):
+            get_gesture_voter().reset(session_id)
+        player_move_str, confidence = classify_session_frame(session_id, hands)
+    spot_checker.verify(session_id, player_move_str)
 
     if not player_move_str:
-        return JsonResponse({'error': 'No hand detected or invalid gesture.'})
-
-    # Game Logic
-    global player_move_history
-    player_move_int = move_to_int[player_move_str]
-    ai_move_int = ai_predict_vom(player_move_history)
-    player_move_history.append(player_move_int)
-    update_vom_patterns(player_move_history)
-    ai_move_str = int_to_move[ai_move_int]
-    winner = get_winner(player_move_str, ai_move_str)
+        return await _unsettled(request, JsonResponse({'error': 'No hand detected or invalid gesture.'}))
+
+    result = await _settle_round(session_id, player_move_str, confidence)
+
+    # The final annotated image for the result display
+    return _annotated_image_response(result, img_with_annotations, data.get('image_format'))
+
+@csrf_exempt
+@timed_view
+@admission_control('round')
+async def analyze_head_to_head(request):
+    """
+    Settles a round between two players sharing one camera. Both hands come
+    from one detection of the frame, are split into the left and right
+    player by position, and the two moves go through get_winner. The page
+    keeps the score and the AI plays no part. Needs DETECTOR_MAX_HANDS = 2.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    if settings.DETECTOR_MAX_HANDS < 2:
+        return JsonResponse({'error': 'Head-to-head needs DETECTOR_MAX_HANDS = 2.'}, status=501)
+    try:
+        round_session = await _claim_round(request)
+    except RoundRejected as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+
+    data, img = _parse_frame_request(request)
+
+    if img is None:
+        return await _unsettled(request, JsonResponse({'error': 'Invalid image data'}, status=400))
+
+    session_id = round_session or str(data.get('session_id') or 'anonymous')
+    try:
+        with stage('detect'):
+            hands, img_with_annotations = await adetect_for_session(session_id, img, draw=True)
+    except DetectorBusy:
+        return await _unsettled(request, _busy_response())
+
+    with stage('gesture'):
+        players = assign_players(hands)
+        moves = [classify_landmarks(hand['lmList'])[0] for hand in players] if players else [None, None]
+    if not all(moves):
+        response = JsonResponse({'error': 'Both players need a clear hand in view.', 'hands': len(hands)})
+        return await _unsettled(request, response)
+
+    left_move, right_move = moves
+    winner = {'player': 'left', 'ai': 'right', 'tie': 'tie'}[get_winner(left_move, right_move)]
+    result = {'left_move': left_move, 'right_move': right_move, 'winner': winner}
+    return _annotated_image_response(result, img_with_annotations, data.get('image_format'))
+
+def _parse_landmark_request(request):
+    """
+    Returns the request's JSON fields and the hands it reports (an empty list
+    for no hand); both are None for a malformed body or an implausible hand.
+    """
+    try:
+        with stage('parse'):
+            data = json.loads(request.body)
+            lm_list = parse_landmark_vector(data.get('landmarks'), data.get('width'), data.get('height'))
+    except (ValueError, AttributeError):
+        return None, None
+    return data, [{'lmList': lm_list}] if lm_list else []
 
-    # Encode the final annotated image for the result display
-    _, buffer = cv2.imencode('.jpg', img_with_annotations)
-    annotated_image_base64 = base64.b64encode(buffer).decode('utf-8')
-    annotated_image_data_url = f"data:image/jpeg;base64,{annotated_image_base64}"
+@csrf_exempt
+@timed_view
+async def submit_landmarks(request):
+    """
+    The live counterpart of annotate_only_frame for client-side inference: the
+    page posts the landmarks it found and gets the gesture back. The frames
+    vote on the round just like server-side detections.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    data, hands = _parse_landmark_request(request)
+    if hands is None:
+        return JsonResponse({'error': 'Invalid landmarks'}, status=400)
 
+    session_id = str(data.get('session_id') or 'anonymous')
+    with stage('gesture'):
+        record_frame(session_id, hands)
+        gesture, confidence = classify_landmarks(hands[0]['lmList']) if hands else (None, 0.0)
     return JsonResponse({
-        'player_move': player_move_str,
-        'ai_move': ai_move_str,
-        'winner': winner,
-        'annotated_image': annotated_image_data_url,
-    })
\ No newline at end of file
+        'gesture': gesture,
+        'confidence': round(confidence, 2),
+        'next_poll_ms': settings.ANNOTATE_MIN_POLL_MS,
+    })
+
+@csrf_exempt
+@timed_view
+async def analyze_landmarks(request):
+    """
+    Settles a round from client-side landmarks. For a random sample of rounds
+    it answers {'spot_check': true} instead, and the page must send the same
+    frame to analyze_frame, which settles the round from the image. With
+    ROUND_TOKENS on, 'round' carries the token to send that frame with.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        round_session = await _claim_round(request)
+    except RoundRejected as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+    data, hands = _parse_landmark_request(request)
+    if hands is None:
+        return await _unsettled(request, JsonResponse({'error': 'Invalid landmarks'}, status=400))
+
+    session_id = round_session or str(data.get('session_id') or 'anonymous')
+    with stage('gesture'):
+        player_move_str, confidence = classify_session_frame(session_id, hands)
+    if not player_move_str:
+        return await _unsettled(request, JsonResponse({'error': 'No hand detected or invalid gesture.'}))
+    if get_spot_checker().claim(session_id, player_move_str):
+        response = {'spot_check': True}
+        if settings.ROUND_TOKENS:
+            response['round'] = get_round_scheduler().issue(session_id, immediate=True)
+        return JsonResponse(response)
+    return JsonResponse(await _settle_round(session_id, player_move_str, confidence))
+
+def detector_stats(request):
+    """Queue depth and recent inference latency of this worker's detection pool."""
+    return JsonResponse(get_detection_service().stats())
+
+def metrics(request):
+    """
+    This process's stage latency histograms and detector counters in Prometheus
+    text format. Each web process keeps its own, so scrape every process.
+    """
+    stats = get_detection_service().stats()
+    lines = get_stage_metrics().render()
+    lines += [
+        '# HELP rps_detector_queue_depth Frames waiting for or in hand detection.',
+        '# TYPE rps_detector_queue_depth gauge',
+        f"rps_detector_queue_depth {stats['queue_depth']}",
+        '# HELP rps_detector_frames_total Frames detected or refused because the queue was full.',
+        '# TYPE rps_detector_frames_total counter',
+        f'rps_detector_frames_total{{result="processed"}} {stats["processed"]}',
+        f'rps_detector_frames_total{{result="rejected"}} {stats["rejected"]}',
+    ]
+    spot_checker = get_spot_checker()
+    lines += [
+        '# HELP rps_spot_checks_total Client-side inference rounds re-checked against a real frame.',
+        '# TYPE rps_spot_checks_total counter',
+        f'rps_spot_checks_total{{result="match"}} {spot_checker.checked - spot_checker.mismatches}',
+        f'rps_spot_checks_total{{result="mismatch"}} {spot_checker.mismatches}',
+    ]
+    scheduler = get_round_scheduler()
+    lines += [
+        '# HELP rps_rounds_issued_total Rounds opened for the HTTP game.',
+        '# TYPE rps_rounds_issued_total counter',
+        f'rps_rounds_issued_total {scheduler.issued}',
+        '# HELP rps_round_frames_rejected_total Final frames turned away without being decoded.',
+        '# TYPE rps_round_frames_rejected_total counter',
+    ]
+    lines += [f'rps_round_frames_rejected_total{{reason="{reason}"}} {count}' for reason, count in scheduler.rejected.items()]
+    controller = get_admission_controller()
+    if controller is not None:
+        lines += [
+            '# HELP rps_admission_in_flight Frame requests admitted and not yet answered.',
+            '# TYPE rps_admission_in_flight gauge',
+            f'rps_admission_in_flight {controller.in_flight}',
+            '# HELP rps_admission_requests_total Frame requests admitted or shed before decoding, by priority.',
+            '# TYPE rps_admission_requests_total counter',
+        ]
+        lines += [f'rps_admission_requests_total{{priority="{priority}",result="admitted"}} {controller.admitted[priority]}'
+                  for priority in PRIORITIES]
+        lines += [f'rps_admission_requests_total{{priority="{priority}",result="shed",reason="{reason}"}} {count}'
+                  for (priority, reason), count in controller.shed.items()]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
@@ -0,0 +1,200 @@
+"""
+Variable-order Markov (VOM) engine for the AI opponent.
+
+With only three moves, every context of length k maps onto a base-3 number
+below 3**k. The engine keeps a rolling base-3 hash of the last ``max_order``
+moves (most recent move in the lowest digit), so the context for any order k
+is simply ``context % 3**k``. Counts for all orders live in one flat table:
+
+    slot = (offset[k] + context % 3**k) * 3 + outcome
+
+where ``offset[k]`` is the number of contexts of all shorter orders. Learning
+and prediction are then a handful of integer operations per order, with no
+tuple building and no per-pattern objects.
+
+``DecayedVOMModel`` is the variant for long sessions. Its table is always
+dense and sized to fit a byte budget, and old counts fade with a half-life
+so a player who changes habits is picked up again quickly. Instead of
+shrinking every count each round, each new move counts for a little more
+than the one before; the whole table is rescaled only when that weight gets
+large.
+"""
+
+import sys
+from array import array
+
+# A DecayedVOMModel rescales its table once a new move weighs this much.
+RESCALE_WEIGHT = 1e30
+
+# Above this size the dense table is swapped for a sparse one that only
+# stores the contexts a player has actually produced.
+DENSE_MAX_BYTES = 16 * 1024
+
+
+class _SparseCounts(dict):
+    """Dict of slot -> count that reads missing slots as 0 without inserting them."""
+    __slots__ = ()
+
+    def __missing__(self, key):
+        return 0
+
+
+def context_count(max_order):
+    """Number of contexts across orders 1..max_order (3 + 9 + ... + 3**max_order)."""
+    return (3 ** (max_order + 1) - 3) // 2
+
+
+class VOMModel:
+    """Counts of the player's next move after every context of up to ``max_order`` moves."""
+    __slots__ = ('max_order', 'threshold', 'length', 'context', 'counts')
+
+    def __init__(self, max_order, threshold):
+        self.max_order = max_order
+        self.threshold = threshold
+        self.length = 0    # Moves seen so far, capped at max_order.
+        self.context = 0   # Last max_order moves as a base-3 number.
+        slots = context_count(max_order) * 3
+        if slots * array('I').itemsize <= DENSE_MAX_BYTES:
+            self.counts = array('I', bytes(slots * array('I').itemsize))
+        else:
+            self.counts = _SparseCounts()
+
+    def update(self, move):
+        """Records that the player threw ``move`` (1-3) after the current context."""
+        outcome = move - 1
+        counts = self.counts
+        context = self.context
+        power = 1
+        offset = 0
+        for _ in range(self.length):
+            power *= 3
+            counts[(offset + context % power) * 3 + outcome] += 1
+            offset += power
+        self.context = (context * 3 + outcome) % (3 ** self.max_order)
+        if self.length < self.max_order:
+            self.length += 1
+
+    def predict(self):
+        """
+        Returns the player's most likely next move (1-3) from the longest
+        context seen more than ``threshold`` times, or None if there is none.
+        """
+        counts = self.counts
+        context = self.context
+        threshold = self.threshold
+        for order in range(self.length, 0, -1):
+            power = 3 ** order
+            base = (context_count(order - 1) + context % power) * 3
+            rock, paper, scissors = counts[base], counts[base + 1], counts[base + 2]
+            if rock + paper + scissors > threshold:
+                if rock >= paper and rock >= scissors:
+                    return 1
+                return 2 if paper >= scissors else 3
+        return None
+
+    def reset_context(self):
+        """Forgets the recent moves but keeps the counts, as at the start of a new game."""
+        self.length = 0
+        self.context = 0
+
+    def to_bytes(self):
+        """The count table as bytes (native byte order); the recent moves are not included."""
+        if isinstance(self.counts, dict):
+            pairs = array('Q')
+            for slot, count in self.counts.items():
+                pairs.extend((slot, count))
+            return b'S' + pairs.tobytes()
+        return b'D' + self.counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, max_order, threshold, data):
+        """A model with the counts from ``to_bytes``; raises ValueError if they do not fit ``max_order``."""
+        model = cls(max_order, threshold)
+        kind, body = bytes(data[:1]), bytes(data[1:])
+        if kind == b'D' and not isinstance(model.counts, dict):
+            counts = array('I')
+            counts.frombytes(body)
+            if len(counts) != len(model.counts):
+                raise ValueError('Count table does not match max_order.')
+            model.counts = counts
+        elif kind == b'S' and isinstance(model.counts, dict):
+            pairs = array('Q')
+            pairs.frombytes(body)
+            model.counts.update(zip(pairs[::2], pairs[1::2]))
+        else:
+            raise ValueError('Count table does not match max_order.')
+        return model
+
+    def nbytes(self):
+        """Approximate memory held by this model, including its count table."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.counts)
+        if isinstance(self.counts, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.counts.items())
+        return size
+
+
+class DecayedVOMModel:
+    """
+    A VOM model whose counts halve every ``half_life`` rounds, in a dense
+    float32 table of at most ``max_bytes``. Orders that would not fit are
+    dropped, longest first.
+    """
+    __slots__ = ('max_order', 'threshold', 'decay', 'weight', 'length', 'context', 'counts')
+
+    def __init__(self, max_order, threshold, half_life, max_bytes):
+        itemsize = array('f').itemsize
+        while max_order > 1 and context_count(max_order) * 3 * itemsize > max_bytes:
+            max_order -= 1
+        self.max_order = max_order
+        self.threshold = threshold
+        self.decay = 0.5 ** (1 / half_life)
+        # What the next move adds to the counts. Every count is worth
+        # stored / weight * decay moves, so growing the weight by 1 / decay
+        # each round decays all of them at once.
+        self.weight = 1.0
+        self.length = 0
+        self.context = 0
+        self.counts = array('f', bytes(context_count(max_order) * 3 * itemsize))
+
+    def update(self, move):
+        outcome = move - 1
+        counts = self.counts
+        context = self.context
+        weight = self.weight
+        power = 1
+        offset = 0
+        for _ in range(self.length):
+            power *= 3
+            counts[(offset + context % power) * 3 + outcome] += weight
+            offset += power
+        self.context = (context * 3 + outcome) % (3 ** self.max_order)
+        if self.length < self.max_order:
+            self.length += 1
+        self.weight = weight / self.decay
+        if self.weight > RESCALE_WEIGHT:
+            scale = 1 / self.weight
+            for slot in range(len(counts)):
+                counts[slot] *= scale
+            self.weight = 1.0
+
+    def predict(self):
+        counts = self.counts
+        context = self.context
+        # The threshold in stored units: the last move added weight * decay.
+        threshold = self.threshold * self.weight * self.decay
+        for order in range(self.length, 0, -1):
+            power = 3 ** order
+            base = (context_count(order - 1) + context % power) * 3
+            rock, paper, scissors = counts[base], counts[base + 1], counts[base + 2]
+            if rock + paper + scissors > threshold:
+                if rock >= paper and rock >= scissors:
+                    return 1
+                return 2 if paper >= scissors else 3
+        return None
+
+    def reset_context(self):
+        self.length = 0
+        self.context = 0
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.counts)
@@ -1,17 +1,46 @@
 # rps/asgi.py
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-# import game.routing  # Make sure this line exists
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rps.settings')
 
+# Set up Django before importing anything that touches models or app code.
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+from django.conf import settings  # noqa: E402
+import game.routing  # noqa: E402
+from game.detection import preload_vision_stack, start_detection_warmup  # noqa: E402
+
+
+async def lifespan(scope, receive, send):
+    """
+    Starts the detectors' fork server and warms them up in the background as
+    each server process starts. Not at import: under gunicorn --preload that
+    would run once in the master, whose fork server its workers cannot use.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            preload_vision_stack()
+            if settings.DETECTOR_WARMUP:
+                start_detection_warmup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    # "websocket": AuthMiddlewareStack(
-    #     URLRouter(
-    #         game.routing.websocket_urlpatterns  # And that it's being used here
-    #     )
-    # ),
-})
\ No newline at end of file
+    "http": django_asgi_app,
+    "lifespan": lifespan,
+    "websocket": AllowedHostsOriginValidator(
+        AuthMiddlewareStack(
+            URLRouter(
+                game.routing.websocket_urlpatterns
+            )
+        )
+    ),
+})
@@ -87,6 +87,190 @@ DATABASES = {
 }
 
 
+# ==============================================================================
+# CACHE SETTINGS
+# ==============================================================================
+
+# The 'vom' cache holds the shared per-session AI models when
+# VOM_STORE_BACKEND is 'cache'. With REDIS_URL set it uses Redis, otherwise it
+# uses a table in the database above (create it with `manage.py createcachetable`).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'vom': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    } if 'REDIS_URL' in os.environ else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'vom_models',
+    },
+    # Short-lived state every worker has to agree on: which round tokens have
+    # been used (game/rounds.py) and who holds each room seat
+    # (game/consumers.py). Redis when REDIS_URL is set, like the channel layer;
+    # otherwise per process, which is only right with a single worker.
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    } if 'REDIS_URL' in os.environ else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+    # Player stats and the leaderboard (game/leaderboard.py). Redis when
+    # REDIS_URL is set; otherwise per process, which is only right with a
+    # single worker.
+    'stats': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'TIMEOUT': None,
+    } if 'REDIS_URL' in os.environ else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stats',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Rooms (ws/room/<name>/) talk across workers through the channel layer. With
+# REDIS_URL set it uses Redis (needs channels-redis); otherwise the in-memory
+# layer, which only reaches consumers in the same process.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [os.environ['REDIS_URL']]},
+    } if 'REDIS_URL' in os.environ else {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+
+# ==============================================================================
+# GAME SETTINGS
+# ==============================================================================
+
+# Where per-session AI models live: 'local' keeps them in each worker process
+# (LRU with an idle timeout), 'cache' shares them through the 'vom' cache.
+VOM_STORE_BACKEND = os.environ.get('VOM_STORE_BACKEND', 'local')
+VOM_STORE_CACHE = 'vom'
+# Most sessions a worker keeps in memory before evicting the least recently used.
+VOM_STORE_MAX_SESSIONS = int(os.environ.get('VOM_STORE_MAX_SESSIONS', '5000'))
+# Seconds a session may stay idle before its model is dropped.
+VOM_STORE_TTL = int(os.environ.get('VOM_STORE_TTL', '1800'))
+
+# The AI a game plays unless the page is opened with ?ai=<name>: 'vom',
+# 'vom_decay', 'markov1', 'markov2' or 'ensemble' (see game/strategies.py).
+AI_STRATEGY = os.environ.get('AI_STRATEGY', 'vom')
+# 'vom_decay' halves old counts every VOM_HALF_LIFE rounds and keeps its table
+# within VOM_MAX_BYTES per session, dropping the longest orders if needed.
+VOM_HALF_LIFE = int(os.environ.get('VOM_HALF_LIFE', '50'))
+VOM_MAX_BYTES = int(os.environ.get('VOM_MAX_BYTES', '8192'))
+
+# Hand detection runs in DETECTOR_WORKERS processes, each with its own
+# MediaPipe graph. 0 keeps it on a single background thread in the web worker.
+DETECTOR_WORKERS = int(os.environ.get('DETECTOR_WORKERS', str(os.cpu_count() or 1)))
+# Frames allowed to wait for a detector before new ones are refused with a 503.
+DETECTOR_MAX_PENDING = int(os.environ.get('DETECTOR_MAX_PENDING', '32'))
+# 2 for a kiosk where two players share the camera (head-to-head mode); it
+# also turns ROI tracking off, since a crop around one hand would lose the other.
+DETECTOR_MAX_HANDS = int(os.environ.get('DETECTOR_MAX_HANDS', '1'))
+DETECTOR_CONFIDENCE = 0.8
+# Run one inference on a blank frame as each detector worker starts, and start
+# the workers as soon as the server is up (ASGI lifespan) rather than on the
+# first frame.
+DETECTOR_WARMUP = os.environ.get('DETECTOR_WARMUP', 'True') == 'True'
+# 'spawn' imports the vision stack in every worker. 'forkserver' imports it
+# once in a fork server that each web worker starts from the ASGI lifespan,
+# and forks its detector workers from that, which shares it between them.
+DETECTOR_START_METHOD = os.environ.get('DETECTOR_START_METHOD', 'spawn')
+# While every detector is busy, frames wait up to DETECTOR_BATCH_WINDOW_MS to
+# be sent to a worker together, at most DETECTOR_BATCH_MAX_SIZE at once.
+# Larger batches mean fewer round trips under load but more wait per frame;
+# a max size of 1 turns batching off.
+DETECTOR_BATCH_WINDOW_MS = int(os.environ.get('DETECTOR_BATCH_WINDOW_MS', '5'))
+DETECTOR_BATCH_MAX_SIZE = int(os.environ.get('DETECTOR_BATCH_MAX_SIZE', '8'))
+# Hand frames to detector worker processes through shared memory instead of
+# pickling them: DETECTOR_MAX_PENDING slots of DETECTOR_FRAME_SLOT_BYTES each
+# (a 640x480 BGR frame by default). Larger frames are still pickled.
+DETECTOR_SHARED_FRAMES = os.environ.get('DETECTOR_SHARED_FRAMES', 'True') == 'True'
+DETECTOR_FRAME_SLOT_BYTES = int(os.environ.get('DETECTOR_FRAME_SLOT_BYTES', str(640 * 480 * 3)))
+# Annotated images sent back to the page are JPEGs of this quality (1-100),
+# resized by ANNOTATED_IMAGE_SCALE (1 keeps the decoded frame's size).
+ANNOTATED_JPEG_QUALITY = int(os.environ.get('ANNOTATED_JPEG_QUALITY', '70'))
+ANNOTATED_IMAGE_SCALE = float(os.environ.get('ANNOTATED_IMAGE_SCALE', '1.0'))
+# Frames at least twice this wide are decoded at 1/2, 1/4 or 1/8 scale
+# (0 always decodes at full size).
+DECODE_TARGET_WIDTH = int(os.environ.get('DECODE_TARGET_WIDTH', '320'))
+# Look for the hand around where it was in the session's previous frame first;
+# the crop extends ROI_MARGIN hand-widths beyond the last bounding box.
+ROI_TRACKING = os.environ.get('ROI_TRACKING', 'True') == 'True'
+ROI_MARGIN = 0.6
+# Keep every settled round in the database, written in batches of up to
+# ROUND_LOG_BATCH_SIZE at least every ROUND_LOG_FLUSH_INTERVAL seconds, and
+# warm a returning player's AI up from their history. A player's snapshot of
+# counts is refreshed once ROUND_SNAPSHOT_EVERY rounds have been played since.
+ROUND_LOG = os.environ.get('ROUND_LOG', 'True') == 'True'
+ROUND_LOG_BATCH_SIZE = 50
+ROUND_LOG_FLUSH_INTERVAL = 2.0
+ROUND_SNAPSHOT_EVERY = 20
+# Keep each named player's stats and the top LEADERBOARD_SIZE players up to
+# date in the 'stats' cache, written to the database every
+# STATS_CHECKPOINT_INTERVAL seconds. On by default with REDIS_URL set. Without
+# it the 'stats' cache is per process, which is only right with a single
+# worker (as in the Procfile): set PLAYER_STATS=True to turn it on there. With
+# several workers and no Redis, a worker that did not start a game cannot tell
+# whose round it settled, and each worker's checkpoint overwrites the others'.
+PLAYER_STATS = os.environ.get('PLAYER_STATS', str('REDIS_URL' in os.environ)) == 'True'
+LEADERBOARD_SIZE = 10
+STATS_CHECKPOINT_INTERVAL = int(os.environ.get('STATS_CHECKPOINT_INTERVAL', '30'))
+
+# The HTTP game's rounds are timed by the server: the page gets a token for
+# each round and its final frame is refused unless it arrives within
+# ROUND_CAPTURE_WINDOW_MS of the shot. Each round's countdown starts up to
+# ROUND_JITTER_MS late so that players do not all upload at once.
+ROUND_TOKENS = os.environ.get('ROUND_TOKENS', 'True') == 'True'
+ROUND_COUNTDOWN_MS = 3000
+ROUND_CAPTURE_WINDOW_MS = int(os.environ.get('ROUND_CAPTURE_WINDOW_MS', '2000'))
+ROUND_JITTER_MS = int(os.environ.get('ROUND_JITTER_MS', '500'))
+
+# Lowest template match (0-1) accepted as a gesture, and how many recent
+# frames (no older than GESTURE_VOTE_WINDOW seconds) vote on a round's move.
+GESTURE_MIN_CONFIDENCE = 0.8
+GESTURE_VOTE_FRAMES = 5
+GESTURE_VOTE_WINDOW = 1.0
+# Let the page run MediaPipe Hands in the browser (?inference=client) and post
+# landmarks instead of frames. Needs the @mediapipe/hands files (hands.js and
+# the .wasm, .data, .binarypb and .tflite files it loads) in
+# game/static/game/mediapipe/. LANDMARK_SPOT_CHECK_RATE of those rounds are
+# settled from a real frame instead, to catch clients reporting false hands.
+CLIENT_INFERENCE = os.environ.get('CLIENT_INFERENCE', 'False') == 'True'
+LANDMARK_SPOT_CHECK_RATE = float(os.environ.get('LANDMARK_SPOT_CHECK_RATE', '0.05'))
+# Send per-stage timings of the frame endpoints in a Server-Timing header.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', str(DEBUG)) == 'True'
+# Keep per-stage latency histograms, served at /metrics.
+STAGE_METRICS = os.environ.get('STAGE_METRICS', 'True') == 'True'
+# Requests slower than this many milliseconds get a sampled profile written to
+# PROFILE_DIR (0 turns the profiler off).
+PROFILE_SLOW_REQUEST_MS = int(os.environ.get('PROFILE_SLOW_REQUEST_MS', '0'))
+PROFILE_SAMPLE_INTERVAL_MS = 5
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+
+# Bounds for the delay the server suggests between live annotation polls; it
+# grows from the minimum as the detection queue fills up.
+ANNOTATE_MIN_POLL_MS = 100
+ANNOTATE_MAX_POLL_MS = 1000
+# Mean grey-level change (0-255) below which a poll reuses the last landmarks.
+FRAME_CHANGE_THRESHOLD = float(os.environ.get('FRAME_CHANGE_THRESHOLD', '2.0'))
+# Admission control before frames are decoded (game/admission.py): at most
+# ADMISSION_MAX_IN_FLIGHT frame requests per process, the last
+# ADMISSION_ROUND_RESERVE of them only for frames that settle rounds, and each
+# session's annotation polls held to ANNOTATE_RATE a second (bursts of ANNOTATE_BURST).
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'True') == 'True'
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '16'))
+ADMISSION_ROUND_RESERVE = int(os.environ.get('ADMISSION_ROUND_RESERVE', '4'))
+ANNOTATE_RATE = float(os.environ.get('ANNOTATE_RATE', '10'))
+ANNOTATE_BURST = 3
+
+
 # ==============================================================================
 # PASSWORD AND INTERNATIONALIZATION
 # ==============================================================================